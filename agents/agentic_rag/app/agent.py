@@ -18,9 +18,12 @@ import os
 import google
 import vertexai
 from google.adk.agents import Agent
-from langchain_google_vertexai import VertexAIEmbeddings
 
-from {{cookiecutter.agent_directory}}.retrievers import get_compressor, get_retriever
+from {{cookiecutter.agent_directory}}.retrievers import (
+    get_compressor,
+    get_embedding,
+    get_retriever,
+)
 from {{cookiecutter.agent_directory}}.templates import format_docs
 
 EMBEDDING_MODEL = "text-embedding-005"
@@ -34,8 +37,8 @@ os.environ.setdefault("GOOGLE_CLOUD_LOCATION", LLM_LOCATION)
 os.environ.setdefault("GOOGLE_GENAI_USE_VERTEXAI", "True")
 
 vertexai.init(project=project_id, location=LOCATION)
-embedding = VertexAIEmbeddings(
-    project=project_id, location=LOCATION, model_name=EMBEDDING_MODEL
+embedding = get_embedding(
+    project_id=project_id, location=LOCATION, model_name=EMBEDDING_MODEL
 )
 
 {% if cookiecutter.datastore_type == "vertex_ai_search" %}
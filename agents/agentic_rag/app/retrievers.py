@@ -14,11 +14,147 @@
 # ruff: noqa
 # mypy: disable-error-code="no-untyped-def"
 
+import hashlib
+import math
 import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
 
 from unittest.mock import MagicMock
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+from langchain_core.embeddings import Embeddings
 from langchain_google_community.vertex_rank import VertexAIRank
 from langchain_google_vertexai import VertexAIEmbeddings
+from pydantic import BaseModel, Field, PrivateAttr
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=int(os.getenv("OFFLINE_EMBEDDING_CACHE_SIZE", "20000")))
+def _feature_vector(feature: str, seed: int, size: int) -> np.ndarray:
+    """Gaussian random vector seeded by a hash of the feature."""
+    digest = hashlib.blake2b(f"{seed}\0{feature}".encode(), digest_size=8).digest()
+    rng = np.random.default_rng(int.from_bytes(digest, "little"))
+    return rng.standard_normal(size, dtype=np.float32)
+
+
+class OfflineEmbeddings(BaseModel, Embeddings):
+    """
+    Deterministic local embeddings for benchmarking without Vertex AI.
+
+    Each word and word bigram is hashed to a seed for a Gaussian random
+    vector, and a text's embedding is the normalized, log-weighted sum of its
+    features' vectors, as in the offline backend of the ingestion scripts.
+    Texts that share words get similar vectors, so retrieval benchmarks stay
+    meaningful. Texts are embedded in requests of `batch_size`, and the
+    OFFLINE_EMBEDDING_* settings simulate per-request latency, throttling,
+    outages and a concurrency quota.
+    """
+
+    size: int = 768
+    seed: int = Field(default_factory=lambda: int(os.getenv("OFFLINE_EMBEDDING_SEED", "0")))
+    batch_size: int = 250
+    latency_ms: float = Field(
+        default_factory=lambda: float(os.getenv("OFFLINE_EMBEDDING_LATENCY_MS", "0"))
+    )
+    latency_per_text_ms: float = Field(
+        default_factory=lambda: float(
+            os.getenv("OFFLINE_EMBEDDING_LATENCY_PER_TEXT_MS", "0")
+        )
+    )
+    latency_jitter: float = Field(
+        default_factory=lambda: float(
+            os.getenv("OFFLINE_EMBEDDING_LATENCY_JITTER", "0.2")
+        )
+    )
+    throttle_rate: float = Field(
+        default_factory=lambda: float(os.getenv("OFFLINE_EMBEDDING_THROTTLE_RATE", "0"))
+    )
+    error_rate: float = Field(
+        default_factory=lambda: float(os.getenv("OFFLINE_EMBEDDING_ERROR_RATE", "0"))
+    )
+    max_concurrency: int = Field(
+        default_factory=lambda: int(os.getenv("OFFLINE_EMBEDDING_MAX_CONCURRENCY", "0"))
+    )
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _in_flight: int = PrivateAttr(default=0)
+
+    def embed_text(self, text: str) -> list[float]:
+        words = _WORD_PATTERN.findall(text.lower())
+        counts: dict[str, int] = {}
+        for i, word in enumerate(words):
+            counts[word] = counts.get(word, 0) + 1
+            if i:
+                bigram = f"{words[i - 1]} {word}"
+                counts[bigram] = counts.get(bigram, 0) + 1
+        if not counts:
+            counts[text] = 1
+
+        vector = np.zeros(self.size, dtype=np.float32)
+        for feature, count in counts.items():
+            vector += (1 + math.log(count)) * _feature_vector(
+                feature, self.seed, self.size
+            )
+        vector /= np.linalg.norm(vector) or 1.0
+        return vector.tolist()
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        """Embeds one request's texts, raising the errors being simulated."""
+        with self._lock:
+            roll = random.random()
+            if roll < self.throttle_rate:
+                raise api_exceptions.ResourceExhausted(
+                    "Quota exceeded for embedding requests (simulated)"
+                )
+            if roll < self.throttle_rate + self.error_rate:
+                raise api_exceptions.ServiceUnavailable(
+                    "The service is currently unavailable (simulated)"
+                )
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                raise api_exceptions.ResourceExhausted(
+                    f"Quota exceeded: more than {self.max_concurrency} "
+                    "concurrent requests (simulated)"
+                )
+            self._in_flight += 1
+        try:
+            latency_ms = self.latency_ms + self.latency_per_text_ms * len(texts)
+            if latency_ms > 0:
+                scale = random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+                time.sleep(max(0.0, latency_ms * scale) / 1000)
+            return [self.embed_text(text) for text in texts]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        embeddings: list[list[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._request(texts[start : start + self.batch_size]))
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._request([text])[0]
+
+
+def get_embedding(project_id: str, location: str, model_name: str) -> Embeddings:
+    """
+    Creates and returns the embedding model.
+
+    Uses OfflineEmbeddings if the EMBEDDING_BACKEND environment variable is set
+    to "offline", otherwise the Vertex AI embedding model.
+    """
+    if os.getenv("EMBEDDING_BACKEND", "vertexai").lower() == "offline":
+        return OfflineEmbeddings()
+    return VertexAIEmbeddings(
+        project=project_id, location=location, model_name=model_name
+    )
+
+
 {% if cookiecutter.datastore_type == "vertex_ai_search" -%}
 from langchain_google_community import VertexAISearchRetriever
 
@@ -27,7 +163,7 @@ def get_retriever(
     project_id: str,
     data_store_id: str,
     data_store_region: str,
-    embedding: VertexAIEmbeddings,
+    embedding: Embeddings,
     embedding_column: str = "embedding",
     max_documents: int = 10,
     custom_embedding_ratio: float = 0.5,
@@ -76,7 +212,7 @@ def get_retriever(
     vector_search_bucket: str,
     vector_search_index: str,
     vector_search_index_endpoint: str,
-    embedding: VertexAIEmbeddings,
+    embedding: Embeddings,
 ) -> VectorStoreRetriever:
     """
     Creates and returns an instance of the retriever service.
@@ -14,7 +14,7 @@
 
 # mypy: disable-error-code="union-attr"
 from langchain_core.messages import BaseMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import tool
 from langchain_google_vertexai import ChatVertexAI
 from langgraph.graph import END, MessagesState, StateGraph
@@ -42,6 +42,21 @@ llm = ChatVertexAI(
 
 
 # 3. Define workflow components
+SYSTEM_MESSAGE = (
+    "You are an expert Lead Software Engineer Manager.\n"
+    "Your role is to speak to a user and understand what kind of code they need to "
+    "build.\n"
+    "Part of your task is therefore to gather requirements and clarifying ambiguity "
+    "by asking followup questions. Don't ask all the questions together as the user "
+    "has a low attention span, rather ask a question at the time.\n"
+    "Once the problem to solve is clear, you will call your tool for writing the "
+    "solution.\n"
+    "Remember, you are an expert in understanding requirements but you cannot code, "
+    "use your coding tool to generate a solution. Keep the test cases if any, they "
+    "are useful for the user."
+)
+
+
 def should_continue(state: MessagesState) -> str:
     """Determines whether to use the crew or end the conversation."""
     last_message = state["messages"][-1]
@@ -50,21 +65,7 @@ def should_continue(state: MessagesState) -> str:
 
 def call_model(state: MessagesState, config: RunnableConfig) -> dict[str, BaseMessage]:
     """Calls the language model and returns the response."""
-    system_message = (
-        "You are an expert Lead Software Engineer Manager.\n"
-        "Your role is to speak to a user and understand what kind of code they need to "
-        "build.\n"
-        "Part of your task is therefore to gather requirements and clarifying ambiguity "
-        "by asking followup questions. Don't ask all the questions together as the user "
-        "has a low attention span, rather ask a question at the time.\n"
-        "Once the problem to solve is clear, you will call your tool for writing the "
-        "solution.\n"
-        "Remember, you are an expert in understanding requirements but you cannot code, "
-        "use your coding tool to generate a solution. Keep the test cases if any, they "
-        "are useful for the user."
-    )
-
-    messages_with_system = [{"type": "system", "content": system_message}] + state[
+    messages_with_system = [{"type": "system", "content": SYSTEM_MESSAGE}] + state[
         "messages"
     ]
     # Forward the RunnableConfig object to ensure the agent is capable of streaming the response.
@@ -72,9 +73,20 @@ def call_model(state: MessagesState, config: RunnableConfig) -> dict[str, BaseMe
     return {"messages": response}
 
 
+async def acall_model(
+    state: MessagesState, config: RunnableConfig
+) -> dict[str, BaseMessage]:
+    """Async version of call_model, used when the agent is run with astream."""
+    messages_with_system = [{"type": "system", "content": SYSTEM_MESSAGE}] + state[
+        "messages"
+    ]
+    response = await llm.ainvoke(messages_with_system, config)
+    return {"messages": response}
+
+
 # 4. Create the workflow graph
 workflow = StateGraph(MessagesState)
-workflow.add_node("agent", call_model)
+workflow.add_node("agent", RunnableLambda(call_model, afunc=acall_model))
 workflow.add_node("dev_crew", ToolNode(tools))
 workflow.set_entry_point("agent")
 
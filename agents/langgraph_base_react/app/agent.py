@@ -14,7 +14,7 @@
 
 # mypy: disable-error-code="union-attr"
 from langchain_core.messages import BaseMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import tool
 from langchain_google_vertexai import ChatVertexAI
 from langgraph.graph import END, MessagesState, StateGraph
@@ -42,6 +42,9 @@ llm = ChatVertexAI(
 
 
 # 3. Define workflow components
+SYSTEM_MESSAGE = "You are a helpful AI assistant."
+
+
 def should_continue(state: MessagesState) -> str:
     """Determines whether to use tools or end the conversation."""
     last_message = state["messages"][-1]
@@ -50,8 +53,7 @@ def should_continue(state: MessagesState) -> str:
 
 def call_model(state: MessagesState, config: RunnableConfig) -> dict[str, BaseMessage]:
     """Calls the language model and returns the response."""
-    system_message = "You are a helpful AI assistant."
-    messages_with_system = [{"type": "system", "content": system_message}] + state[
+    messages_with_system = [{"type": "system", "content": SYSTEM_MESSAGE}] + state[
         "messages"
     ]
     # Forward the RunnableConfig object to ensure the agent is capable of streaming the response.
@@ -59,9 +61,20 @@ def call_model(state: MessagesState, config: RunnableConfig) -> dict[str, BaseMe
     return {"messages": response}
 
 
+async def acall_model(
+    state: MessagesState, config: RunnableConfig
+) -> dict[str, BaseMessage]:
+    """Async version of call_model, used when the agent is run with astream."""
+    messages_with_system = [{"type": "system", "content": SYSTEM_MESSAGE}] + state[
+        "messages"
+    ]
+    response = await llm.ainvoke(messages_with_system, config)
+    return {"messages": response}
+
+
 # 4. Create the workflow graph
 workflow = StateGraph(MessagesState)
-workflow.add_node("agent", call_model)
+workflow.add_node("agent", RunnableLambda(call_model, afunc=acall_model))
 workflow.add_node("tools", ToolNode(tools))
 workflow.set_entry_point("agent")
 
@@ -1,6 +1,7 @@
 # app/agent.py
 
 import os
+import time
 import vertexai
 import google.auth
 from vertexai.generative_models import GenerativeModel, Part
@@ -54,12 +55,19 @@ Goal: To be a collaborative technical co-pilot and a strategic sounding board fo
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 INDEX_ID = os.environ.get("INDEX_ID")
 ENDPOINT_ID = os.environ.get("INDEX_ENDPOINT_ID")
+# Used when the endpoint has no ACTIVE_DEPLOYED_INDEX_LABEL, i.e. when the index
+# was deployed by indexing.py rather than by index_lifecycle.py.
 DEPLOYED_INDEX_ID = os.environ.get("DEPLOYED_INDEX_ID")
 LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION")
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME")
 MODEL_NAME = os.environ.get("MODEL_NAME")
 
-if not all([PROJECT_ID, INDEX_ID, ENDPOINT_ID, DEPLOYED_INDEX_ID, LOCATION, EMBEDDING_MODEL_NAME, MODEL_NAME]):
+# index_lifecycle.py points this endpoint label at the deployed index serving
+# traffic; it is re-read every DEPLOYED_INDEX_REFRESH_SECONDS.
+ACTIVE_DEPLOYED_INDEX_LABEL = "active-deployed-index"
+DEPLOYED_INDEX_REFRESH_SECONDS = float(os.environ.get("DEPLOYED_INDEX_REFRESH_SECONDS", 60))
+
+if not all([PROJECT_ID, INDEX_ID, ENDPOINT_ID, LOCATION, EMBEDDING_MODEL_NAME, MODEL_NAME]):
     raise ValueError("One or more required environment variables are not set. Please check your .env file.")
 
 # --- Vector Search Tool ---
@@ -95,13 +103,41 @@ class VectorSearchTool(FunctionTool):
         self.endpoint_name = (
             f"projects/{PROJECT_ID}/locations/{LOCATION}/indexEndpoints/{ENDPOINT_ID}"
         )
+        self._deployed_index_id = None
+        self._resolved_at = float("-inf")
+        self.deployed_index_id()
+
+    def deployed_index_id(self) -> str:
+        """
+        The deployed index serving traffic, from the endpoint label set by
+        index_lifecycle.py (or DEPLOYED_INDEX_ID without one). The label is
+        re-read every DEPLOYED_INDEX_REFRESH_SECONDS so traffic switches and
+        rollbacks take effect without a restart.
+        """
+        if time.monotonic() - self._resolved_at < DEPLOYED_INDEX_REFRESH_SECONDS:
+            return self._deployed_index_id
+        try:
+            labels = self.client.get_index_endpoint(name=self.endpoint_name).labels
+        except Exception as e:
+            if self._deployed_index_id is None:
+                raise
+            print(f"Could not refresh the deployed index, keeping '{self._deployed_index_id}': {e}")
+            labels = {ACTIVE_DEPLOYED_INDEX_LABEL: self._deployed_index_id}
+        deployed_index_id = labels.get(ACTIVE_DEPLOYED_INDEX_LABEL) or DEPLOYED_INDEX_ID
+        if not deployed_index_id:
+            raise ValueError(
+                f"The endpoint has no '{ACTIVE_DEPLOYED_INDEX_LABEL}' label and DEPLOYED_INDEX_ID is not set."
+            )
+        self._deployed_index_id = deployed_index_id
+        self._resolved_at = time.monotonic()
+        return deployed_index_id
 
     def execute(self, query: str):
         query_embedding = self.embedding_model.get_embeddings([query])[0].values
         
         request = FindNeighborsRequest(
             index_endpoint=self.endpoint_name,
-            deployed_index_id=DEPLOYED_INDEX_ID,
+            deployed_index_id=self.deployed_index_id(),
             queries=[
                 FindNeighborsRequest.Query(
                     query_vector=query_embedding,
@@ -0,0 +1,157 @@
+# app/batching.py
+
+"""
+Token-aware adaptive batching for embedding requests.
+
+Texts are packed into the largest batches that fit under the embedding API's
+per-request instance and token limits, using a local token estimate. When the
+API rejects a batch as too large, the batch is split in half and retried and
+the limits shrink. After a run of successful requests they grow back towards
+the model maximums.
+"""
+
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TypeVar
+import math
+import os
+import threading
+
+from google.api_core import exceptions as api_exceptions
+
+T = TypeVar("T")
+
+# --- Configuration ---
+# Vertex AI text embedding models accept up to 250 texts and 20,000 tokens per
+# request, and truncate each text to 2,048 tokens.
+EMBEDDING_MAX_BATCH_INSTANCES = int(os.environ.get("EMBEDDING_MAX_BATCH_INSTANCES", 250))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.environ.get("EMBEDDING_MAX_BATCH_TOKENS", 20000))
+EMBEDDING_MAX_INPUT_TOKENS = int(os.environ.get("EMBEDDING_MAX_INPUT_TOKENS", 2048))
+
+# Characters per token used for the local estimate. Real text averages about
+# four, so three leaves headroom for code and non-English content.
+CHARS_PER_TOKEN = float(os.environ.get("EMBEDDING_CHARS_PER_TOKEN", 3))
+
+# Consecutive successful requests before the limits are raised again.
+GROW_AFTER_SUCCESSES = int(os.environ.get("EMBEDDING_GROW_AFTER_SUCCESSES", 5))
+GROWTH_FACTOR = 1.25
+
+# InvalidArgument is also returned for malformed requests, so the message has
+# to say the request was too large for the batch to be split.
+_SIZE_ERROR_MARKERS = (
+    "token",
+    "too many",
+    "too large",
+    "exceed",
+    "instances",
+    "payload",
+    "request size",
+)
+
+
+def estimate_tokens(text: str, max_input_tokens: int = EMBEDDING_MAX_INPUT_TOKENS) -> int:
+    """Estimates the token count of `text` as the API will see it."""
+    return min(max(1, math.ceil(len(text) / CHARS_PER_TOKEN)), max_input_tokens)
+
+
+def is_batch_size_error(error: Exception) -> bool:
+    """True for errors caused by a request being too large, as opposed to quota or outages."""
+    if not isinstance(error, api_exceptions.InvalidArgument):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in _SIZE_ERROR_MARKERS)
+
+
+class AdaptiveBatcher:
+    """Packs texts into request-sized batches and adapts the limits to API feedback."""
+
+    def __init__(
+        self,
+        max_instances: int = EMBEDDING_MAX_BATCH_INSTANCES,
+        max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        grow_after: int = GROW_AFTER_SUCCESSES,
+    ):
+        self.max_instances = max_instances
+        self.max_tokens = max_tokens
+        self.grow_after = grow_after
+        self.instance_limit = max_instances
+        self.token_limit = max_tokens
+        self._successes = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.splits = 0
+
+    def batches(
+        self, items: Iterable[T], text: Callable[[T], Optional[str]] = lambda item: item
+    ) -> Iterator[List[T]]:
+        """
+        Lazily groups `items` into batches under the current limits. The limits
+        are read for every batch, so they follow shrink/grow decisions made
+        while earlier batches were being embedded. Items whose `text` is None
+        (for example cache hits) are not sent, so they do not count against
+        the limits, but a batch never holds more than four requests' worth.
+        """
+        batch: List[T] = []
+        batch_texts = 0
+        batch_tokens = 0
+        for item in items:
+            item_text = text(item)
+            tokens = 0 if item_text is None else estimate_tokens(item_text)
+            request_full = item_text is not None and (
+                batch_texts >= self.instance_limit or batch_tokens + tokens > self.token_limit
+            )
+            if batch and (request_full or len(batch) >= 4 * self.max_instances):
+                yield batch
+                batch, batch_texts, batch_tokens = [], 0, 0
+            batch.append(item)
+            if item_text is not None:
+                batch_texts += 1
+                batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed(self, texts: List[str], request: Callable[[List[str]], List[Any]]) -> List[Any]:
+        """
+        Calls `request(texts)`. If the API rejects the batch as too large it is
+        split in half, each half is embedded, and the limits shrink. Results are
+        returned in the order of `texts`.
+        """
+        with self._lock:
+            self.requests += 1
+        try:
+            results = request(texts)
+        except Exception as e:
+            if len(texts) <= 1 or not is_batch_size_error(e):
+                raise
+            self._shrink(texts)
+            middle = len(texts) // 2
+            return self.embed(texts[:middle], request) + self.embed(texts[middle:], request)
+        self._record_success()
+        return results
+
+    def _shrink(self, texts: List[str]) -> None:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        with self._lock:
+            self.splits += 1
+            self._successes = 0
+            self.instance_limit = max(1, min(self.instance_limit, len(texts) // 2))
+            self.token_limit = max(1, min(self.token_limit, tokens // 2))
+        print(
+            f"Batch of {len(texts)} texts was too large. Shrinking limits to "
+            f"{self.instance_limit} texts / {self.token_limit} tokens."
+        )
+
+    def _record_success(self) -> None:
+        with self._lock:
+            self._successes += 1
+            if self._successes < self.grow_after:
+                return
+            self._successes = 0
+            self.instance_limit = min(
+                self.max_instances, math.ceil(self.instance_limit * GROWTH_FACTOR)
+            )
+            self.token_limit = min(self.max_tokens, math.ceil(self.token_limit * GROWTH_FACTOR))
+
+    def summary(self) -> str:
+        return (
+            f"{self.requests} requests, {self.splits} batch splits, final limits "
+            f"{self.instance_limit} texts / {self.token_limit} tokens per request"
+        )
@@ -0,0 +1,159 @@
+# app/checkpoint.py
+
+"""
+Crash-safe checkpointing for the ingestion scripts.
+
+A checkpoint is an append-only JSONL manifest written next to a stage's
+output file. Every committed unit of work adds one record with the ids it
+completed and the byte offsets reached in the output (and input) file. On
+resume the output is truncated back to the last committed offset, so a
+partially written batch is never kept, and completed ids are skipped.
+A stage that seeks into its input also records which input file the
+offsets belong to, and refuses to resume against a different one.
+
+Items that still fail after retries are written to a dead-letter file so
+they can be retried later instead of being dropped. An item can be written
+there twice if a run crashes after dead-lettering a batch but before
+committing it, so the file is deduplicated by id when read.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import time
+
+
+def _append_durably(path: str, record: Dict[str, Any]) -> None:
+    with open(path, "ab") as f:
+        f.write((json.dumps(record) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def file_fingerprint(path: str) -> Dict[str, Any]:
+    """Identifies a file by its path, size and modification time."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class Checkpoint:
+    """Append-only manifest of the work committed to a stage's output file."""
+
+    def __init__(self, manifest_path: str):
+        self.path = manifest_path
+        self.completed_ids: set = set()
+        self.output_offset = 0
+        self.input_offset = 0
+        self.input: Optional[Dict[str, Any]] = None
+
+    def load(self) -> bool:
+        """Loads the manifest. Returns False if there is nothing to resume from."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final record from a crash mid-write is ignored.
+                    break
+                if "input" in record:
+                    self.input = record["input"]
+                    continue
+                self.completed_ids.update(record["ids"])
+                self.output_offset = record["output_offset"]
+                self.input_offset = record.get("input_offset") or self.input_offset
+        return True
+
+    def reset(self) -> None:
+        """Starts a fresh manifest."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.completed_ids = set()
+        self.output_offset = 0
+        self.input_offset = 0
+        self.input = None
+
+    def bind_input(self, input_path: str) -> None:
+        """Records the input file that committed input offsets refer to."""
+        self.input = file_fingerprint(input_path)
+        _append_durably(self.path, {"input": self.input})
+
+    def matches_input(self, input_path: str) -> bool:
+        """Whether `input_path` is the unchanged file this checkpoint was made from."""
+        return self.input is not None and self.input == file_fingerprint(input_path)
+
+    def commit(
+        self, ids: List[str], output_offset: int, input_offset: Optional[int] = None
+    ) -> None:
+        """
+        Records that `ids` are durably written up to `output_offset`. Call this
+        only after the output file has been fsynced.
+        """
+        record = {"ids": ids, "output_offset": output_offset, "committed_at": time.time()}
+        if input_offset is not None:
+            record["input_offset"] = input_offset
+        _append_durably(self.path, record)
+        self.completed_ids.update(ids)
+        self.output_offset = output_offset
+        if input_offset is not None:
+            self.input_offset = input_offset
+
+
+def truncate_to_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    """Drops anything written to `path` after the last committed offset."""
+    if os.path.exists(path) and os.path.getsize(path) > checkpoint.output_offset:
+        with open(path, "r+b") as f:
+            f.truncate(checkpoint.output_offset)
+
+
+def iter_jsonl_with_offsets(path: str, start_offset: int = 0) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """Yields (item, offset after the item's line) from a JSONL file."""
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for line in f:
+            offset += len(line)
+            yield json.loads(line), offset
+
+
+class DeadLetterFile:
+    """JSONL file of items that failed processing, kept for a later retry."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def add(self, items: Iterable[Dict[str, Any]], error: Exception) -> None:
+        failed_at = time.time()
+        with open(self.path, "ab") as f:
+            for item in items:
+                entry = {"item": item, "error": str(error), "failed_at": failed_at}
+                f.write((json.dumps(entry) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Returns the latest entry for each failed item, in first-failure order."""
+        if not os.path.exists(self.path):
+            return []
+        entries: Dict[Any, Dict[str, Any]] = {}
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["item"]["id"]] = entry
+        return list(entries.values())
+
+    def replace(self, entries: List[Dict[str, Any]]) -> None:
+        """Atomically replaces the file contents with `entries`."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def reset(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,276 @@
+# app/chunk_io.py
+
+"""
+Reading and writing the chunk files exchanged by the ingestion scripts.
+
+Chunks are stored as JSONL by default. Setting DATA_FORMAT=parquet switches
+every stage to Parquet files instead, where embeddings are stored in a
+fixed-size-list float32 column and rows are written in row groups. Parquet
+support needs `pyarrow`, which is only imported when that format is used.
+"""
+
+from typing import Any, Dict, IO, Iterable, Iterator, List, NamedTuple, Optional
+import json
+import os
+
+import numpy as np
+
+# --- Configuration ---
+# "jsonl" (default) or "parquet".
+DATA_FORMAT = os.environ.get("DATA_FORMAT", "jsonl").lower()
+
+# Rows buffered before a Parquet row group is flushed to disk.
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", 10000))
+# Rows per record batch when streaming a Parquet file back.
+PARQUET_READ_BATCH_SIZE = int(os.environ.get("PARQUET_READ_BATCH_SIZE", 1000))
+
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 768))
+
+
+def data_file(stem: str, data_format: str = DATA_FORMAT) -> str:
+    """Returns the file name for a stage output, e.g. 'embedded_data.jsonl'."""
+    return f"{stem}.{'parquet' if data_format == 'parquet' else 'jsonl'}"
+
+
+def is_parquet(path: str) -> bool:
+    return path.endswith(".parquet")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("DATA_FORMAT=parquet requires the 'pyarrow' package.") from e
+    return pyarrow
+
+
+def _arrow_schema(pa, rows: List[Dict[str, Any]], embedding_dimensions: int):
+    """Known chunk fields get fixed types, anything else is inferred from `rows`."""
+    known = {
+        "id": pa.string(),
+        "text": pa.string(),
+        "source": pa.string(),
+        "title": pa.string(),
+        "sources": pa.list_(pa.string()),
+        "duplicate_ids": pa.list_(pa.string()),
+        "embedding": pa.list_(pa.float32(), embedding_dimensions),
+    }
+    names: List[str] = []
+    for row in rows:
+        names.extend(name for name in row if name not in names)
+
+    fields = []
+    for name in names:
+        if name in known:
+            fields.append(pa.field(name, known[name]))
+        else:
+            values = pa.array([row.get(name) for row in rows])
+            fields.append(pa.field(name, values.type))
+    return pa.schema(fields)
+
+
+class ChunkWriter:
+    """Writes chunk dicts to a JSONL or Parquet file, chosen by extension."""
+
+    def __init__(
+        self,
+        path: str,
+        embedding_dimensions: int = EMBEDDING_DIMENSIONS,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+        append: bool = False,
+    ):
+        if append and is_parquet(path):
+            raise ValueError("Appending is only supported for JSONL files.")
+        self.path = path
+        self.embedding_dimensions = embedding_dimensions
+        self.row_group_size = row_group_size
+        self._rows: List[Dict[str, Any]] = []
+        self._parquet_writer = None
+        self._schema = None
+        self._file: Optional[IO[bytes]] = (
+            None if is_parquet(path) else open(path, "ab" if append else "wb")
+        )
+
+    def write(self, item: Dict[str, Any]) -> None:
+        if self._file is not None:
+            self._file.write((json.dumps(item) + "\n").encode("utf-8"))
+            return
+        self._rows.append(item)
+        if len(self._rows) >= self.row_group_size:
+            self._flush_row_group()
+
+    def write_many(self, items: Iterable[Dict[str, Any]]) -> None:
+        for item in items:
+            self.write(item)
+
+    def flush(self) -> None:
+        """Pushes buffered rows to disk. Parquet rows become a row group."""
+        if self._file is not None:
+            self._file.flush()
+        elif self._rows:
+            self._flush_row_group()
+
+    def sync(self) -> None:
+        """Flushes and fsyncs a JSONL file so everything written survives a crash."""
+        self.flush()
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def tell(self) -> int:
+        """Returns the byte offset of the end of a JSONL file."""
+        if self._file is None:
+            raise ValueError("Byte offsets are only available for JSONL files.")
+        return self._file.tell()
+
+    def _flush_row_group(self) -> None:
+        pa = _pyarrow()
+        if self._parquet_writer is None:
+            self._schema = _arrow_schema(pa, self._rows, self.embedding_dimensions)
+            self._parquet_writer = pa.parquet.ParquetWriter(self.path, self._schema)
+
+        columns = []
+        for field in self._schema:
+            if field.name == "embedding":
+                flat = np.asarray(
+                    [row["embedding"] for row in self._rows], dtype=np.float32
+                ).reshape(-1)
+                columns.append(
+                    pa.FixedSizeListArray.from_arrays(flat, self.embedding_dimensions)
+                )
+            else:
+                columns.append(
+                    pa.array([row.get(field.name) for row in self._rows], type=field.type)
+                )
+        batch = pa.RecordBatch.from_arrays(columns, schema=self._schema)
+        self._parquet_writer.write_table(
+            pa.Table.from_batches([batch]), row_group_size=len(self._rows)
+        )
+        self._rows = []
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            return
+        if self._rows:
+            self._flush_row_group()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        else:
+            # No rows were written, but downstream stages still expect a file.
+            pa = _pyarrow()
+            pa.parquet.write_table(pa.table({}), self.path)
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def iter_record_batches(path: str, batch_size: int = PARQUET_READ_BATCH_SIZE):
+    """Streams a Parquet chunk file as pyarrow RecordBatches."""
+    pa = _pyarrow()
+    return pa.parquet.ParquetFile(path).iter_batches(batch_size=batch_size)
+
+
+def _embeddings_as_lists(batch) -> Optional[List[List[float]]]:
+    if "embedding" not in batch.schema.names:
+        return None
+    column = batch.column("embedding")
+    dimensions = column.type.list_size
+    return column.flatten().to_numpy().reshape(-1, dimensions).tolist()
+
+
+def read_chunks(path: str, batch_size: int = PARQUET_READ_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yields chunk dicts from a JSONL or Parquet file, one at a time."""
+    if not is_parquet(path):
+        with open(path, "r") as infile:
+            for line in infile:
+                yield json.loads(line)
+        return
+
+    for batch in iter_record_batches(path, batch_size):
+        embeddings = _embeddings_as_lists(batch)
+        columns = {
+            name: batch.column(name).to_pylist()
+            for name in batch.schema.names
+            if name != "embedding"
+        }
+        for i in range(batch.num_rows):
+            item = {name: values[i] for name, values in columns.items()}
+            if embeddings is not None:
+                item["embedding"] = embeddings[i]
+            yield item
+
+
+def write_vector_search_json(path: str, outfile: IO[str]) -> int:
+    """
+    Writes the chunks in `path` to `outfile` in the newline-delimited JSON
+    format read by Vector Search. Parquet files are converted batch by batch,
+    so `outfile` can be a GCS blob stream. Returns the number of records.
+    """
+    count = 0
+    for item in read_chunks(path):
+        outfile.write(json.dumps(item) + "\n")
+        count += 1
+    return count
+
+
+class Shard(NamedTuple):
+    """A Vector Search JSON shard: `size` bytes of `path` starting at `offset`."""
+
+    name: str
+    path: str
+    offset: int
+    size: int
+    # The shard was written to a file of its own, which the caller deletes.
+    temporary: bool
+
+
+def iter_vector_search_shards(path: str, tmp_dir: str, max_shard_bytes: int) -> Iterator[Shard]:
+    """
+    Splits the chunks in `path` into Vector Search JSON shards of at most
+    `max_shard_bytes` each (a single larger record gets a shard to itself)
+    and yields each one as soon as it is complete, so uploads can start
+    while the rest of the file is still being split.
+
+    JSONL shards are byte ranges of `path` itself and nothing is copied.
+    Parquet shards are converted into files in `tmp_dir`, one at a time.
+
+    Shard boundaries are positional: an unchanged file gives byte-identical
+    shards, and an append leaves every shard but the last one untouched, but
+    editing or removing a record shifts the contents of every later shard.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if not is_parquet(path):
+        with open(path, "rb") as infile:
+            count = start = end = 0
+            for line in infile:
+                if end > start and end + len(line) - start > max_shard_bytes:
+                    yield Shard(f"{stem}-{count:05d}.json", path, start, end - start, False)
+                    count, start = count + 1, end
+                end += len(line)
+            if end > start:
+                yield Shard(f"{stem}-{count:05d}.json", path, start, end - start, False)
+        return
+
+    count = 0
+    shard: Optional[IO[bytes]] = None
+    try:
+        for item in read_chunks(path):
+            line = (json.dumps(item) + "\n").encode("utf-8")
+            if shard is not None and shard.tell() and shard.tell() + len(line) > max_shard_bytes:
+                shard.close()
+                yield Shard(os.path.basename(shard.name), shard.name, 0, os.path.getsize(shard.name), True)
+                shard, count = None, count + 1
+            if shard is None:
+                shard = open(os.path.join(tmp_dir, f"{stem}-{count:05d}.json"), "wb")
+            shard.write(line)
+        if shard is not None:
+            shard.close()
+            yield Shard(os.path.basename(shard.name), shard.name, 0, os.path.getsize(shard.name), True)
+            shard = None
+    finally:
+        if shard is not None:
+            shard.close()
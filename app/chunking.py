@@ -0,0 +1,181 @@
+# app/chunking.py
+
+"""
+Process-pool chunking stage for the ingestion pipeline.
+
+Splitting large documents with RecursiveCharacterTextSplitter is CPU-bound, so
+this module moves it out of the fetch loop and onto a pool of worker processes.
+Results are yielded in the same order the documents were submitted.
+Workers are started with CHUNKING_START_METHOD ("forkserver" where available)
+rather than by forking the caller, which may be running other threads (e.g.
+the stages of streaming_pipeline.py) that hold locks or gRPC clients.
+
+Run this file directly to benchmark chunking throughput on a synthetic corpus:
+
+    python app/chunking.py --corpus-mb 2048 --workers 16
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# --- Configuration ---
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 100))
+
+# Number of worker processes used for splitting. Defaults to every core.
+CHUNKING_WORKERS = int(os.environ.get("CHUNKING_WORKERS", os.cpu_count() or 1))
+
+# Documents in flight per worker. Bounds memory while keeping workers busy.
+CHUNKING_PREFETCH = int(os.environ.get("CHUNKING_PREFETCH", 2))
+
+# How worker processes are started. Forking a multi-threaded process can deadlock.
+CHUNKING_START_METHOD = os.environ.get(
+    "CHUNKING_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+
+# The splitter is built once per worker process by _init_worker().
+_worker_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+
+def _make_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int) -> None:
+    """Builds the text splitter once per worker process."""
+    global _worker_splitter
+    _worker_splitter = _make_splitter(chunk_size, chunk_overlap)
+
+
+def _split_text(text: str) -> List[str]:
+    """Splits text into chunks with the worker's splitter."""
+    return _worker_splitter.split_text(text)
+
+
+def chunk_documents(
+    documents: Iterable[Dict[str, Any]],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    max_workers: int = CHUNKING_WORKERS,
+    prefetch: int = CHUNKING_PREFETCH,
+) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
+    """
+    Splits the "text" of each document into chunks on a process pool.
+
+    Documents are pulled lazily from `documents`, so a generator that fetches
+    pages keeps fetching while earlier documents are being split. Results are
+    yielded as (document, chunks) pairs in input order, regardless of which
+    worker finishes first. With `max_workers` <= 1 the split runs in-process.
+    """
+    if max_workers <= 1:
+        splitter = _make_splitter(chunk_size, chunk_overlap)
+        for document in documents:
+            yield document, splitter.split_text(document["text"])
+        return
+
+    window = max(1, max_workers * prefetch)
+    pending: deque = deque()
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(CHUNKING_START_METHOD),
+        initializer=_init_worker,
+        initargs=(chunk_size, chunk_overlap),
+    ) as executor:
+        try:
+            for document in documents:
+                future = executor.submit(_split_text, document["text"])
+                pending.append((document, future))
+
+                # Yield the oldest result once the in-flight window is full.
+                if len(pending) >= window:
+                    yield _pop_result(pending)
+
+            while pending:
+                yield _pop_result(pending)
+        finally:
+            # Reached on errors or if the consumer stops early.
+            for _, future in pending:
+                future.cancel()
+
+
+def _pop_result(pending: deque) -> Tuple[Dict[str, Any], List[str]]:
+    document, future = pending.popleft()
+    return document, future.result()
+
+
+# --- Benchmark ---
+
+_WORDS = (
+    "agent vertex index embedding search vector pipeline retrieval model "
+    "google cloud deploy endpoint chunk token latency throughput query"
+).split()
+
+
+def synthetic_corpus(total_mb: int, doc_kb: int = 512, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """Lazily generates a deterministic corpus of roughly `total_mb` megabytes."""
+    rng = random.Random(seed)
+    target = total_mb * 1024 * 1024
+    produced = 0
+    doc_id = 0
+    while produced < target:
+        paragraphs = []
+        size = 0
+        while size < doc_kb * 1024:
+            sentence = " ".join(rng.choices(_WORDS, k=rng.randint(8, 24))) + "."
+            paragraphs.append(sentence if rng.random() > 0.1 else sentence + "\n\n")
+            size += len(sentence) + 1
+        text = " ".join(paragraphs)
+        produced += len(text)
+        yield {"source": f"synthetic://{doc_id}", "title": "synthetic", "text": text}
+        doc_id += 1
+
+
+def run_benchmark(total_mb: int, doc_kb: int, workers: List[int]) -> None:
+    """Prints chunking throughput for each worker count on the same corpus."""
+    print(f"Chunking benchmark: {total_mb} MB corpus, {doc_kb} KB documents.")
+    baseline = None
+    for max_workers in workers:
+        total_bytes = 0
+        total_chunks = 0
+        start = time.perf_counter()
+        for document, chunks in chunk_documents(
+            synthetic_corpus(total_mb, doc_kb), max_workers=max_workers
+        ):
+            total_bytes += len(document["text"])
+            total_chunks += len(chunks)
+        elapsed = time.perf_counter() - start
+        mb_per_s = total_bytes / (1024 * 1024) / elapsed
+        baseline = baseline or mb_per_s
+        print(
+            f"  - workers={max_workers:<3} {elapsed:8.2f}s  {mb_per_s:8.2f} MB/s  "
+            f"{total_chunks / elapsed:10.0f} chunks/s  speedup x{mb_per_s / baseline:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the chunking stage.")
+    parser.add_argument("--corpus-mb", type=int, default=2048, help="Synthetic corpus size in MB")
+    parser.add_argument("--doc-kb", type=int, default=512, help="Average document size in KB")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, CHUNKING_WORKERS],
+        help="Worker counts to compare",
+    )
+    args = parser.parse_args()
+    run_benchmark(args.corpus_mb, args.doc_kb, args.workers)
@@ -3,12 +3,15 @@
 import requests
 from bs4 import BeautifulSoup
 from youtube_transcript_api import YouTubeTranscriptApi
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from urllib.parse import urlparse
-import json
+import argparse
 import os
 import uuid
 
+from checkpoint import Checkpoint, truncate_to_checkpoint
+from chunk_io import ChunkWriter, data_file, is_parquet
+from chunking import CHUNKING_WORKERS, chunk_documents
+
 # --- Configuration ---
 URLS_TO_INGEST = [
     "https://github.com/GoogleCloudPlatform/agent-starter-pack",
@@ -44,7 +47,8 @@ URLS_TO_INGEST = [
 # Chunking parameters are now read from environment variables
 CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 1000))
 CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 100))
-INGESTED_DATA_FILE = "ingested_data.jsonl"
+INGESTED_DATA_FILE = data_file("ingested_data")
+CHECKPOINT_FILE = f"{INGESTED_DATA_FILE}.checkpoint"
 
 def get_youtube_transcript(url: str):
     """Fetches the transcript from a YouTube video URL."""
@@ -77,42 +81,78 @@ def get_github_repo_content(url: str):
     print(f"Skipping GitHub repository for now. We will handle this separately.")
     return None
 
-def ingest_urls(urls: list):
+def chunk_id(source: str, index: int) -> str:
+    """
+    Stable id for the `index`-th chunk of `source`. Re-ingesting a page gives
+    its chunks the same ids, so indexing.py can tell changed chunks from new ones.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{index}"))
+
+def fetch_documents(urls: list):
+    """
+    Fetches each URL and yields its content as a document with metadata.
+    """
+    for url in urls:
+        print(f"Ingesting content from: {url}")
+        domain = urlparse(url).netloc
+        content = None
+
+        if "youtube.com" in domain:
+            content = get_youtube_transcript(url)
+        elif "github.com" in domain:
+            content = get_github_repo_content(url)
+        else:
+            content = scrape_web_page(url)
+
+        if content:
+            yield {"text": content, "source": url, "title": domain}
+
+def ingest_urls(urls: list, resume: bool = False):
     """
     Ingests content from a list of URLs and returns chunks with metadata.
+    Fetching runs in this process while chunking runs on a process pool.
+
+    With JSONL output each finished URL is committed to a checkpoint manifest,
+    and `resume=True` skips URLs that were ingested by an interrupted run.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-    )
-    
-    with open(INGESTED_DATA_FILE, "w") as outfile:
-        for url in urls:
-            print(f"Ingesting content from: {url}")
-            domain = urlparse(url).netloc
-            content = None
-
-            if "youtube.com" in domain:
-                content = get_youtube_transcript(url)
-            elif "github.com" in domain:
-                content = get_github_repo_content(url)
-            else:
-                content = scrape_web_page(url)
-
-            if content:
-                chunks = text_splitter.split_text(content)
-                for chunk in chunks:
-                    chunk_with_metadata = {
-                        "id": str(uuid.uuid4()),
-                        "text": chunk,
-                        "source": url,
-                        "title": domain
-                    }
-                    outfile.write(json.dumps(chunk_with_metadata) + '\n')
-                print(f"  - Ingested {len(chunks)} chunks.")
+    checkpointing = not is_parquet(INGESTED_DATA_FILE)
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    if resume and checkpointing and checkpoint.load():
+        truncate_to_checkpoint(INGESTED_DATA_FILE, checkpoint)
+        urls = [url for url in urls if url not in checkpoint.completed_ids]
+        print(f"Resuming from checkpoint: {len(checkpoint.completed_ids)} URLs already ingested.")
+    else:
+        checkpoint.reset()
+        resume = False
+
+    with ChunkWriter(INGESTED_DATA_FILE, append=resume) as writer:
+        for document, chunks in chunk_documents(
+            fetch_documents(urls),
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            max_workers=CHUNKING_WORKERS,
+        ):
+            for index, chunk in enumerate(chunks):
+                chunk_with_metadata = {
+                    "id": chunk_id(document["source"], index),
+                    "text": chunk,
+                    "source": document["source"],
+                    "title": document["title"]
+                }
+                writer.write(chunk_with_metadata)
+            if checkpointing:
+                writer.sync()
+                checkpoint.commit([document["source"]], writer.tell())
+            print(f"  - Ingested {len(chunks)} chunks from {document['source']}.")
     
     print(f"\nSuccessfully ingested content and saved to {INGESTED_DATA_FILE}.")
 
 if __name__ == "__main__":
-    ingest_urls(URLS_TO_INGEST)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingest and chunk the configured URLs.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its checkpoint instead of starting over",
+    )
+    args = parser.parse_args()
+    ingest_urls(URLS_TO_INGEST, resume=args.resume)
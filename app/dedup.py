@@ -0,0 +1,215 @@
+# app/dedup.py
+
+"""
+Near-duplicate chunk elimination with MinHash LSH.
+
+Runs between data_ingestion.py and embedding.py. Each chunk is shingled into
+word n-grams and summarised by a MinHash signature. Signatures are split into
+LSH bands so that only chunks sharing a band are compared, and a chunk whose
+estimated Jaccard similarity to an earlier chunk is above the threshold is
+dropped. The earliest chunk of each group is kept, and the sources of the
+dropped chunks are merged into its metadata.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from chunk_io import ChunkWriter, data_file, read_chunks
+
+# --- Configuration ---
+INGESTED_DATA_FILE = data_file("ingested_data")
+DEDUPED_DATA_FILE = data_file("deduped_data")
+
+# Chunks at or above this estimated Jaccard similarity are treated as duplicates.
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8))
+# Number of MinHash permutations. More permutations give a tighter estimate.
+DEDUP_NUM_PERM = int(os.environ.get("DEDUP_NUM_PERM", 128))
+# Number of words per shingle.
+DEDUP_SHINGLE_SIZE = int(os.environ.get("DEDUP_SHINGLE_SIZE", 5))
+
+# Largest prime below 2**32. Keeps (a * h + b) inside uint64 for 32-bit hashes.
+_PRIME = np.uint64(4294967291)
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> set:
+    """Returns the set of lowercased word n-grams in `text`."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def candidate_probability(similarity: Any, bands: int, rows: int) -> Any:
+    """Probability that two chunks with this Jaccard similarity share a band."""
+    return 1 - (1 - np.power(similarity, rows)) ** bands
+
+
+def _area(y: np.ndarray, x: np.ndarray) -> float:
+    """Trapezoidal integral of y over x."""
+    return float(np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2)
+
+
+def optimal_bands(
+    threshold: float,
+    num_perm: int,
+    false_positive_weight: float = 0.05,
+    false_negative_weight: float = 0.95,
+) -> Tuple[int, int]:
+    """
+    Picks (bands, rows) with bands * rows <= num_perm minimising the weighted
+    false-positive and false-negative areas under the LSH S-curve, as
+    datasketch does. The area below `threshold` counts pairs compared for
+    nothing, the area above it counts duplicates that are never compared.
+
+    Every candidate is checked against the signature estimate, so a false
+    positive only costs a comparison while a false negative keeps a
+    duplicate. The default weights therefore put the S-curve below the
+    threshold: for 0.8 and 128 permutations they give 16 bands x 8 rows,
+    which makes ~95% of pairs at J=0.8 candidates.
+    """
+    below = np.linspace(0, threshold, 201)
+    above = np.linspace(threshold, 1, 201)
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = _area(candidate_probability(below, bands, rows), below)
+            false_negative = _area(1 - candidate_probability(above, bands, rows), above)
+            error = false_positive_weight * false_positive + false_negative_weight * false_negative
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+class MinHashDeduplicator:
+    """Streams chunks and decides, one by one, whether each is a near-duplicate."""
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = DEDUP_NUM_PERM,
+        shingle_size: int = DEDUP_SHINGLE_SIZE,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._signatures: List[np.ndarray] = []
+
+    def signature(self, text: str) -> np.ndarray:
+        """Computes the MinHash signature of `text` as a uint64 vector."""
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                for s in shingles(text, self.shingle_size)
+            ),
+            dtype=np.uint64,
+        )
+        return ((self._a * hashes[np.newaxis, :] + self._b) % _PRIME).min(axis=1)
+
+    def add(self, text: str) -> Optional[int]:
+        """
+        Registers a chunk. Returns the index of the representative chunk it
+        duplicates, or None if the chunk is new and becomes a representative.
+        Indices count representatives in the order they were added.
+        """
+        signature = self.signature(text)
+        band_keys = [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+        candidates = {
+            candidate
+            for band, key in enumerate(band_keys)
+            for candidate in self._buckets[band].get(key, ())
+        }
+        for candidate in sorted(candidates):
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= self.threshold:
+                return candidate
+
+        representative = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault(key, []).append(representative)
+        return None
+
+
+def find_duplicates(
+    items: Iterable[Dict[str, Any]], deduplicator: MinHashDeduplicator
+) -> Tuple[List[int], Dict[int, List[Dict[str, Any]]]]:
+    """
+    Returns the line numbers of representative chunks and, for each
+    representative line, the metadata of the chunks merged into it.
+    """
+    representative_lines: List[int] = []
+    merged: Dict[int, List[Dict[str, Any]]] = {}
+    for line_number, item in enumerate(items):
+        match = deduplicator.add(item["text"])
+        if match is None:
+            representative_lines.append(line_number)
+        else:
+            merged.setdefault(representative_lines[match], []).append(
+                {"id": item["id"], "source": item["source"]}
+            )
+    return representative_lines, merged
+
+
+def deduplicate_file(
+    input_file: str = INGESTED_DATA_FILE, output_file: str = DEDUPED_DATA_FILE
+) -> None:
+    """
+    Removes near-duplicate chunks from `input_file` and writes the
+    representatives, with merged source metadata, to `output_file`.
+    The input is read twice so only signatures are held in memory.
+    """
+    deduplicator = MinHashDeduplicator()
+    print(
+        f"Deduplicating chunks with threshold={deduplicator.threshold}, "
+        f"num_perm={deduplicator.num_perm} ({deduplicator.bands} bands x {deduplicator.rows} rows)."
+    )
+
+    representative_lines, merged = find_duplicates(read_chunks(input_file), deduplicator)
+
+    keep = set(representative_lines)
+    total = 0
+    with ChunkWriter(output_file) as writer:
+        for line_number, item in enumerate(read_chunks(input_file)):
+            total += 1
+            if line_number not in keep:
+                continue
+            duplicates = merged.get(line_number)
+            if duplicates:
+                sources = [item["source"]]
+                for duplicate in duplicates:
+                    if duplicate["source"] not in sources:
+                        sources.append(duplicate["source"])
+                item["sources"] = sources
+                item["duplicate_ids"] = [duplicate["id"] for duplicate in duplicates]
+            writer.write(item)
+
+    removed = total - len(representative_lines)
+    print(
+        f"Kept {len(representative_lines)} of {total} chunks, removed {removed} near-duplicates. "
+        f"'{output_file}' created."
+    )
+
+
+if __name__ == "__main__":
+    if not os.path.exists(INGESTED_DATA_FILE):
+        print(f"Error: The file '{INGESTED_DATA_FILE}' was not found. Please run data_ingestion.py first.")
+    else:
+        deduplicate_file()
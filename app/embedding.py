@@ -1,94 +1,281 @@
 # app/embedding.py
 
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
-import json
+import argparse
 import os
-import time
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple
+
+from batching import EMBEDDING_MAX_BATCH_INSTANCES, AdaptiveBatcher
+from checkpoint import Checkpoint, DeadLetterFile, iter_jsonl_with_offsets, truncate_to_checkpoint
+from chunk_io import ChunkWriter, data_file, is_parquet, read_chunks
+from embedding_backends import EmbeddingBackend, get_embedding_backend
+from embedding_cache import EMBEDDING_CACHE_FILE, EmbeddingCache
+from rate_control import RateController, ordered_map
 
 # --- Configuration ---
 # Your project and location are now read from environment variables
 PROJECT_ID = os.environ.get("PROJECT_ID", "vertex-ai-co-pilot")
 LOCATION = os.environ.get("REGION", "europe-west4")
 
-# The name of the embedding model to use.
+# The name of the embedding model to use. Set EMBEDDING_BACKEND=offline to
+# use deterministic local embeddings instead (see embedding_backends.py).
 EMBEDDING_MODEL_NAME = "text-embedding-004"
 
 # Names of the input and output files.
-INGESTED_DATA_FILE = "ingested_data.jsonl"
-EMBEDDED_DATA_FILE = "embedded_data.jsonl"
+INGESTED_DATA_FILE = data_file("ingested_data")
+DEDUPED_DATA_FILE = data_file("deduped_data")
+EMBEDDED_DATA_FILE = data_file("embedded_data")
+
+# Progress manifest for resuming, and the file where failed items are kept.
+CHECKPOINT_FILE = f"{EMBEDDED_DATA_FILE}.checkpoint"
+DEAD_LETTER_FILE = os.environ.get("DEAD_LETTER_FILE", "embedding_failures.jsonl")
+
+# The maximum number of texts per API request. Batches are packed by the
+# AdaptiveBatcher up to this count and the model's per-request token limit.
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", EMBEDDING_MAX_BATCH_INSTANCES))
 
-# The batch size for API requests to avoid rate limits.
-# A small batch size is good for testing and avoiding API quotas.
-EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 5))
+def get_embeddings_with_retry(
+    model: EmbeddingBackend, texts: List[str], controller: RateController
+) -> List[Any]:
+    """
+    Generates embeddings under the shared rate controller. Quota (429) and
+    transient server errors are retried with backoff and shrink the number of
+    concurrent requests; any other error is raised straight away.
+    """
+    return controller.call(lambda: model.get_embeddings(texts), items=len(texts))
 
-def get_embeddings_with_retry(model: TextEmbeddingModel, texts: List[str]) -> List[Any]:
+def resolve_input_file() -> str:
     """
-    Generates embeddings with exponential backoff for rate limit handling.
-    This function is crucial for robust API calls.
+    Returns the deduplicated chunks file if dedup.py has been run on the
+    latest ingested data, otherwise the ingested data file.
     """
-    delay = 1  # Initial delay in seconds
-    for _ in range(5):  # Retry up to 5 times
-        try:
-            return model.get_embeddings(texts)
-        except Exception as e:
-            print(f"Embedding request failed: {e}. Retrying in {delay}s...")
-            time.sleep(delay)
-            delay *= 2  # Double the delay for the next retry
-    raise Exception("Failed to get embeddings after multiple retries.")
-
-def generate_embeddings() -> None:
+    if os.path.exists(DEDUPED_DATA_FILE) and (
+        not os.path.exists(INGESTED_DATA_FILE)
+        or os.path.getmtime(DEDUPED_DATA_FILE) >= os.path.getmtime(INGESTED_DATA_FILE)
+    ):
+        return DEDUPED_DATA_FILE
+    return INGESTED_DATA_FILE
+
+def failed_chunk_ids() -> Set[str]:
+    """Ids of the chunks in the dead-letter file, which are missing from the output."""
+    return {entry["item"]["id"] for entry in DeadLetterFile(DEAD_LETTER_FILE).read()}
+
+def write_batch(
+    batch: List[Dict[str, Any]],
+    vectors: Optional[List[List[float]]],
+    error: Optional[BaseException],
+    writer: ChunkWriter,
+    dead_letters: DeadLetterFile,
+) -> List[str]:
+    """
+    Writes an embedded batch to the output file. A batch that still failed
+    after retries goes to the dead-letter file. Returns the ids written.
+    """
+    if error is not None:
+        print(f"Error processing a batch: {error}. Saving {len(batch)} items to '{DEAD_LETTER_FILE}'.")
+        dead_letters.add(batch, error)
+        return []
+
+    # Add the embedding to each item and write to the output file.
+    for item, vector in zip(batch, vectors):
+        item["embedding"] = vector
+        writer.write(item)
+    return [item["id"] for item in batch]
+
+def embed_items(
+    model: EmbeddingBackend,
+    entries: Iterable[Tuple[Dict[str, Any], Optional[int]]],
+    writer: ChunkWriter,
+    dead_letters: DeadLetterFile,
+    checkpoint: Optional[Checkpoint],
+    cache: Optional[EmbeddingCache],
+) -> None:
+    """
+    Embeds (item, input_offset) entries with concurrent requests and writes
+    the results in input order, committing each batch to `checkpoint`.
+    Texts found in `cache` are not sent to the API.
+    """
+    batcher = AdaptiveBatcher(max_instances=EMBEDDING_BATCH_SIZE)
+    controller = RateController()
+
+    def with_cached_vectors() -> Iterator[Tuple[Dict[str, Any], Optional[int], Optional[List[float]]]]:
+        for item, input_offset in entries:
+            vector = cache.get(model.model_name, item["text"]) if cache is not None else None
+            yield item, input_offset, vector
+
+    def request(batch_entries: List[Tuple[Dict[str, Any], Optional[int], Optional[List[float]]]]) -> List[List[float]]:
+        missing = [item["text"] for item, _, cached in batch_entries if cached is None]
+        if missing:
+            embeddings = iter(
+                batcher.embed(missing, lambda part: get_embeddings_with_retry(model, part, controller))
+            )
+        return [
+            cached if cached is not None else next(embeddings).values
+            for _, _, cached in batch_entries
+        ]
+
+    batches = batcher.batches(
+        with_cached_vectors(),
+        text=lambda entry: entry[0]["text"] if entry[2] is None else None,
+    )
+    for batch_entries, vectors, error in ordered_map(request, batches, controller):
+        batch = [item for item, _, _ in batch_entries]
+        ids = write_batch(batch, vectors, error, writer, dead_letters)
+        if cache is not None and error is None:
+            fresh = [
+                (item["text"], vector)
+                for (item, _, cached), vector in zip(batch_entries, vectors)
+                if cached is None
+            ]
+            cache.put_many(
+                model.model_name, (text for text, _ in fresh), (vector for _, vector in fresh)
+            )
+            cache.commit()
+        if checkpoint is not None:
+            writer.sync()
+            checkpoint.commit(ids, writer.tell(), batch_entries[-1][1])
+
+    print(f"Batching: {batcher.summary()}.")
+    print(f"Throughput: {controller.report()}.")
+    if cache is not None:
+        evicted = cache.evict()
+        print(f"Cache: {cache.report()}, {evicted} evicted.")
+
+def open_cache() -> Optional[EmbeddingCache]:
+    return EmbeddingCache() if EMBEDDING_CACHE_FILE else None
+
+def load_embedding_model() -> EmbeddingBackend:
+    # Load the pre-trained embedding model, or the offline backend.
+    return get_embedding_backend(EMBEDDING_MODEL_NAME, PROJECT_ID, LOCATION)
+
+def generate_embeddings(resume: bool = False) -> None:
     """
     Reads chunks from the ingested data file, generates embeddings for them
     in batches, and saves the results to a new JSONL file.
     This approach is memory-efficient for large datasets.
+
+    With JSONL output every batch is committed to a checkpoint manifest. With
+    `resume=True` the run continues from the last committed batch instead of
+    starting over.
     """
-    # Initialize the Vertex AI SDK.
-    vertexai.init(project=PROJECT_ID, location=LOCATION)
-    
-    # Load the pre-trained embedding model.
-    embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
-    
-    print(f"Starting embedding generation using model: {EMBEDDING_MODEL_NAME}")
-    
-    with open(INGESTED_DATA_FILE, 'r') as infile, open(EMBEDDED_DATA_FILE, 'w') as outfile:
-        batch = []
-        for line in infile:
-            item = json.loads(line)
-            batch.append(item)
-            
-            # When the batch is full, process it.
-            if len(batch) >= EMBEDDING_BATCH_SIZE:
-                texts = [item["text"] for item in batch]
-                try:
-                    embeddings = get_embeddings_with_retry(embedding_model, texts)
-                    
-                    # Add the embedding to each item and write to the output file.
-                    for j, item in enumerate(batch):
-                        item["embedding"] = embeddings[j].values
-                        outfile.write(json.dumps(item) + '\n')
-                
-                except Exception as e:
-                    print(f"Error processing a batch: {e}. Skipping this batch.")
-                
-                batch = []  # Reset batch after processing
-
-        # Process any remaining items in the last batch.
-        if batch:
-            texts = [item["text"] for item in batch]
-            try:
-                embeddings = get_embeddings_with_retry(embedding_model, texts)
-                for j, item in enumerate(batch):
-                    item["embedding"] = embeddings[j].values
-                    outfile.write(json.dumps(item) + '\n')
-            except Exception as e:
-                print(f"Error processing the final batch: {e}. Skipping this batch.")
+    embedding_model = load_embedding_model()
+    input_file = resolve_input_file()
+    print(f"Starting embedding generation for '{input_file}' using model: {embedding_model.model_name}")
+
+    # Parquet files cannot be appended to, so they are not checkpointed.
+    checkpointing = not is_parquet(EMBEDDED_DATA_FILE)
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    dead_letters = DeadLetterFile(DEAD_LETTER_FILE)
+
+    if resume and checkpointing and checkpoint.load():
+        if not checkpoint.matches_input(input_file):
+            print(
+                f"Error: The checkpoint in '{CHECKPOINT_FILE}' was not made from the current "
+                f"'{input_file}'. Run without --resume to start over."
+            )
+            return
+        truncate_to_checkpoint(EMBEDDED_DATA_FILE, checkpoint)
+        print(f"Resuming from checkpoint: {len(checkpoint.completed_ids)} chunks already embedded.")
+    else:
+        checkpoint.reset()
+        dead_letters.reset()
+        if checkpointing:
+            checkpoint.bind_input(input_file)
+        resume = False
+
+    if is_parquet(input_file):
+        items = ((item, None) for item in read_chunks(input_file))
+    else:
+        items = iter_jsonl_with_offsets(input_file, checkpoint.input_offset)
+
+    pending = (
+        (item, input_offset)
+        for item, input_offset in items
+        if item["id"] not in checkpoint.completed_ids
+    )
+
+    cache = open_cache()
+    with ChunkWriter(EMBEDDED_DATA_FILE, append=resume) as writer:
+        embed_items(
+            embedding_model,
+            pending,
+            writer,
+            dead_letters,
+            checkpoint if checkpointing else None,
+            cache,
+        )
+    if cache is not None:
+        cache.close()
             
+    # A batch dead-lettered just before a crash may have been embedded on resume.
+    failed = sum(
+        entry["item"]["id"] not in checkpoint.completed_ids for entry in dead_letters.read()
+    )
+    if failed:
+        print(f"{failed} items failed. Run 'python embedding.py retry' to retry them.")
     print(f"Embedding complete. '{EMBEDDED_DATA_FILE}' created.")
 
+def retry_failed_embeddings() -> None:
+    """
+    Re-embeds the items in the dead-letter file and appends them to the
+    output file. Items that fail again stay in the dead-letter file.
+    """
+    if is_parquet(EMBEDDED_DATA_FILE):
+        print("Error: Retrying failed items needs JSONL output (DATA_FORMAT=jsonl).")
+        return
+    dead_letters = DeadLetterFile(DEAD_LETTER_FILE)
+    entries = dead_letters.read()
+    if not entries:
+        print(f"No failed items found in '{DEAD_LETTER_FILE}'.")
+        return
+
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    if checkpoint.load():
+        truncate_to_checkpoint(EMBEDDED_DATA_FILE, checkpoint)
+
+    embedding_model = load_embedding_model()
+    pending = [entry["item"] for entry in entries if entry["item"]["id"] not in checkpoint.completed_ids]
+    print(f"Retrying {len(pending)} failed items...")
+    retry_dead_letters = DeadLetterFile(DEAD_LETTER_FILE + ".retry")
+    retry_dead_letters.reset()
+
+    cache = open_cache()
+    with ChunkWriter(EMBEDDED_DATA_FILE, append=True) as writer:
+        embed_items(
+            embedding_model,
+            ((item, None) for item in pending),
+            writer,
+            retry_dead_letters,
+            checkpoint,
+            cache,
+        )
+    if cache is not None:
+        cache.close()
+
+    # Whatever failed again becomes the new dead-letter file.
+    dead_letters.replace(retry_dead_letters.read())
+    retry_dead_letters.reset()
+    remaining = len(dead_letters.read())
+    print(f"Retry complete. {len(pending) - remaining} items embedded, {remaining} still failing.")
+
 if __name__ == "__main__":
-    if not os.path.exists(INGESTED_DATA_FILE):
+    parser = argparse.ArgumentParser(description="Generate embeddings for ingested chunks.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["run", "retry"],
+        default="run",
+        help="'run' embeds the ingested chunks, 'retry' re-embeds items in the dead-letter file",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its checkpoint instead of starting over",
+    )
+    args = parser.parse_args()
+
+    if args.command == "retry":
+        retry_failed_embeddings()
+    elif not os.path.exists(resolve_input_file()):
         print(f"Error: The file '{INGESTED_DATA_FILE}' was not found. Please run data_ingestion.py first.")
     else:
-        generate_embeddings()
\ No newline at end of file
+        generate_embeddings(resume=args.resume)
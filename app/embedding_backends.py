@@ -0,0 +1,222 @@
+# app/embedding_backends.py
+
+"""
+Embedding backends for the ingestion scripts.
+
+A backend turns a batch of texts into embeddings with get_embeddings(), the
+same call the Vertex AI TextEmbeddingModel exposes, and names the model its
+vectors come from so cached vectors are never mixed between backends.
+
+EMBEDDING_BACKEND selects the implementation:
+
+- "vertexai" (default) calls the Vertex AI text embedding model.
+- "offline" computes deterministic vectors locally with feature hashing and
+  random projections. It keeps the real dimensionality and per-request
+  limits, and can simulate latency, throttling, outages and a concurrency
+  quota, so the pipeline can be load-tested without network access.
+"""
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, List, Sequence
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+
+from batching import EMBEDDING_MAX_BATCH_INSTANCES, EMBEDDING_MAX_BATCH_TOKENS, estimate_tokens
+from chunk_io import EMBEDDING_DIMENSIONS
+
+# --- Configuration ---
+# "vertexai" or "offline".
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "vertexai").lower()
+
+# Offline backend: the seed fixes the projection, so the same text always
+# gets the same vector for a given seed and dimensionality.
+OFFLINE_EMBEDDING_SEED = int(os.environ.get("OFFLINE_EMBEDDING_SEED", 0))
+# Simulated request latency: a fixed part plus a part per text, scaled by a
+# random factor in [1 - jitter, 1 + jitter].
+OFFLINE_EMBEDDING_LATENCY_MS = float(os.environ.get("OFFLINE_EMBEDDING_LATENCY_MS", 0))
+OFFLINE_EMBEDDING_LATENCY_PER_TEXT_MS = float(os.environ.get("OFFLINE_EMBEDDING_LATENCY_PER_TEXT_MS", 0))
+OFFLINE_EMBEDDING_LATENCY_JITTER = float(os.environ.get("OFFLINE_EMBEDDING_LATENCY_JITTER", 0.2))
+# Fraction of requests that fail with a 429 or a 503.
+OFFLINE_EMBEDDING_THROTTLE_RATE = float(os.environ.get("OFFLINE_EMBEDDING_THROTTLE_RATE", 0))
+OFFLINE_EMBEDDING_ERROR_RATE = float(os.environ.get("OFFLINE_EMBEDDING_ERROR_RATE", 0))
+# Requests allowed in flight before further ones get a 429. 0 means no limit.
+OFFLINE_EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("OFFLINE_EMBEDDING_MAX_CONCURRENCY", 0))
+# Word and bigram vectors kept in memory. Each costs dimensions * 4 bytes,
+# about 3 KB at 768 dimensions, so the default holds ~60 MB.
+OFFLINE_EMBEDDING_CACHE_SIZE = int(os.environ.get("OFFLINE_EMBEDDING_CACHE_SIZE", 20_000))
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class Embedding:
+    """An embedding vector, shaped like vertexai's TextEmbedding."""
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: List[float]):
+        self.values = values
+
+
+class EmbeddingBackend(ABC):
+    """Interface of the objects returned by get_embedding_backend()."""
+
+    model_name: str
+    dimensions: int
+
+    @abstractmethod
+    def get_embeddings(self, texts: List[str]) -> List[Any]:
+        """Returns one object with a `values` list per text, in order."""
+
+
+class VertexAIEmbeddingBackend(EmbeddingBackend):
+    """Calls a Vertex AI text embedding model."""
+
+    def __init__(self, model_name: str, project: str, location: str, dimensions: int = EMBEDDING_DIMENSIONS):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+
+        vertexai.init(project=project, location=location)
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self._model = TextEmbeddingModel.from_pretrained(model_name)
+
+    def get_embeddings(self, texts: List[str]) -> List[Any]:
+        return self._model.get_embeddings(texts)
+
+
+class OfflineEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic local embeddings. Each word and word bigram is hashed to
+    a seed for a Gaussian random vector; a text's embedding is the
+    normalized, log-weighted sum of its features' vectors. Texts that share
+    words therefore get similar vectors, which keeps retrieval benchmarks
+    meaningful, and no text ever leaves the machine.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        seed: int = OFFLINE_EMBEDDING_SEED,
+        max_instances: int = EMBEDDING_MAX_BATCH_INSTANCES,
+        max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        latency_ms: float = OFFLINE_EMBEDDING_LATENCY_MS,
+        latency_per_text_ms: float = OFFLINE_EMBEDDING_LATENCY_PER_TEXT_MS,
+        latency_jitter: float = OFFLINE_EMBEDDING_LATENCY_JITTER,
+        throttle_rate: float = OFFLINE_EMBEDDING_THROTTLE_RATE,
+        error_rate: float = OFFLINE_EMBEDDING_ERROR_RATE,
+        max_concurrency: int = OFFLINE_EMBEDDING_MAX_CONCURRENCY,
+        cache_size: int = OFFLINE_EMBEDDING_CACHE_SIZE,
+    ):
+        self.model_name = f"offline-hash-{dimensions}-seed{seed}"
+        self.dimensions = dimensions
+        self.seed = seed
+        self.max_instances = max_instances
+        self.max_tokens = max_tokens
+        self.latency_ms = latency_ms
+        self.latency_per_text_ms = latency_per_text_ms
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._feature_vector = lru_cache(maxsize=cache_size)(self._feature_vector_uncached)
+        self.requests = 0
+        self.texts = 0
+        self.injected_errors = 0
+
+    def _feature_vector_uncached(self, feature: str) -> np.ndarray:
+        digest = hashlib.blake2b(
+            f"{self.seed}\0{feature}".encode("utf-8"), digest_size=8
+        ).digest()
+        rng = np.random.default_rng(int.from_bytes(digest, "little"))
+        return rng.standard_normal(self.dimensions, dtype=np.float32)
+
+    def embed_text(self, text: str) -> List[float]:
+        words = _WORD_PATTERN.findall(text.lower())
+        counts: dict = {}
+        for i, word in enumerate(words):
+            counts[word] = counts.get(word, 0) + 1
+            if i:
+                bigram = f"{words[i - 1]} {word}"
+                counts[bigram] = counts.get(bigram, 0) + 1
+        if not counts:
+            counts[text] = 1
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, count in counts.items():
+            vector += (1 + math.log(count)) * self._feature_vector(feature)
+        vector /= np.linalg.norm(vector) or 1.0
+        return vector.tolist()
+
+    def _check_request(self, texts: Sequence[str]) -> None:
+        """Raises the errors the real API would return for this request."""
+        if len(texts) > self.max_instances:
+            raise api_exceptions.InvalidArgument(
+                f"Too many instances: {len(texts)} exceeds the limit of {self.max_instances} per request"
+            )
+        tokens = sum(estimate_tokens(text) for text in texts)
+        if tokens > self.max_tokens:
+            raise api_exceptions.InvalidArgument(
+                f"Unable to submit request because the input token count {tokens} "
+                f"exceeds the limit of {self.max_tokens}"
+            )
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.throttle_rate:
+                self.injected_errors += 1
+                raise api_exceptions.ResourceExhausted("Quota exceeded for embedding requests (simulated)")
+            if roll < self.throttle_rate + self.error_rate:
+                self.injected_errors += 1
+                raise api_exceptions.ServiceUnavailable("The service is currently unavailable (simulated)")
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self.injected_errors += 1
+                raise api_exceptions.ResourceExhausted(
+                    f"Quota exceeded: more than {self.max_concurrency} concurrent requests (simulated)"
+                )
+            self._in_flight += 1
+
+    def _simulate_latency(self, count: int) -> None:
+        latency_ms = self.latency_ms + self.latency_per_text_ms * count
+        if latency_ms <= 0:
+            return
+        with self._lock:
+            scale = self._random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        time.sleep(max(0.0, latency_ms * scale) / 1000)
+
+    def get_embeddings(self, texts: List[str]) -> List[Embedding]:
+        self._check_request(texts)
+        try:
+            self._simulate_latency(len(texts))
+            embeddings = [Embedding(self.embed_text(text)) for text in texts]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self.requests += 1
+            self.texts += len(texts)
+        return embeddings
+
+    def report(self) -> str:
+        return f"{self.requests} requests, {self.texts} texts, {self.injected_errors} injected errors"
+
+
+def get_embedding_backend(
+    model_name: str, project: str, location: str, backend: str = EMBEDDING_BACKEND
+) -> EmbeddingBackend:
+    """Returns the backend selected by EMBEDDING_BACKEND."""
+    if backend == "offline":
+        return OfflineEmbeddingBackend()
+    if backend == "vertexai":
+        return VertexAIEmbeddingBackend(model_name, project, location)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Use 'vertexai' or 'offline'.")
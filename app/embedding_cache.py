@@ -0,0 +1,184 @@
+# app/embedding_cache.py
+
+"""
+Persistent embedding cache backed by SQLite.
+
+Vectors are stored as packed little-endian float32 blobs keyed by the
+SHA-256 of the model name and the text, so re-running embedding.py on
+unchanged chunks with the same EMBEDDING_MODEL_NAME never calls the API
+again. Least-recently-used entries are evicted once the cache grows past
+EMBEDDING_CACHE_MAX_MB.
+
+Run this file directly to manage the cache:
+
+    python app/embedding_cache.py warm embedded_data.jsonl
+    python app/embedding_cache.py stats
+    python app/embedding_cache.py evict
+"""
+
+from typing import Iterable, List, Optional, Sequence
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from chunk_io import data_file, read_chunks
+
+# --- Configuration ---
+# Set EMBEDDING_CACHE_FILE to an empty string to disable the cache.
+EMBEDDING_CACHE_FILE = os.environ.get("EMBEDDING_CACHE_FILE", "embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", 2048))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(model.encode("utf-8") + b"\0" + text.encode("utf-8")).digest()
+
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def unpack_vector(blob: bytes) -> List[float]:
+    return np.frombuffer(blob, dtype="<f4").tolist()
+
+
+class EmbeddingCache:
+    """SQLite key-value store of embedding vectors with LRU eviction."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_FILE, max_mb: int = EMBEDDING_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._touched: List[bytes] = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append(key)
+        return unpack_vector(row[0])
+
+    def put_many(self, model: str, texts: Iterable[str], vectors: Iterable[Sequence[float]]) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+            (
+                (cache_key(model, text), model, pack_vector(vector), now)
+                for text, vector in zip(texts, vectors)
+            ),
+        )
+
+    def commit(self) -> None:
+        """Persists new entries and the last-used time of entries that were hit."""
+        if self._touched:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                ((now, key) for key in self._touched),
+            )
+            self._touched = []
+        self._conn.commit()
+
+    def size_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return row[0]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def evict(self) -> int:
+        """Deletes least-recently-used entries until the cache fits in max_bytes."""
+        self.commit()
+        excess = self.size_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+        evicted = []
+        for key, size in self._conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        ):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._conn.commit()
+        return len(evicted)
+
+    def warm_from_file(self, path: str, model: str, batch_size: int = 1000) -> int:
+        """Loads text/embedding pairs from an embedded data file into the cache."""
+        count = 0
+        texts: List[str] = []
+        vectors: List[List[float]] = []
+        for item in read_chunks(path):
+            if "embedding" not in item:
+                continue
+            texts.append(item["text"])
+            vectors.append(item["embedding"])
+            if len(texts) >= batch_size:
+                self.put_many(model, texts, vectors)
+                count += len(texts)
+                texts, vectors = [], []
+        if texts:
+            self.put_many(model, texts, vectors)
+            count += len(texts)
+        self.commit()
+        return count
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate), "
+            f"{self.count()} entries, {self.size_bytes() / (1024 * 1024):.1f} MB"
+        )
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    from embedding import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Manage the embedding cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    warm = subparsers.add_parser("warm", help="Load vectors from an embedded data file")
+    warm.add_argument("file", nargs="?", default=data_file("embedded_data"))
+    warm.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="Model the vectors came from")
+    subparsers.add_parser("stats", help="Print cache size")
+    subparsers.add_parser("evict", help=f"Evict entries above {EMBEDDING_CACHE_MAX_MB} MB")
+    args = parser.parse_args()
+
+    if not EMBEDDING_CACHE_FILE:
+        print("Error: EMBEDDING_CACHE_FILE is empty, the cache is disabled.")
+    else:
+        cache = EmbeddingCache()
+        if args.command == "warm":
+            print(f"Warmed the cache with {cache.warm_from_file(args.file, args.model)} vectors from '{args.file}'.")
+        elif args.command == "evict":
+            print(f"Evicted {cache.evict()} entries.")
+        print(f"Cache '{EMBEDDING_CACHE_FILE}': {cache.count()} entries, {cache.size_bytes() / (1024 * 1024):.1f} MB.")
+        cache.close()
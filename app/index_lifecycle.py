@@ -0,0 +1,359 @@
+# app/index_lifecycle.py
+
+"""
+Non-blocking Vector Search index lifecycle with blue/green deploys.
+
+Two indexes, "blue" and "green", take turns serving from one endpoint. A
+rollout builds the inactive colour from fresh data and deploys it next to
+the live one. Once it is serving, traffic is switched by rewriting the
+endpoint's labels in one update, and the old index stays deployed until it
+is retired, so there is no retrieval gap and rolling back is a label flip.
+
+Nothing here waits on a long-running operation. Each command starts at most
+one operation, records its name in a local state file and returns;
+`advance` checks the operation and, when it is done, starts the next step.
+A crashed or cancelled CI job can therefore pick up where it left off.
+Resources are looked up with server-side display-name filters instead of
+listing the whole project, and a rollout adopts the inactive colour's index
+if it already exists (e.g. after a crash), rebuilding it in place.
+
+    python app/index_lifecycle.py rollout      # upload data, start building the inactive index
+    python app/index_lifecycle.py advance      # move to the next step if the current one is done
+    python app/index_lifecycle.py advance --wait
+    python app/index_lifecycle.py status
+    python app/index_lifecycle.py rollback     # switch traffic back to the previous index
+    python app/index_lifecycle.py retire       # undeploy and delete the previous index
+
+The retriever in app/agent.py reads the live deployed index from the
+endpoint label ACTIVE_DEPLOYED_INDEX_LABEL and re-reads it every
+DEPLOYED_INDEX_REFRESH_SECONDS, so a switch or rollback reaches running
+agents without a restart. Wait at least that long after a switch before
+retiring the previous index.
+"""
+
+from typing import Any, Dict, Optional
+import argparse
+import json
+import os
+import re
+import time
+
+from google.cloud import aiplatform_v1
+from google.protobuf import field_mask_pb2, json_format, struct_pb2
+
+from indexing import (
+    EMBEDDED_DATA_FILE,
+    EMBEDDING_DIMENSIONS,
+    ENDPOINT_DISPLAY_NAME,
+    GCS_BUCKET_NAME,
+    GCS_UPLOAD_FOLDER,
+    INDEX_APPROXIMATE_NEIGHBORS_COUNT,
+    INDEX_DISPLAY_NAME,
+    INDEX_DISTANCE_MEASURE,
+    INDEX_LEAF_NODE_EMBEDDING_COUNT,
+    INDEX_LEAF_NODES_TO_SEARCH_PERCENT,
+    INDEX_MACHINE_TYPE,
+    INDEX_MAX_REPLICAS,
+    INDEX_MIN_REPLICAS,
+    INDEX_UPDATE_METHOD,
+    LOCATION,
+    PROJECT_ID,
+    upload_data_to_gcs,
+)
+
+# --- Configuration ---
+INDEX_STATE_FILE = os.environ.get("INDEX_STATE_FILE", "index_lifecycle_state.json")
+# Seconds between checks with `advance --wait`.
+OPERATION_POLL_SECONDS = float(os.environ.get("OPERATION_POLL_SECONDS", 30))
+
+ACTIVE_INDEX_LABEL = "active-index"
+ACTIVE_DEPLOYED_INDEX_LABEL = "active-deployed-index"
+COLORS = ("blue", "green")
+_INDEX_METADATA_SCHEMA = (
+    "gs://google-cloud-aiplatform/schema/matchingengine/metadata/nearest_neighbor_search_1.0.0.yaml"
+)
+
+
+def other_color(color: Optional[str]) -> str:
+    return "green" if color == "blue" else "blue"
+
+
+def index_display_name(color: str) -> str:
+    return f"{INDEX_DISPLAY_NAME}_{color}"
+
+
+def new_deployed_index_id(color: str) -> str:
+    """
+    A deployed index id that is also a valid label value ([a-z0-9_-], at most
+    63 characters), since switch_traffic publishes it in an endpoint label.
+    """
+    suffix = f"_{color}_{int(time.time())}"
+    name = re.sub(r"[^a-z0-9]", "", INDEX_DISPLAY_NAME.lower())
+    return f"deployed_{name}"[: 63 - len(suffix)] + suffix
+
+
+class IndexLifecycleManager:
+    """Blue/green index rollouts driven by a resumable state file."""
+
+    def __init__(self, state_file: str = INDEX_STATE_FILE):
+        self.state_file = state_file
+        self.parent = f"projects/{PROJECT_ID}/locations/{LOCATION}"
+        client_options = {"api_endpoint": f"{LOCATION}-aiplatform.googleapis.com"}
+        self.indexes = aiplatform_v1.IndexServiceClient(client_options=client_options)
+        self.endpoints = aiplatform_v1.IndexEndpointServiceClient(client_options=client_options)
+        self.state: Dict[str, Any] = {"endpoint": None, "active": None, "colors": {}, "pending": None}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state.update(json.load(f))
+
+    def save(self) -> None:
+        """Atomically replaces the state file."""
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_file)
+
+    # --- Lookups (server-side filters) ---
+
+    def find_index(self, display_name: str) -> Optional[aiplatform_v1.Index]:
+        request = {"parent": self.parent, "filter": f'display_name="{display_name}"'}
+        return next(iter(self.indexes.list_indexes(request=request)), None)
+
+    def find_endpoint(self, display_name: str) -> Optional[aiplatform_v1.IndexEndpoint]:
+        request = {"parent": self.parent, "filter": f'display_name="{display_name}"'}
+        return next(iter(self.endpoints.list_index_endpoints(request=request)), None)
+
+    # --- Operations ---
+
+    def _start(self, action: str, operation, **details: Any) -> None:
+        self.state["pending"] = {
+            "action": action,
+            "operation": operation.operation.name,
+            "started_at": time.time(),
+            **details,
+        }
+        self.save()
+        print(f"Started {action}: {operation.operation.name}")
+
+    def _check_pending(self):
+        """Returns the finished operation, or None if it is still running."""
+        pending = self.state["pending"]
+        operation = self.indexes.get_operation(request={"name": pending["operation"]})
+        if not operation.done:
+            return None
+        if operation.HasField("error"):
+            raise RuntimeError(
+                f"{pending['action']} failed: {operation.error.message}. "
+                "Fix the cause and run 'abort' to clear it."
+            )
+        return operation
+
+    def _create_endpoint(self) -> None:
+        endpoint = aiplatform_v1.IndexEndpoint(
+            display_name=ENDPOINT_DISPLAY_NAME, public_endpoint_enabled=True
+        )
+        self._start(
+            "create_endpoint",
+            self.endpoints.create_index_endpoint(parent=self.parent, index_endpoint=endpoint),
+        )
+
+    def _create_index(self, color: str) -> None:
+        """
+        Builds the colour's index from its contents. An index left over from
+        an interrupted or repeated rollout of the colour is rebuilt in place
+        instead of creating a duplicate.
+        """
+        info = self.state["colors"][color]
+        existing = self.find_index(index_display_name(color))
+        if existing is not None:
+            if existing.deployed_indexes:
+                raise RuntimeError(
+                    f"Index '{existing.display_name}' is deployed on "
+                    f"{existing.deployed_indexes[0].index_endpoint}. Undeploy it first."
+                )
+            metadata = {"contentsDeltaUri": info["contents_uri"], "isCompleteOverwrite": True}
+            index = aiplatform_v1.Index(
+                name=existing.name, metadata=json_format.ParseDict(metadata, struct_pb2.Value())
+            )
+            operation = self.indexes.update_index(
+                index=index, update_mask=field_mask_pb2.FieldMask(paths=["metadata"])
+            )
+            print(f"Reusing existing index '{existing.display_name}'.")
+            self._start("create_index", operation, color=color)
+            return
+
+        metadata = {
+            "contentsDeltaUri": info["contents_uri"],
+            "config": {
+                "dimensions": EMBEDDING_DIMENSIONS,
+                "approximateNeighborsCount": INDEX_APPROXIMATE_NEIGHBORS_COUNT,
+                "distanceMeasureType": INDEX_DISTANCE_MEASURE,
+                "algorithmConfig": {
+                    "treeAhConfig": {
+                        "leafNodeEmbeddingCount": INDEX_LEAF_NODE_EMBEDDING_COUNT,
+                        "leafNodesToSearchPercent": INDEX_LEAF_NODES_TO_SEARCH_PERCENT,
+                    }
+                },
+            },
+        }
+        index = aiplatform_v1.Index(
+            display_name=index_display_name(color),
+            metadata_schema_uri=_INDEX_METADATA_SCHEMA,
+            metadata=json_format.ParseDict(metadata, struct_pb2.Value()),
+            index_update_method=INDEX_UPDATE_METHOD,
+        )
+        self._start("create_index", self.indexes.create_index(parent=self.parent, index=index), color=color)
+
+    def _deploy_index(self, color: str) -> None:
+        # The id is only recorded on the colour once the deploy succeeds (see
+        # advance), so a failed and aborted deploy doesn't block the next rollout.
+        info = self.state["colors"][color]
+        deployed_index_id = new_deployed_index_id(color)
+        deployed_index = aiplatform_v1.DeployedIndex(
+            id=deployed_index_id,
+            index=info["index"],
+            dedicated_resources=aiplatform_v1.DedicatedResources(
+                machine_spec=aiplatform_v1.MachineSpec(machine_type=INDEX_MACHINE_TYPE),
+                min_replica_count=INDEX_MIN_REPLICAS,
+                max_replica_count=INDEX_MAX_REPLICAS,
+            ),
+        )
+        self._start(
+            "deploy_index",
+            self.endpoints.deploy_index(index_endpoint=self.state["endpoint"], deployed_index=deployed_index),
+            color=color,
+            deployed_index_id=deployed_index_id,
+        )
+
+    def switch_traffic(self, color: str) -> None:
+        """Points the endpoint labels at `color` in a single update."""
+        info = self.state["colors"][color]
+        endpoint = self.endpoints.get_index_endpoint(name=self.state["endpoint"])
+        labels = dict(endpoint.labels)
+        labels[ACTIVE_INDEX_LABEL] = info["index"].rsplit("/", 1)[-1]
+        labels[ACTIVE_DEPLOYED_INDEX_LABEL] = info["deployed_index_id"]
+        self.endpoints.update_index_endpoint(
+            index_endpoint=aiplatform_v1.IndexEndpoint(name=self.state["endpoint"], labels=labels),
+            update_mask=field_mask_pb2.FieldMask(paths=["labels"]),
+        )
+        self.state["active"] = color
+        self.save()
+        print(f"Traffic switched to '{color}' ({info['deployed_index_id']}).")
+
+    # --- Commands ---
+
+    def rollout(self, contents_uri: str) -> None:
+        """Starts building the inactive colour from `contents_uri`."""
+        if self.state["pending"]:
+            raise RuntimeError(f"A {self.state['pending']['action']} operation is still pending. Run 'advance'.")
+        color = other_color(self.state["active"])
+        if self.state["colors"].get(color, {}).get("deployed_index_id"):
+            raise RuntimeError(f"The '{color}' index is still deployed. Run 'retire' first.")
+        self.state["colors"][color] = {"contents_uri": contents_uri}
+        self.state["rollout"] = color
+
+        if not self.state["endpoint"]:
+            endpoint = self.find_endpoint(ENDPOINT_DISPLAY_NAME)
+            if endpoint is None:
+                self._create_endpoint()
+                return
+            self.state["endpoint"] = endpoint.name
+        self._create_index(color)
+
+    def advance(self) -> bool:
+        """
+        Checks the pending operation and starts the next step if it finished.
+        Returns True when nothing is left to do.
+        """
+        pending = self.state["pending"]
+        if not pending:
+            return True
+        operation = self._check_pending()
+        if operation is None:
+            elapsed = time.time() - pending["started_at"]
+            print(f"{pending['action']} still running ({elapsed / 60:.0f} min).")
+            return False
+
+        action = pending["action"]
+        self.state["pending"] = None
+        if action == "create_endpoint":
+            endpoint = aiplatform_v1.IndexEndpoint.deserialize(operation.response.value)
+            self.state["endpoint"] = endpoint.name
+            self._create_index(self.state["rollout"])
+        elif action == "create_index":
+            index = aiplatform_v1.Index.deserialize(operation.response.value)
+            self.state["colors"][pending["color"]]["index"] = index.name
+            self._deploy_index(pending["color"])
+        elif action == "deploy_index":
+            self.state["colors"][pending["color"]]["deployed_index_id"] = pending["deployed_index_id"]
+            previous = self.state["active"]
+            self.switch_traffic(pending["color"])
+            self.state["rollout"] = None
+            self.save()
+            if previous:
+                print(f"'{previous}' is still deployed for rollback. Run 'retire' to remove it.")
+        elif action == "undeploy_index":
+            info = self.state["colors"][pending["color"]]
+            info["deployed_index_id"] = None
+            self._start("delete_index", self.indexes.delete_index(name=info["index"]), color=pending["color"])
+        elif action == "delete_index":
+            del self.state["colors"][pending["color"]]
+            self.save()
+        return self.state["pending"] is None
+
+    def rollback(self) -> None:
+        previous = other_color(self.state["active"])
+        if not self.state["colors"].get(previous, {}).get("deployed_index_id"):
+            raise RuntimeError(f"The '{previous}' index is not deployed, so there is nothing to roll back to.")
+        self.switch_traffic(previous)
+
+    def retire(self) -> None:
+        """Starts undeploying (and then deleting) the inactive colour."""
+        if self.state["pending"]:
+            raise RuntimeError(f"A {self.state['pending']['action']} operation is still pending. Run 'advance'.")
+        color = other_color(self.state["active"])
+        info = self.state["colors"].get(color)
+        if not info or not info.get("deployed_index_id"):
+            print(f"The '{color}' index is not deployed.")
+            return
+        operation = self.endpoints.undeploy_index(
+            index_endpoint=self.state["endpoint"], deployed_index_id=info["deployed_index_id"]
+        )
+        self._start("undeploy_index", operation, color=color)
+
+    def abort(self) -> None:
+        """Forgets the pending operation, e.g. after it failed."""
+        self.state["pending"] = None
+        self.save()
+
+    def status(self) -> str:
+        return json.dumps(self.state, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blue/green Vector Search index rollouts.")
+    parser.add_argument("command", choices=["rollout", "advance", "status", "rollback", "retire", "abort"])
+    parser.add_argument("--contents-uri", help="GCS folder to build from (default: upload EMBEDDED_DATA_FILE)")
+    parser.add_argument("--wait", action="store_true", help="With 'advance', keep polling until done")
+    args = parser.parse_args()
+
+    manager = IndexLifecycleManager()
+    if args.command == "rollout":
+        contents_uri = args.contents_uri or upload_data_to_gcs(
+            source_file=EMBEDDED_DATA_FILE,
+            bucket_name=GCS_BUCKET_NAME,
+            destination_folder=f"{GCS_UPLOAD_FOLDER}_{other_color(manager.state['active'])}",
+        )
+        manager.rollout(contents_uri)
+    elif args.command == "advance":
+        while not manager.advance() and args.wait:
+            time.sleep(OPERATION_POLL_SECONDS)
+    elif args.command == "rollback":
+        manager.rollback()
+    elif args.command == "retire":
+        manager.retire()
+    elif args.command == "abort":
+        manager.abort()
+    print(manager.status())
@@ -0,0 +1,80 @@
+# app/index_manifest.py
+
+"""
+Manifests of the datapoints deployed to a Vector Search index.
+
+A manifest maps every chunk id in an embedded data file to a short hash of
+its text and embedding. The manifest of the last successful index update is
+stored in GCS next to the uploaded data. Diffing it against the manifest of
+the current file gives the datapoints to upsert (added or changed) and the
+ids to delete, so an existing index can be refreshed without a rebuild.
+
+Chunks that failed to embed are missing from the current file although
+their source still has them. They are passed as `unresolved` ids: they are
+never deleted, and their deployed entries are kept in the saved manifest
+until a later run embeds them.
+"""
+
+from typing import AbstractSet, Dict, List, Optional, Set, Tuple
+import hashlib
+import json
+
+import numpy as np
+
+from chunk_io import read_chunks
+
+Manifest = Dict[str, str]
+
+
+def datapoint_hash(item: dict) -> str:
+    """Hash of the parts of a chunk that end up in the index."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(item["text"].encode("utf-8"))
+    digest.update(np.asarray(item["embedding"], dtype="<f4").tobytes())
+    return digest.hexdigest()
+
+
+def build_manifest(path: str) -> Manifest:
+    """Returns {chunk id: datapoint hash} for an embedded data file."""
+    return {item["id"]: datapoint_hash(item) for item in read_chunks(path)}
+
+
+def diff_manifests(
+    deployed: Manifest, current: Manifest, unresolved: AbstractSet[str] = frozenset()
+) -> Tuple[Set[str], List[str]]:
+    """
+    Returns (ids to upsert, ids to delete) to turn `deployed` into `current`.
+    Ids in `unresolved` are left in the index.
+    """
+    upserts = {
+        chunk_id
+        for chunk_id, digest in current.items()
+        if deployed.get(chunk_id) != digest
+    }
+    deletes = sorted(
+        chunk_id for chunk_id in deployed if chunk_id not in current and chunk_id not in unresolved
+    )
+    return upserts, deletes
+
+
+def carry_over(deployed: Manifest, current: Manifest, unresolved: AbstractSet[str]) -> Manifest:
+    """The manifest to save after an update: `current` plus the deployed unresolved ids."""
+    manifest = dict(current)
+    for chunk_id in unresolved:
+        if chunk_id not in manifest and chunk_id in deployed:
+            manifest[chunk_id] = deployed[chunk_id]
+    return manifest
+
+
+def load_manifest(bucket, blob_name: str) -> Optional[Manifest]:
+    """Reads a manifest from GCS. Returns None if none has been saved yet."""
+    blob = bucket.blob(blob_name)
+    if not blob.exists():
+        return None
+    return json.loads(blob.download_as_bytes())
+
+
+def save_manifest(bucket, blob_name: str, manifest: Manifest) -> None:
+    bucket.blob(blob_name).upload_from_string(
+        json.dumps(manifest, separators=(",", ":")), content_type="application/json"
+    )
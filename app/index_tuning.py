@@ -0,0 +1,385 @@
+# app/index_tuning.py
+
+"""
+Index configuration tuning harness.
+
+Computes the exact top-k neighbours of a query set by brute force over the
+embedded data file, then measures how close approximate search gets for a
+grid of tree-AH settings, together with query latency percentiles and an
+estimate of the serving memory. Queries sampled from the file are held out
+of the searched corpus, so they can't find themselves.
+
+Approximate search is evaluated either locally, with a simulation of the
+tree-AH index (k-means leaves, int8-quantized scoring and exact reordering
+of the approximate candidates), or against a deployed index endpoint. The
+local simulation shows how recall moves with each setting; only the remote
+mode gives real serving latencies.
+
+    python app/index_tuning.py --queries 200 --k 10
+    python app/index_tuning.py --endpoint projects/.../indexEndpoints/123 \\
+        --deployed-index-id deployed_myragindex_1700000000
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from chunk_io import data_file, read_chunks
+
+# --- Configuration ---
+EMBEDDED_DATA_FILE = os.environ.get("EMBEDDED_DATA_FILE", data_file("embedded_data"))
+TUNING_REPORT_FILE = os.environ.get("TUNING_REPORT_FILE", "index_tuning_report.json")
+
+# Queries are scored against the corpus in blocks of this many.
+QUERY_BLOCK_SIZE = 256
+# k-means for the simulated leaves is trained on at most this many vectors.
+KMEANS_SAMPLE_SIZE = 100_000
+KMEANS_ITERATIONS = 10
+
+# Serving memory per machine type in GB, for the sizing estimate.
+MACHINE_MEMORY_GB = {
+    "e2-standard-2": 8,
+    "e2-standard-16": 64,
+    "n1-standard-16": 60,
+    "e2-highmem-16": 128,
+    "n2d-standard-32": 128,
+}
+# Fraction of a machine's memory the index may use, leaving room for the server.
+MEMORY_HEADROOM = 0.5
+
+
+def load_embeddings(path: str) -> Tuple[List[str], np.ndarray]:
+    ids: List[str] = []
+    vectors: List[List[float]] = []
+    for item in read_chunks(path):
+        ids.append(item["id"])
+        vectors.append(item["embedding"])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def prepare(vectors: np.ndarray, distance: str) -> np.ndarray:
+    """Normalizes vectors for cosine distance; other measures use them as is."""
+    if distance != "COSINE_DISTANCE":
+        return vectors
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def similarity(corpus: np.ndarray, queries: np.ndarray, distance: str, corpus_sq_norms=None) -> np.ndarray:
+    """Scores (queries x corpus), higher is closer, for a Vector Search distance measure."""
+    scores = queries @ corpus.T
+    if distance == "SQUARED_L2_DISTANCE":
+        if corpus_sq_norms is None:
+            corpus_sq_norms = np.einsum("ij,ij->i", corpus, corpus)
+        # -|q - x|^2 without the |q|^2 term, which does not change the ranking.
+        scores = 2 * scores - corpus_sq_norms
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores in each row, best first."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int, distance: str) -> np.ndarray:
+    """Brute-force ground truth: the exact top-k corpus rows for every query."""
+    sq_norms = np.einsum("ij,ij->i", corpus, corpus) if distance == "SQUARED_L2_DISTANCE" else None
+    results = []
+    for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+        block = queries[start : start + QUERY_BLOCK_SIZE]
+        results.append(top_k(similarity(corpus, block, distance, sq_norms), k))
+    return np.vstack(results)
+
+
+def recall_at_k(found: Sequence[Sequence[int]], truth: np.ndarray, k: int) -> float:
+    hits = sum(len(set(row[:k]) & set(expected[:k])) for row, expected in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def percentiles(latencies_ms: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies_ms)
+    return {f"p{p}": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+
+class SimulatedTreeAHIndex:
+    """
+    Local stand-in for a tree-AH index. Vectors are partitioned into k-means
+    leaves of about `leaf_node_embedding_count` vectors. A query scores the
+    leaf centroids, searches the best `leaf_nodes_to_search_percent` of the
+    leaves with int8-quantized vectors (in place of asymmetric hashing), and
+    reorders the best `approximate_neighbors_count` candidates exactly.
+    """
+
+    def __init__(self, corpus: np.ndarray, leaf_node_embedding_count: int, distance: str, seed: int = 0):
+        self.corpus = corpus
+        self.distance = distance
+        self.sq_norms = np.einsum("ij,ij->i", corpus, corpus)
+        rng = np.random.default_rng(seed)
+
+        sample = corpus[rng.choice(len(corpus), min(len(corpus), KMEANS_SAMPLE_SIZE), replace=False)]
+        # Each leaf is seeded with a distinct sample vector, so there can't be more leaves than samples.
+        n_leaves = min(len(sample), max(1, math.ceil(len(corpus) / leaf_node_embedding_count)))
+        centroids = sample[rng.choice(len(sample), n_leaves, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = self._nearest_centroid(sample, centroids)
+            for leaf in range(n_leaves):
+                members = sample[assignment == leaf]
+                if len(members):
+                    centroids[leaf] = members.mean(axis=0)
+        self.centroids = centroids
+        assignment = self._nearest_centroid(corpus, centroids)
+        self.leaves = [np.flatnonzero(assignment == leaf) for leaf in range(n_leaves)]
+
+        self.scale = np.maximum(np.abs(corpus).max(axis=0), 1e-12) / 127
+        self.codes = np.round(corpus / self.scale).astype(np.int8)
+
+    @staticmethod
+    def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        for start in range(0, len(vectors), 4096):
+            block = vectors[start : start + 4096]
+            assignment[start : start + 4096] = np.argmax(2 * block @ centroids.T - centroid_sq_norms, axis=1)
+        return assignment
+
+    def search(
+        self, query: np.ndarray, k: int, approximate_neighbors_count: int, leaf_nodes_to_search_percent: float
+    ) -> np.ndarray:
+        n_search = max(1, math.ceil(len(self.leaves) * leaf_nodes_to_search_percent / 100))
+        leaf_scores = similarity(self.centroids, query[None, :], self.distance)[0]
+        best_leaves = np.argpartition(-leaf_scores, n_search - 1)[:n_search]
+        candidates = np.concatenate([self.leaves[leaf] for leaf in best_leaves])
+
+        approximate = (self.codes[candidates] * self.scale) @ query
+        if self.distance == "SQUARED_L2_DISTANCE":
+            approximate = 2 * approximate - self.sq_norms[candidates]
+        shortlist = candidates[top_k(approximate[None, :], approximate_neighbors_count)[0]]
+
+        exact = similarity(self.corpus[shortlist], query[None, :], self.distance, self.sq_norms[shortlist])
+        return shortlist[top_k(exact, k)[0]]
+
+
+def evaluate_local(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+    distance: str,
+    leaf_sizes: Sequence[int],
+    neighbor_counts: Sequence[int],
+    leaf_percents: Sequence[float],
+) -> List[Dict[str, Any]]:
+    results = []
+    for leaf_size in leaf_sizes:
+        started = time.perf_counter()
+        index = SimulatedTreeAHIndex(corpus, leaf_size, distance)
+        build_seconds = time.perf_counter() - started
+        for neighbors in neighbor_counts:
+            for leaf_percent in leaf_percents:
+                found, latencies = [], []
+                for query in queries:
+                    started = time.perf_counter()
+                    found.append(index.search(query, k, max(neighbors, k), leaf_percent).tolist())
+                    latencies.append((time.perf_counter() - started) * 1000)
+                results.append({
+                    "leaf_node_embedding_count": leaf_size,
+                    "approximate_neighbors_count": neighbors,
+                    "leaf_nodes_to_search_percent": leaf_percent,
+                    f"recall@{k}": round(recall_at_k(found, truth, k), 4),
+                    "latency_ms": percentiles(latencies),
+                    "build_seconds": round(build_seconds, 2),
+                })
+                print(f"  leaf size {leaf_size}, neighbors {neighbors}, search {leaf_percent}% of leaves: "
+                      f"recall@{k} {results[-1][f'recall@{k}']:.3f}, p95 {results[-1]['latency_ms']['p95']:.2f} ms")
+    return results
+
+
+def evaluate_remote(
+    endpoint_name: str,
+    deployed_index_id: str,
+    ids: List[str],
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+    neighbor_counts: Sequence[int],
+    query_ids: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Queries a deployed index one request at a time and measures recall and
+    latency. The deployed index still holds queries sampled from the corpus,
+    so with `query_ids` one extra neighbor is requested and the query's own
+    datapoint is dropped from the results.
+    """
+    from google.cloud import aiplatform
+
+    endpoint = aiplatform.MatchingEngineIndexEndpoint(endpoint_name)
+    row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+    results = []
+    for neighbors in neighbor_counts:
+        found, latencies = [], []
+        for position, query in enumerate(queries):
+            own_id = query_ids[position] if query_ids else None
+            started = time.perf_counter()
+            response = endpoint.find_neighbors(
+                deployed_index_id=deployed_index_id,
+                queries=[query.tolist()],
+                num_neighbors=k + 1 if own_id else k,
+                approx_num_neighbors=max(neighbors, k + 1),
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            neighbor_ids = [neighbor.id for neighbor in response[0] if neighbor.id != own_id][:k]
+            found.append([row_of.get(neighbor_id, -1) for neighbor_id in neighbor_ids])
+        results.append({
+            "approximate_neighbors_count": neighbors,
+            f"recall@{k}": round(recall_at_k(found, truth, k), 4),
+            "latency_ms": percentiles(latencies),
+        })
+        print(f"  neighbors {neighbors}: recall@{k} {results[-1][f'recall@{k}']:.3f}, "
+              f"p95 {results[-1]['latency_ms']['p95']:.1f} ms")
+    return results
+
+
+def estimate_memory(count: int, dimensions: int) -> Dict[str, Any]:
+    """
+    Rough serving memory of a tree-AH index: the float32 vectors used for
+    reordering, 4-bit AH codes, and about 100 bytes per datapoint for ids and
+    bookkeeping. Lists the machine types that hold it with MEMORY_HEADROOM.
+    """
+    index_bytes = count * (dimensions * 4 + dimensions // 2 + 100)
+    index_gb = index_bytes / 1024**3
+    fitting = [
+        machine for machine, memory_gb in MACHINE_MEMORY_GB.items()
+        if index_gb <= memory_gb * MEMORY_HEADROOM
+    ]
+    return {"datapoints": count, "estimated_index_gb": round(index_gb, 3), "machine_types_that_fit": fitting}
+
+
+def recommend(results: List[Dict[str, Any]], k: int, target_recall: float) -> Optional[Dict[str, Any]]:
+    """The configuration with the lowest p95 latency that reaches `target_recall`."""
+    meeting = [result for result in results if result[f"recall@{k}"] >= target_recall]
+    return min(meeting, key=lambda result: result["latency_ms"]["p95"]) if meeting else None
+
+
+def load_queries(
+    corpus: np.ndarray, num_queries: int, query_file: Optional[str], seed: int
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Embeds the lines of `query_file`, or samples `num_queries` corpus vectors
+    (at most half the corpus). Returns the queries and the sampled corpus
+    rows, which the caller must hold out of the searched corpus: a query that
+    is also indexed finds itself and inflates recall.
+    """
+    if query_file:
+        from embedding import load_embedding_model
+
+        with open(query_file) as f:
+            texts = [line.strip() for line in f if line.strip()]
+        model = load_embedding_model()
+        vectors = []
+        for start in range(0, len(texts), 100):
+            vectors.extend(e.values for e in model.get_embeddings(texts[start : start + 100]))
+        return np.asarray(vectors, dtype=np.float32), None
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(corpus), min(num_queries, len(corpus) // 2), replace=False)
+    return corpus[rows], rows
+
+
+def parse_list(value: str, cast=int) -> List:
+    return [cast(part) for part in value.split(",") if part]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall, latency and memory of index settings.")
+    parser.add_argument("--file", default=EMBEDDED_DATA_FILE, help="Embedded data file")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Corpus vectors held out and used as queries")
+    parser.add_argument("--query-file", help="Text file with one query per line, embedded instead of sampling")
+    parser.add_argument("--k", type=int, default=10, help="Neighbors per query for recall@k")
+    parser.add_argument("--distance", default="DOT_PRODUCT_DISTANCE",
+                        choices=["DOT_PRODUCT_DISTANCE", "COSINE_DISTANCE", "SQUARED_L2_DISTANCE"])
+    parser.add_argument("--neighbors", default="50,150,300", help="approximate_neighbors_count values")
+    parser.add_argument("--leaf-sizes", default="500,1000", help="leaf_node_embedding_count values")
+    parser.add_argument("--leaf-percents", default="5,10,20", help="leaf_nodes_to_search_percent values")
+    parser.add_argument("--endpoint", help="Index endpoint resource name, to evaluate a deployed index")
+    parser.add_argument("--deployed-index-id", help="Deployed index id on --endpoint")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Recall the recommendation must reach")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=TUNING_REPORT_FILE)
+    args = parser.parse_args()
+    if bool(args.endpoint) != bool(args.deployed_index_id):
+        parser.error("--endpoint and --deployed-index-id must be given together")
+    if args.k <= 0:
+        parser.error("--k must be positive")
+    if not args.query_file and args.queries <= 0:
+        parser.error("--queries must be positive")
+    neighbor_counts = parse_list(args.neighbors)
+    leaf_sizes = parse_list(args.leaf_sizes)
+    leaf_percents = parse_list(args.leaf_percents, float)
+    if not neighbor_counts or min(neighbor_counts) <= 0:
+        parser.error("--neighbors must be positive integers")
+    if not leaf_sizes or min(leaf_sizes) <= 0:
+        parser.error("--leaf-sizes must be positive integers")
+    if not leaf_percents or not all(0 < percent <= 100 for percent in leaf_percents):
+        parser.error("--leaf-percents must be in (0, 100]")
+
+    ids, corpus = load_embeddings(args.file)
+    # Sampled queries are held out of the corpus, which needs at least one
+    # vector left per query.
+    if len(ids) < (1 if args.query_file else 2):
+        parser.error(f"'{args.file}' holds {len(ids)} embeddings, too few to evaluate")
+    memory = estimate_memory(len(ids), corpus.shape[1] if len(ids) else 0)
+    corpus = prepare(corpus, args.distance)
+    queries, held_out = load_queries(corpus, args.queries, args.query_file, args.seed)
+    queries = prepare(queries, args.distance)
+    query_ids = None
+    if held_out is not None:
+        query_ids = [ids[row] for row in held_out]
+        keep = np.ones(len(ids), dtype=bool)
+        keep[held_out] = False
+        ids, corpus = [chunk_id for chunk_id, kept in zip(ids, keep) if kept], corpus[keep]
+    if not len(queries):
+        parser.error(f"'{args.query_file}' holds no queries")
+    if args.k >= len(ids):
+        parser.error(f"--k must be smaller than the {len(ids)} searched vectors")
+    print(f"Computing exact top-{args.k} for {len(queries)} queries over {len(ids)} vectors...")
+    truth = exact_neighbors(corpus, queries, args.k, args.distance)
+
+    if args.endpoint:
+        print(f"Evaluating deployed index '{args.deployed_index_id}'...")
+        results = evaluate_remote(
+            args.endpoint, args.deployed_index_id, ids, queries, truth, args.k, neighbor_counts, query_ids
+        )
+    else:
+        print("Evaluating simulated tree-AH configurations...")
+        results = evaluate_local(
+            corpus, queries, truth, args.k, args.distance,
+            leaf_sizes, neighbor_counts, leaf_percents,
+        )
+
+    report = {
+        "file": args.file,
+        "distance_measure_type": args.distance,
+        "k": args.k,
+        "queries": len(queries),
+        "mode": "remote" if args.endpoint else "local simulation",
+        "memory": memory,
+        "results": results,
+        "recommended": recommend(results, args.k, args.target_recall),
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Estimated index memory: {memory['estimated_index_gb']} GB, "
+          f"fits on: {', '.join(memory['machine_types_that_fit']) or 'no listed machine type'}.")
+    if report["recommended"]:
+        print(f"Fastest configuration with recall@{args.k} >= {args.target_recall}: {report['recommended']}")
+    else:
+        print(f"No configuration reached recall@{args.k} >= {args.target_recall}.")
+    print(f"Report written to '{args.report}'.")
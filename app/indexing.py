@@ -2,59 +2,174 @@
 
 import vertexai
 from google.cloud import aiplatform, storage
+from google.cloud.aiplatform_v1.types import IndexDatapoint
+import google_crc32c
+import argparse
+import base64
+import json
 import os
+import tempfile
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterator, List, Optional, Set
+
+from chunk_io import Shard, data_file, iter_vector_search_shards, read_chunks
+from embedding import failed_chunk_ids
+from index_manifest import build_manifest, carry_over, diff_manifests, load_manifest, save_manifest
 
 # --- Configuration ---
 PROJECT_ID = os.environ.get("PROJECT_ID", "vertex-ai-co-pilot")
 LOCATION = os.environ.get("REGION", "europe-west4")
 
-EMBEDDED_DATA_FILE = os.environ.get("EMBEDDED_DATA_FILE", "embedded_data.jsonl")
+EMBEDDED_DATA_FILE = os.environ.get("EMBEDDED_DATA_FILE", data_file("embedded_data"))
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", f"{PROJECT_ID}-vector-search-data")
 GCS_UPLOAD_FOLDER = os.environ.get("GCS_UPLOAD_FOLDER", "vector_search/embedded_chunks")
 
+# The embedded data is uploaded as shards of at most this size, in parallel.
+GCS_SHARD_MB = int(os.environ.get("GCS_SHARD_MB", 256))
+GCS_UPLOAD_WORKERS = int(os.environ.get("GCS_UPLOAD_WORKERS", 8))
+# Shards are sent as resumable uploads in pieces of this size (a multiple of 256 KB).
+GCS_UPLOAD_CHUNK_MB = int(os.environ.get("GCS_UPLOAD_CHUNK_MB", 16))
+
 INDEX_DISPLAY_NAME = os.environ.get("INDEX_DISPLAY_NAME", "my_rag_index")
 ENDPOINT_DISPLAY_NAME = os.environ.get("ENDPOINT_DISPLAY_NAME", "my_rag_endpoint")
 
 EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 768))
 
-def upload_data_to_gcs(source_file: str, bucket_name: str, destination_folder: str) -> str:
-    """
-    Uploads a local file to GCS and returns the GCS URI.
-    It also creates the bucket if it doesn't already exist.
-    """
+# Index and serving settings. Run index_tuning.py to see the recall, latency
+# and memory these give on your data before changing them.
+INDEX_APPROXIMATE_NEIGHBORS_COUNT = int(os.environ.get("INDEX_APPROXIMATE_NEIGHBORS_COUNT", 150))
+INDEX_DISTANCE_MEASURE = os.environ.get("INDEX_DISTANCE_MEASURE", "DOT_PRODUCT_DISTANCE")
+INDEX_LEAF_NODE_EMBEDDING_COUNT = int(os.environ.get("INDEX_LEAF_NODE_EMBEDDING_COUNT", 1000))
+INDEX_LEAF_NODES_TO_SEARCH_PERCENT = int(os.environ.get("INDEX_LEAF_NODES_TO_SEARCH_PERCENT", 10))
+INDEX_MACHINE_TYPE = os.environ.get("INDEX_MACHINE_TYPE", "n1-standard-16")
+INDEX_MIN_REPLICAS = int(os.environ.get("INDEX_MIN_REPLICAS", 1))
+INDEX_MAX_REPLICAS = int(os.environ.get("INDEX_MAX_REPLICAS", 2))
+
+# "BATCH_UPDATE" or "STREAM_UPDATE" for new indexes. Streaming indexes apply
+# incremental updates within seconds; batch indexes rebuild from a delta folder.
+INDEX_UPDATE_METHOD = os.environ.get("INDEX_UPDATE_METHOD", "BATCH_UPDATE")
+# Manifest of the datapoints in the index as of the last successful update.
+# It is kept outside GCS_UPLOAD_FOLDER, which Vector Search reads as data.
+INDEX_MANIFEST_BLOB = os.environ.get(
+    "INDEX_MANIFEST_BLOB", f"{os.path.dirname(GCS_UPLOAD_FOLDER)}/deployed_manifest.json"
+)
+# Folder for the delta files of batch updates, one subfolder per update.
+GCS_UPDATE_FOLDER = os.environ.get("GCS_UPDATE_FOLDER", "vector_search/updates")
+# Datapoints per upsert or remove request on streaming indexes.
+INDEX_UPDATE_BATCH_SIZE = int(os.environ.get("INDEX_UPDATE_BATCH_SIZE", 500))
+
+def get_bucket(bucket_name: str) -> storage.Bucket:
+    """Returns the GCS bucket, creating it if it doesn't already exist."""
     storage_client = storage.Client(project=PROJECT_ID)
     try:
-        bucket = storage_client.get_bucket(bucket_name)
+        return storage_client.get_bucket(bucket_name)
     except Exception:
         print(f"Bucket '{bucket_name}' not found. Creating it...")
-        bucket = storage_client.create_bucket(bucket_name, location=LOCATION)
+        return storage_client.create_bucket(bucket_name, location=LOCATION)
 
-    destination_blob_name = os.path.join(destination_folder, os.path.basename(source_file))
-    blob = bucket.blob(destination_blob_name)
-    
-    if blob.exists():
-        print(f"File {destination_blob_name} already exists in GCS. Skipping upload.")
-    else:
-        print(f"Uploading {source_file} to gs://{bucket_name}/{destination_blob_name}...")
-        blob.upload_from_filename(source_file)
-        print("Upload complete.")
-    
-    return f"gs://{bucket_name}/{destination_blob_name}"
+def file_crc32c(path: str, offset: int = 0, size: Optional[int] = None) -> str:
+    """
+    Base64 CRC32C of a local file, or of `size` bytes of it from `offset`,
+    in the format GCS reports for blobs.
+    """
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = os.path.getsize(path) - offset if size is None else size
+        while remaining > 0:
+            block = f.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            checksum.update(block)
+            remaining -= len(block)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+def upload_shard(bucket: storage.Bucket, shard: Shard, blob_name: str) -> bool:
+    """
+    Uploads one shard with a resumable, CRC32C-verified upload. A blob that
+    already has the same checksum is left alone. A temporary shard file is
+    deleted afterwards. Returns True if uploaded.
+    """
+    try:
+        existing = bucket.get_blob(blob_name)
+        if (
+            existing is not None
+            and existing.size == shard.size
+            and existing.crc32c == file_crc32c(shard.path, shard.offset, shard.size)
+        ):
+            return False
+        blob = bucket.blob(blob_name, chunk_size=GCS_UPLOAD_CHUNK_MB * 1024 * 1024)
+        with open(shard.path, "rb") as f:
+            f.seek(shard.offset)
+            blob.upload_from_file(f, size=shard.size, content_type="application/json", checksum="crc32c")
+        return True
+    finally:
+        if shard.temporary:
+            os.remove(shard.path)
+
+def upload_data_to_gcs(source_file: str, bucket_name: str, destination_folder: str) -> str:
+    """
+    Uploads a local file to GCS as size-bounded JSON shards and returns the
+    GCS URI of the shard folder, which is used as the index contents_delta_uri.
+    It also creates the bucket if it doesn't already exist.
+    Shards are uploaded in parallel as soon as they are cut, with at most
+    twice GCS_UPLOAD_WORKERS in flight. Shards already in GCS with a matching
+    checksum are skipped; since shard boundaries are positional, that only
+    saves uploads when records were appended (see iter_vector_search_shards).
+    Stale shards from earlier, larger files are deleted so the folder holds
+    exactly this file's data. A file without records is rejected rather than
+    emptying the folder.
+    """
+    bucket = get_bucket(bucket_name)
+    folder = destination_folder.rstrip("/")
+
+    print(f"Uploading {source_file} to gs://{bucket_name}/{folder}/...")
+    blob_names: List[str] = []
+    uploaded = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(source_file))) as shard_dir, \
+            ThreadPoolExecutor(max_workers=GCS_UPLOAD_WORKERS) as pool:
+        in_flight: Deque[Future] = deque()
+        for shard in iter_vector_search_shards(source_file, shard_dir, GCS_SHARD_MB * 1024 * 1024):
+            blob_names.append(f"{folder}/{shard.name}")
+            in_flight.append(pool.submit(upload_shard, bucket, shard, blob_names[-1]))
+            # Bounds the temporary Parquet shards on disk to the ones in flight.
+            if len(in_flight) >= 2 * GCS_UPLOAD_WORKERS:
+                uploaded += in_flight.popleft().result()
+        uploaded += sum(future.result() for future in in_flight)
+
+    if not blob_names:
+        raise ValueError(
+            f"'{source_file}' has no records; refusing to replace the data in gs://{bucket_name}/{folder}/."
+        )
+
+    current = set(blob_names)
+    stale = [blob for blob in bucket.list_blobs(prefix=f"{folder}/") if blob.name not in current]
+    for blob in stale:
+        blob.delete()
+    print(f"Upload complete. {uploaded} shards uploaded, {len(blob_names) - uploaded} unchanged, "
+          f"{len(stale)} stale shards removed.")
+
+    return f"gs://{bucket_name}/{folder}/"
+
+def find_index() -> Optional[aiplatform.MatchingEngineIndex]:
+    """Returns the index named INDEX_DISPLAY_NAME, or None."""
+    vertexai.init(project=PROJECT_ID, location=LOCATION)
+    # Filter on the server rather than listing every index in the project.
+    for index in aiplatform.matching_engine.MatchingEngineIndex.list(
+        filter=f'display_name="{INDEX_DISPLAY_NAME}"'
+    ):
+        print(f"Found existing index: '{INDEX_DISPLAY_NAME}'.")
+        return index
+    return None
 
 def create_and_deploy_index(gcs_uri: str) -> aiplatform.matching_engine.MatchingEngineIndexEndpoint:
     """
     Creates and deploys a Vertex AI Vector Search index, reusing existing resources.
     """
-    vertexai.init(project=PROJECT_ID, location=LOCATION)
-    
     # 1. Check for an existing Index
-    my_index = None
-    for index in aiplatform.matching_engine.MatchingEngineIndex.list():
-        if index.display_name == INDEX_DISPLAY_NAME:
-            print(f"Found existing index: '{INDEX_DISPLAY_NAME}'.")
-            my_index = index
-            break
+    my_index = find_index()
             
     # 2. If Index exists, check if it's already deployed
     if my_index and my_index.deployed_indexes:
@@ -71,8 +186,11 @@ def create_and_deploy_index(gcs_uri: str) -> aiplatform.matching_engine.Matching
             display_name=INDEX_DISPLAY_NAME,
             contents_delta_uri=gcs_uri,
             dimensions=EMBEDDING_DIMENSIONS,
-            approximate_neighbors_count=150,
-            distance_measure_type="DOT_PRODUCT_DISTANCE",
+            approximate_neighbors_count=INDEX_APPROXIMATE_NEIGHBORS_COUNT,
+            distance_measure_type=INDEX_DISTANCE_MEASURE,
+            leaf_node_embedding_count=INDEX_LEAF_NODE_EMBEDDING_COUNT,
+            leaf_nodes_to_search_percent=INDEX_LEAF_NODES_TO_SEARCH_PERCENT,
+            index_update_method=INDEX_UPDATE_METHOD,
         )
         print("Index creation job sent. Waiting for completion...")
         my_index.wait()
@@ -80,11 +198,12 @@ def create_and_deploy_index(gcs_uri: str) -> aiplatform.matching_engine.Matching
 
     # 4. Check for an existing Endpoint
     my_endpoint = None
-    for endpoint in aiplatform.matching_engine.MatchingEngineIndexEndpoint.list():
-        if endpoint.display_name == ENDPOINT_DISPLAY_NAME:
-            print(f"Found existing endpoint '{ENDPOINT_DISPLAY_NAME}'. Re-using it.")
-            my_endpoint = endpoint
-            break
+    for endpoint in aiplatform.matching_engine.MatchingEngineIndexEndpoint.list(
+        filter=f'display_name="{ENDPOINT_DISPLAY_NAME}"'
+    ):
+        print(f"Found existing endpoint '{ENDPOINT_DISPLAY_NAME}'. Re-using it.")
+        my_endpoint = endpoint
+        break
             
     # 5. If Endpoint does not exist, create it
     if not my_endpoint:
@@ -101,17 +220,127 @@ def create_and_deploy_index(gcs_uri: str) -> aiplatform.matching_engine.Matching
     my_endpoint.deploy_index(
         index=my_index,
         deployed_index_id=deployed_index_id,
-        machine_type="n1-standard-16",
-        min_replica_count=1,
-        max_replica_count=2,
+        machine_type=INDEX_MACHINE_TYPE,
+        min_replica_count=INDEX_MIN_REPLICAS,
+        max_replica_count=INDEX_MAX_REPLICAS,
     )
     print("Index deployment complete.")
     
     return my_endpoint
 
+def iter_datapoints(source_file: str, ids: Set[str]) -> Iterator[Dict]:
+    """Yields the chunks in `source_file` whose id is in `ids`."""
+    for item in read_chunks(source_file):
+        if item["id"] in ids:
+            yield item
+
+def batched(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def stream_update_index(
+    index: aiplatform.MatchingEngineIndex, source_file: str, upserts: Set[str], deletes: List[str]
+) -> None:
+    """Applies the delta to a STREAM_UPDATE index with batched upsert/remove calls."""
+    upserted = 0
+    for batch in batched(iter_datapoints(source_file, upserts), INDEX_UPDATE_BATCH_SIZE):
+        index.upsert_datapoints(
+            datapoints=[
+                IndexDatapoint(datapoint_id=item["id"], feature_vector=item["embedding"])
+                for item in batch
+            ]
+        )
+        upserted += len(batch)
+        print(f"  - Upserted {upserted}/{len(upserts)} datapoints.")
+    for batch in batched(iter(deletes), INDEX_UPDATE_BATCH_SIZE):
+        index.remove_datapoints(datapoint_ids=batch)
+    if deletes:
+        print(f"  - Removed {len(deletes)} datapoints.")
+
+def batch_update_index(
+    index: aiplatform.MatchingEngineIndex,
+    bucket: storage.Bucket,
+    source_file: str,
+    upserts: Set[str],
+    deletes: List[str],
+) -> None:
+    """
+    Applies the delta to a BATCH_UPDATE index. Only the changed datapoints are
+    uploaded, to a new folder, with removed ids listed in its delete/ subfolder.
+    """
+    folder = f"{GCS_UPDATE_FOLDER}/{int(time.time())}"
+    if upserts:
+        with bucket.blob(f"{folder}/upserts.json").open("w") as outfile:
+            for item in iter_datapoints(source_file, upserts):
+                outfile.write(json.dumps(item) + "\n")
+    if deletes:
+        bucket.blob(f"{folder}/delete/deletes.txt").upload_from_string("\n".join(deletes) + "\n")
+    delta_uri = f"gs://{bucket.name}/{folder}"
+    print(f"Updating index from {delta_uri}. This rebuilds the changed partitions...")
+    index.update_embeddings(contents_delta_uri=delta_uri, is_complete_overwrite=False)
+
+def update_index(
+    index: aiplatform.MatchingEngineIndex,
+    source_file: str,
+    bucket_name: str,
+    unresolved: Optional[Set[str]] = None,
+) -> None:
+    """
+    Brings an existing index in line with `source_file` by diffing it against
+    the manifest of the last update and applying only the difference.
+    Chunks in `unresolved`, by default those in the embedding dead-letter
+    file, failed to embed rather than disappeared, so they are not deleted.
+    """
+    bucket = get_bucket(bucket_name)
+    current = build_manifest(source_file)
+    deployed = load_manifest(bucket, INDEX_MANIFEST_BLOB)
+    if deployed is None:
+        print("No deployed manifest found. Upserting every datapoint; stale ones cannot be detected.")
+        deployed = {}
+    if unresolved is None:
+        unresolved = failed_chunk_ids()
+    upserts, deletes = diff_manifests(deployed, current, unresolved)
+    print(f"Index delta: {len(upserts)} added or changed, {len(deletes)} removed, "
+          f"{len(current) - len(upserts)} unchanged, {len(unresolved)} failed to embed and kept.")
+    if not upserts and not deletes:
+        print("Index is already up to date.")
+        return
+
+    if index.gca_resource.index_update_method.name == "STREAM_UPDATE":
+        stream_update_index(index, source_file, upserts, deletes)
+    else:
+        batch_update_index(index, bucket, source_file, upserts, deletes)
+    save_manifest(bucket, INDEX_MANIFEST_BLOB, carry_over(deployed, current, unresolved))
+    print("Index update complete.")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload embeddings and create or update the index.")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "full", "update"],
+        default="auto",
+        help="'full' uploads everything and creates/deploys the index, 'update' applies only "
+        "the changes since the last update to the existing index, 'auto' updates if the index exists",
+    )
+    args = parser.parse_args()
+
     if not os.path.exists(EMBEDDED_DATA_FILE):
         print(f"❌ Error: The file '{EMBEDDED_DATA_FILE}' was not found. Please run embedding.py first.")
+        raise SystemExit(1)
+
+    existing_index = find_index()
+    if existing_index is not None and args.mode != "full":
+        update_index(existing_index, EMBEDDED_DATA_FILE, GCS_BUCKET_NAME)
+        for deployed_index in existing_index.deployed_indexes:
+            print(f"✅ Updated index is served by: {deployed_index.index_endpoint}")
+    elif args.mode == "update":
+        print(f"❌ Error: Index '{INDEX_DISPLAY_NAME}' not found. Run with --mode full first.")
     else:
         gcs_data_path = upload_data_to_gcs(
             source_file=EMBEDDED_DATA_FILE,
@@ -120,6 +349,11 @@ if __name__ == "__main__":
         )
 
         index_endpoint = create_and_deploy_index(gcs_data_path)
+        if existing_index is None:
+            # The new index holds exactly this file, so later runs can diff against it.
+            save_manifest(
+                get_bucket(GCS_BUCKET_NAME), INDEX_MANIFEST_BLOB, build_manifest(EMBEDDED_DATA_FILE)
+            )
         print(f"✅ Index endpoint ready: {index_endpoint.resource_name}")
         if index_endpoint.public_endpoint_domain_name:
             print(f"🌍 Public endpoint domain: {index_endpoint.public_endpoint_domain_name}")
\ No newline at end of file
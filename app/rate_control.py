@@ -0,0 +1,215 @@
+# app/rate_control.py
+
+"""
+Quota-aware concurrency for embedding requests.
+
+RateController combines a token bucket (requests per second) with an
+additive-increase/multiplicative-decrease (AIMD) window on the number of
+requests in flight: every successful request widens the window a little,
+and a 429 / RESOURCE_EXHAUSTED response halves it. Throttled and transient
+failures are retried with jittered exponential backoff; any other error is
+raised immediately.
+
+ordered_map() runs a function over a stream of items on a thread pool,
+keeping at most `window` requests in flight, and yields results in input
+order.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+T = TypeVar("T")
+
+# --- Configuration ---
+# Upper bound on concurrent embedding requests.
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 32))
+# In-flight window at start-up. AIMD moves it between 1 and the maximum.
+EMBEDDING_INITIAL_CONCURRENCY = int(os.environ.get("EMBEDDING_INITIAL_CONCURRENCY", 4))
+# Request quota for the embedding model, enforced locally by the token bucket.
+EMBEDDING_QUOTA_RPM = float(os.environ.get("EMBEDDING_QUOTA_RPM", 1500))
+
+THROTTLE_RETRIES = 8
+TRANSIENT_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# Throttles within this many seconds of a decrease count as the same event,
+# so one burst of 429s from every in-flight request halves the window once.
+DECREASE_COOLDOWN_SECONDS = 2.0
+
+_THROTTLE_ERRORS = (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)
+_TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.BadGateway,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """True for quota / rate-limit responses (HTTP 429, gRPC RESOURCE_EXHAUSTED)."""
+    return isinstance(error, _THROTTLE_ERRORS)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """True for server-side or network failures that are worth retrying."""
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket. acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class RateController:
+    """AIMD in-flight window plus token bucket, shared by all request threads."""
+
+    def __init__(
+        self,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        initial_concurrency: int = EMBEDDING_INITIAL_CONCURRENCY,
+        requests_per_minute: float = EMBEDDING_QUOTA_RPM,
+    ):
+        self.max_concurrency = max_concurrency
+        self._window = float(min(initial_concurrency, max_concurrency))
+        self._bucket = (
+            TokenBucket(requests_per_minute / 60, capacity=max_concurrency)
+            if requests_per_minute > 0
+            else None
+        )
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._started = time.monotonic()
+        self.requests = 0
+        self.items = 0
+        self.throttles = 0
+        self.retries = 0
+        self.peak_window = self._window
+
+    @property
+    def window(self) -> int:
+        """Number of requests allowed in flight right now."""
+        return max(1, int(self._window))
+
+    def _on_success(self, items: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.items += items
+            # +1 request per window's worth of successes.
+            self._window = min(self.max_concurrency, self._window + 1 / self._window)
+            self.peak_window = max(self.peak_window, self._window)
+
+    def _on_throttle(self) -> None:
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                self._window = max(1.0, self._window / 2)
+                self._last_decrease = now
+
+    def call(self, request: Callable[[], T], items: int = 1) -> T:
+        """
+        Runs `request` under the rate limit, retrying throttled and transient
+        failures. `items` is the number of texts in the request, for reporting.
+        """
+        throttled = transient = 0
+        while True:
+            if self._bucket is not None:
+                self._bucket.acquire()
+            try:
+                result = request()
+            except Exception as e:
+                if is_throttle_error(e) and throttled < THROTTLE_RETRIES:
+                    self._on_throttle()
+                    attempt = throttled = throttled + 1
+                elif is_transient_error(e) and transient < TRANSIENT_RETRIES:
+                    attempt = transient = transient + 1
+                else:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                # Full jitter keeps retries from every thread from re-aligning.
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+                print(f"Embedding request failed: {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            self._on_success(items)
+            return result
+
+    def report(self) -> str:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return (
+            f"{self.requests} requests ({self.requests / elapsed:.2f} req/s), "
+            f"{self.items} texts ({self.items / elapsed:.1f} texts/s), "
+            f"{self.throttles} throttled, {self.retries} retries, "
+            f"window {self.window} (peak {int(self.peak_window)})"
+        )
+
+
+def ordered_map(
+    func: Callable[[T], Any],
+    items: Iterable[T],
+    controller: RateController,
+    max_buffered: Optional[int] = None,
+) -> Iterator[Tuple[T, Any, Optional[BaseException]]]:
+    """
+    Applies `func` to `items` on a thread pool and yields (item, result, error)
+    in input order. At most `controller.window` calls run at once, and at most
+    `max_buffered` results wait for an earlier, slower call to finish.
+    """
+    max_buffered = max_buffered or 4 * controller.max_concurrency
+    iterator = iter(items)
+    exhausted = False
+    pending: deque = deque()
+
+    with ThreadPoolExecutor(max_workers=controller.max_concurrency) as pool:
+        while True:
+            in_flight = sum(not future.done() for _, future in pending)
+            while not exhausted and in_flight < controller.window and len(pending) < max_buffered:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, pool.submit(func, item)))
+                in_flight += 1
+
+            if not pending:
+                return
+
+            while pending and pending[0][1].done():
+                item, future = pending.popleft()
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+
+            running = [future for _, future in pending if not future.done()]
+            if running:
+                wait(running, return_when=FIRST_COMPLETED)
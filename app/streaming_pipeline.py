@@ -0,0 +1,391 @@
+# app/streaming_pipeline.py
+
+"""
+Streaming ingest -> embed -> index pipeline.
+
+Runs the stages of data_ingestion.py, embedding.py and indexing.py at the
+same time instead of one after another. Each stage runs on its own thread
+and hands items to the next through a bounded queue, so a slow stage makes
+the stages before it wait (backpressure) instead of piling data up in memory.
+A full refresh then takes about as long as its slowest stage.
+
+    fetch --docs--> chunk --chunks--> dedup --unique--> embed --embedded--> write --upserts--> index
+
+- fetch: downloads the configured URLs (or generates a synthetic corpus).
+- chunk: splits documents on the chunking process pool.
+- dedup: drops near-duplicate chunks with the MinHash LSH of dedup.py, so
+  the same chunks are indexed as on the batch path. The kept chunk has
+  already moved on when a duplicate arrives, so unlike dedup.py the
+  duplicates' sources are not merged into its metadata. --no-dedup skips
+  the stage.
+- embed: embeds chunks with the adaptive batcher, the rate controller and
+  the embedding cache, as embedding.py does.
+- write: writes EMBEDDED_DATA_FILE, so the usual tools still work on it.
+- index (optional): upserts new and changed datapoints into a STREAM_UPDATE
+  index as they arrive, then deletes chunks that disappeared from the source
+  (not those that only failed to embed). Batch-update
+  indexes are updated from the finished file.
+
+Throughput and queue depths are printed every PIPELINE_REPORT_SECONDS, and
+a per-stage summary at the end. A stage's wait times show where the
+bottleneck is: it waits neither for input nor for room downstream.
+
+    python app/streaming_pipeline.py
+    python app/streaming_pipeline.py --index
+    EMBEDDING_BACKEND=offline python app/streaming_pipeline.py --synthetic-mb 512
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import argparse
+import os
+import queue
+import threading
+import time
+
+from checkpoint import DeadLetterFile
+from chunk_io import ChunkWriter
+from chunking import CHUNKING_WORKERS, chunk_documents, synthetic_corpus
+from data_ingestion import CHUNK_OVERLAP, CHUNK_SIZE, URLS_TO_INGEST, chunk_id, fetch_documents
+from dedup import MinHashDeduplicator
+from embedding import DEAD_LETTER_FILE, EMBEDDED_DATA_FILE, embed_items, load_embedding_model, open_cache
+
+# --- Configuration ---
+# Capacity of the queue between fetching and chunking, in documents.
+PIPELINE_DOCUMENT_QUEUE_SIZE = int(os.environ.get("PIPELINE_DOCUMENT_QUEUE_SIZE", 16))
+# Capacity of the other queues, in chunks.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 2000))
+PIPELINE_REPORT_SECONDS = float(os.environ.get("PIPELINE_REPORT_SECONDS", 10))
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised in a stage when another stage has failed."""
+
+
+class Stage:
+    """Counters for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[BaseException] = None
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed(), 1e-9)
+        return (
+            f"{self.name:>6}: {self.items} items in {elapsed:.1f}s ({self.items / elapsed:.1f}/s), "
+            f"waited {self.input_wait:.1f}s for input, {self.output_wait:.1f}s for downstream"
+        )
+
+
+class Channel:
+    """Bounded queue between two stages that records its depth."""
+
+    def __init__(self, name: str, capacity: int, stop: threading.Event):
+        self.name = name
+        self.capacity = capacity
+        self._queue: queue.Queue = queue.Queue(maxsize=capacity)
+        self._stop = stop
+        self.max_depth = 0
+        self._depth_total = 0
+        self._samples = 0
+
+    def put(self, item: Any, stage: Stage) -> None:
+        started = time.monotonic()
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        stage.output_wait += time.monotonic() - started
+
+    def close(self, stage: Stage) -> None:
+        self.put(_DONE, stage)
+
+    def iterate(self, stage: Stage) -> Iterator[Any]:
+        """Yields items until the upstream stage closes the channel."""
+        while True:
+            started = time.monotonic()
+            while True:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+                try:
+                    item = self._queue.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+            stage.input_wait += time.monotonic() - started
+            if item is _DONE:
+                return
+            yield item
+
+    def sample(self) -> int:
+        depth = self._queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_total += depth
+        self._samples += 1
+        return depth
+
+    def summary(self) -> str:
+        average = self._depth_total / self._samples if self._samples else 0.0
+        return f"{self.name:>8}: max depth {self.max_depth}/{self.capacity}, average {average:.0f}"
+
+
+class ChannelWriter:
+    """ChunkWriter stand-in that passes embedded items on to the next stage."""
+
+    def __init__(self, channel: Channel, stage: Stage):
+        self.channel = channel
+        self.stage = stage
+
+    def write(self, item: Dict[str, Any]) -> None:
+        self.stage.items += 1
+        self.channel.put(item, self.stage)
+
+
+class StreamingPipeline:
+    """Runs the stages on threads connected by bounded channels."""
+
+    def __init__(self, documents: Iterable[Dict[str, Any]], index_sink: bool = False, dedup: bool = True):
+        self.documents = documents
+        self.index_sink = index_sink
+        self.dedup = dedup
+        self.stop = threading.Event()
+        stage_names = ("fetch", "chunk", "dedup", "embed", "write") if dedup else ("fetch", "chunk", "embed", "write")
+        self.stages = {name: Stage(name) for name in stage_names}
+        self.channels = {
+            "docs": Channel("docs", PIPELINE_DOCUMENT_QUEUE_SIZE, self.stop),
+            "chunks": Channel("chunks", PIPELINE_QUEUE_SIZE, self.stop),
+        }
+        if dedup:
+            self.channels["unique"] = Channel("unique", PIPELINE_QUEUE_SIZE, self.stop)
+        self.channels["embedded"] = Channel("embedded", PIPELINE_QUEUE_SIZE, self.stop)
+        self.duplicates = 0
+        if index_sink:
+            self.stages["index"] = Stage("index")
+            self.channels["upserts"] = Channel("upserts", PIPELINE_QUEUE_SIZE, self.stop)
+        self.streamed_to_index = False
+
+    def _run_stage(self, name: str, body: Callable[[Stage], None]) -> threading.Thread:
+        stage = self.stages[name]
+
+        def target() -> None:
+            stage.started = time.monotonic()
+            try:
+                body(stage)
+            except PipelineStopped:
+                pass
+            except BaseException as e:
+                stage.error = e
+                self.stop.set()
+                print(f"Stage '{name}' failed: {e!r}")
+            finally:
+                stage.finished = time.monotonic()
+
+        thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _fetch(self, stage: Stage) -> None:
+        out = self.channels["docs"]
+        for document in self.documents:
+            stage.items += 1
+            out.put(document, stage)
+        out.close(stage)
+
+    def _chunk(self, stage: Stage) -> None:
+        out = self.channels["chunks"]
+        for document, chunks in chunk_documents(
+            self.channels["docs"].iterate(stage),
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            max_workers=CHUNKING_WORKERS,
+        ):
+            for index, chunk in enumerate(chunks):
+                item = {
+                    "id": chunk_id(document["source"], index),
+                    "text": chunk,
+                    "source": document["source"],
+                    "title": document["title"],
+                }
+                stage.items += 1
+                out.put(item, stage)
+        out.close(stage)
+
+    def _dedup(self, stage: Stage) -> None:
+        out = self.channels["unique"]
+        deduplicator = MinHashDeduplicator()
+        for item in self.channels["chunks"].iterate(stage):
+            if deduplicator.add(item["text"]) is not None:
+                self.duplicates += 1
+                continue
+            stage.items += 1
+            out.put(item, stage)
+        out.close(stage)
+
+    def _embed(self, stage: Stage) -> None:
+        out = self.channels["embedded"]
+        chunks = self.channels["unique" if self.dedup else "chunks"]
+        model = load_embedding_model()
+        dead_letters = DeadLetterFile(DEAD_LETTER_FILE)
+        dead_letters.reset()
+        cache = open_cache()
+        try:
+            entries = ((item, None) for item in chunks.iterate(stage))
+            embed_items(model, entries, ChannelWriter(out, stage), dead_letters, None, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+        out.close(stage)
+
+    def _write(self, stage: Stage) -> None:
+        upserts = self.channels.get("upserts")
+        with ChunkWriter(EMBEDDED_DATA_FILE) as writer:
+            for item in self.channels["embedded"].iterate(stage):
+                writer.write(item)
+                stage.items += 1
+                if upserts is not None:
+                    upserts.put(item, stage)
+        if upserts is not None:
+            upserts.close(stage)
+
+    def _index(self, stage: Stage) -> None:
+        from indexing import (
+            GCS_BUCKET_NAME,
+            INDEX_MANIFEST_BLOB,
+            INDEX_UPDATE_BATCH_SIZE,
+            IndexDatapoint,
+            find_index,
+            get_bucket,
+        )
+        from embedding import failed_chunk_ids
+        from index_manifest import carry_over, datapoint_hash, load_manifest, save_manifest
+
+        items = self.channels["upserts"].iterate(stage)
+        index = find_index()
+        if index is None or index.gca_resource.index_update_method.name != "STREAM_UPDATE":
+            # Only streaming indexes take upserts; the rest is updated from the file.
+            for _ in items:
+                pass
+            return
+
+        bucket = get_bucket(GCS_BUCKET_NAME)
+        deployed = load_manifest(bucket, INDEX_MANIFEST_BLOB) or {}
+        current: Dict[str, str] = {}
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            index.upsert_datapoints(
+                datapoints=[
+                    IndexDatapoint(datapoint_id=item["id"], feature_vector=item["embedding"])
+                    for item in batch
+                ]
+            )
+            stage.items += len(batch)
+            batch.clear()
+
+        for item in items:
+            digest = datapoint_hash(item)
+            current[item["id"]] = digest
+            if deployed.get(item["id"]) != digest:
+                batch.append(item)
+                if len(batch) >= INDEX_UPDATE_BATCH_SIZE:
+                    flush()
+        if batch:
+            flush()
+
+        # The embed stage has finished once the upserts run out, so the dead-letter
+        # file is complete. Those chunks failed to embed; their source still has them.
+        unresolved = failed_chunk_ids()
+        removed = [
+            chunk_id for chunk_id in deployed if chunk_id not in current and chunk_id not in unresolved
+        ]
+        for start in range(0, len(removed), INDEX_UPDATE_BATCH_SIZE):
+            index.remove_datapoints(datapoint_ids=removed[start : start + INDEX_UPDATE_BATCH_SIZE])
+        save_manifest(bucket, INDEX_MANIFEST_BLOB, carry_over(deployed, current, unresolved))
+        print(f"Streamed {stage.items} upserts and {len(removed)} deletions to the index.")
+        self.streamed_to_index = True
+
+    def _progress(self) -> str:
+        stages = " | ".join(f"{stage.name} {stage.items}" for stage in self.stages.values())
+        depths = " ".join(
+            f"{channel.name} {channel.sample()}/{channel.capacity}" for channel in self.channels.values()
+        )
+        return f"[{time.monotonic() - self._started:6.0f}s] {stages} || queues: {depths}"
+
+    def run(self) -> None:
+        self._started = time.monotonic()
+        bodies = {
+            "fetch": self._fetch,
+            "chunk": self._chunk,
+            "dedup": self._dedup,
+            "embed": self._embed,
+            "write": self._write,
+            "index": self._index,
+        }
+        threads = [self._run_stage(name, bodies[name]) for name in self.stages]
+
+        last_report = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+            for channel in self.channels.values():
+                channel.sample()
+            if time.monotonic() - last_report >= PIPELINE_REPORT_SECONDS:
+                print(self._progress())
+                last_report = time.monotonic()
+
+        total = time.monotonic() - self._started
+        print(f"\nPipeline finished in {total:.1f}s.")
+        for stage in self.stages.values():
+            print(stage.summary())
+        for channel in self.channels.values():
+            print(channel.summary())
+        if self.dedup:
+            print(f"Removed {self.duplicates} near-duplicate chunks.")
+
+        errors = [stage.error for stage in self.stages.values() if stage.error is not None]
+        if errors:
+            raise errors[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ingestion, embedding and indexing as one streaming pipeline.")
+    parser.add_argument("--index", action="store_true", help="Also update the Vector Search index")
+    parser.add_argument(
+        "--synthetic-mb", type=int, help="Use a synthetic corpus of this size instead of fetching URLS_TO_INGEST"
+    )
+    parser.add_argument(
+        "--no-dedup", action="store_true", help="Skip near-duplicate removal (dedup.py) between chunking and embedding"
+    )
+    args = parser.parse_args()
+
+    documents = synthetic_corpus(args.synthetic_mb) if args.synthetic_mb else fetch_documents(URLS_TO_INGEST)
+    pipeline = StreamingPipeline(documents, index_sink=args.index, dedup=not args.no_dedup)
+    pipeline.run()
+
+    failed = len(DeadLetterFile(DEAD_LETTER_FILE).read())
+    if failed:
+        print(f"{failed} items failed to embed. Run 'python embedding.py retry' to retry them.")
+    if args.index and not pipeline.streamed_to_index:
+        from indexing import GCS_BUCKET_NAME, find_index, update_index
+
+        index = find_index()
+        if index is None:
+            print("No index found. Run 'python indexing.py --mode full' to create one.")
+        else:
+            update_index(index, EMBEDDED_DATA_FILE, GCS_BUCKET_NAME)
+    print(f"'{EMBEDDED_DATA_FILE}' written.")
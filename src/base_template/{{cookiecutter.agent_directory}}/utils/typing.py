@@ -35,6 +35,7 @@ from pydantic import (
 )
 {%- endif %}
 {%- else %}
+import functools
 import json
 import uuid
 from typing import (
@@ -43,9 +44,11 @@ from typing import (
     Literal,
 )
 
+import orjson
 from langchain_core.load.serializable import Serializable
 from langchain_core.messages import (
     AIMessage,
+    BaseMessage,
     HumanMessage,
     ToolMessage,
 )
@@ -124,21 +127,95 @@ def ensure_valid_config(config: RunnableConfig | None) -> RunnableConfig:
     return config
 
 
+MessageLayout = tuple[list[str], tuple[tuple[str, bool, Any, Any], ...]]
+
+
+@functools.cache
+def _message_layout(cls: type[Serializable]) -> MessageLayout | None:
+    """
+    Cached constructor layout of a message class: its lc_id and, for each
+    field, (name, required, empty container type, default).
+    Returns None for classes that need the generic Serializable.to_json().
+    """
+    if (
+        not issubclass(cls, BaseMessage)
+        or cls.to_json is not Serializable.to_json
+        or not cls.is_lc_serializable()
+        or any("lc_secrets" in vars(c) for c in cls.mro() if c is not Serializable)
+    ):
+        return None
+    fields = []
+    for name, field in cls.model_fields.items():
+        if field.exclude:
+            continue
+        required = field.is_required()
+        empty_type = (
+            field.default_factory if field.default_factory in (dict, list) else ()
+        )
+        default = None if required else field.get_default(call_default_factory=True)
+        fields.append((name, required, empty_type, default))
+    return cls.lc_id(), tuple(fields)
+
+
+def _message_to_json(message: BaseMessage, layout: MessageLayout) -> dict[str, Any]:
+    """
+    Same output as message.to_json(), using the cached layout of its class.
+    Fields left at their defaults are omitted, as in Serializable.to_json().
+    """
+    lc_id, fields = layout
+    values = message.__dict__
+    kwargs = {}
+    for name, required, empty_type, default in fields:
+        value = values[name]
+        if not required:
+            try:
+                truthy = bool(value)
+            except Exception:
+                truthy = False
+            if not truthy:
+                if isinstance(value, empty_type):
+                    continue
+                try:
+                    if not default != value:
+                        continue
+                except Exception:
+                    pass
+        kwargs[name] = value
+    kwargs.update(message.lc_attributes)
+    return {"lc": 1, "type": "constructor", "id": lc_id, "kwargs": kwargs}
+
+
 def default_serialization(obj: Any) -> Any:
     """
     Default serialization for LangChain objects.
     Converts BaseModel instances to JSON strings.
     """
     if isinstance(obj, Serializable):
+        layout = _message_layout(type(obj))
+        if layout is not None:
+            return _message_to_json(obj, layout)  # type: ignore[arg-type]
         return obj.to_json()
 
 
+def _dumpb(obj: Any) -> bytes:
+    """Serialize an object to JSON bytes with orjson."""
+    try:
+        return orjson.dumps(
+            obj, default=default_serialization, option=orjson.OPT_NON_STR_KEYS
+        )
+    except orjson.JSONEncodeError:
+        # e.g. integers wider than 64 bits, which only the stdlib encoder handles
+        return json.dumps(obj, default=default_serialization).encode()
+
+
 def dumps(obj: Any) -> str:
     """
     Serialize an object to a JSON string.
 
     For LangChain objects (BaseModel instances), it converts them to
-    dictionaries before serialization.
+    dictionaries before serialization. Message chunks, which make up most of
+    a streamed response, take a fast path that reuses a per-class field
+    layout instead of calling to_json() on every chunk.
 
     Args:
         obj: The object to serialize
@@ -146,7 +223,7 @@ def dumps(obj: Any) -> str:
     Returns:
         JSON string representation of the object
     """
-    return json.dumps(obj, default=default_serialization)
+    return _dumpb(obj).decode()
 {%- if cookiecutter.deployment_target == 'agent_engine' %}
 
 
@@ -161,6 +238,6 @@ def dumpd(obj: Any) -> Any:
     Returns:
         Dict/list representation of the object that can be JSON serialized
     """
-    return json.loads(dumps(obj))
+    return orjson.loads(_dumpb(obj))
 {%- endif %}
 {% endif %}
\ No newline at end of file
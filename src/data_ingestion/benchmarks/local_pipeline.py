@@ -0,0 +1,128 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ruff: noqa
+
+"""Benchmark of the data ingestion pipeline on the local runner.
+
+Generates a synthetic StackOverflow-shaped dataset, runs the pipeline steps
+on DuckDB with the offline embedder and a local datastore sink, and reports
+the time spent in each step. A second run over the same data measures the
+incremental path, where unchanged chunks reuse their embeddings:
+
+    uv run --with duckdb --with html2text --with langchain-text-splitters \\
+        python benchmarks/local_pipeline.py --questions 20000 --days 30 --shard-days 7
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_ingestion_pipeline.local_runner import DEFAULT_DATASTORE, LocalRunner
+
+WORDS = (
+    "python list dict pandas dataframe numpy array function class module import "
+    "error exception loop iterate index value key string int float return yield "
+    "async await thread process memory performance file path json csv sql query "
+    "regex parse format print debug test assert install package version virtualenv"
+).split()
+
+
+def paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def html_body(rng: random.Random, paragraphs: int) -> str:
+    """HTML shaped like a StackOverflow post: paragraphs, code blocks and lists."""
+    parts = []
+    for _ in range(paragraphs):
+        kind = rng.random()
+        if kind < 0.6:
+            parts.append(f"<p>{paragraph(rng, rng.randint(15, 60))} <code>{rng.choice(WORDS)}()</code></p>")
+        elif kind < 0.85:
+            lines = "\n".join(
+                f"    {rng.choice(WORDS)} = {rng.choice(WORDS)}({rng.randint(0, 99)})"
+                for _ in range(rng.randint(3, 15))
+            )
+            parts.append(f"<pre><code>def {rng.choice(WORDS)}():\n{lines}\n</code></pre>")
+        else:
+            items = "".join(f"<li>{paragraph(rng, rng.randint(4, 12))}</li>" for _ in range(rng.randint(2, 5)))
+            parts.append(f"<ul>{items}</ul>")
+    return "\n".join(parts)
+
+
+def make_dataset(path: str, questions: int, days: int, end: datetime, seed: int = 0) -> None:
+    """Write a synthetic questions table; ~5% of questions have a second edit."""
+    rng = random.Random(seed)
+    rows: dict[str, list] = {
+        "creation_date": [],
+        "last_edit_date": [],
+        "question_id": [],
+        "question_title": [],
+        "question_body": [],
+        "answers": [],
+    }
+    for question_id in range(1, questions + 1):
+        created = end - timedelta(seconds=rng.randint(0, days * 86400 - 1))
+        edits = 2 if rng.random() < 0.05 else 1
+        for edit in range(edits):
+            rows["creation_date"].append(created)
+            rows["last_edit_date"].append(created + timedelta(hours=edit))
+            rows["question_id"].append(question_id)
+            rows["question_title"].append(paragraph(rng, rng.randint(5, 12)))
+            rows["question_body"].append(html_body(rng, rng.randint(1, 6)))
+            rows["answers"].append(
+                [{"body": html_body(rng, rng.randint(1, 5))} for _ in range(rng.randint(0, 4))]
+            )
+    pq.write_table(pa.table(rows), path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=7, help="Days spanned by the questions")
+    parser.add_argument("--shard-days", type=int, default=0)
+    parser.add_argument("--markdown-workers", type=int, default=0)
+    parser.add_argument("--datastore-type", default=DEFAULT_DATASTORE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    end = datetime(2020, 1, 1)
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "questions.parquet")
+        make_dataset(source, args.questions, args.days, end, args.seed)
+        megabytes = os.path.getsize(source) / 1024 / 1024
+        print(f"{args.questions} questions over {args.days} days ({megabytes:.1f} MB of Parquet)")
+
+        runner = LocalRunner(
+            source,
+            workdir,
+            datastore_type=args.datastore_type,
+            markdown_workers=args.markdown_workers,
+        )
+        for name in ("initial run", "rerun"):
+            timings = runner.run(
+                end.date(), look_back_days=args.days, shard_days=args.shard_days
+            )
+            print(f"\n{name}: {runner.counts}")
+            for step, seconds in timings.items():
+                print(f"{step:>10}: {seconds:8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ruff: noqa
+
+"""Benchmark of the HTML to markdown step of the process_data component.
+
+Compares the previous conversion (markdownify, one row at a time) with the
+batched conversion used by process_data (html2text on a process pool) over a
+sample of StackOverflow rows.
+
+The sample is read from the public StackOverflow table used by the pipeline,
+or from a JSONL file with `question_text` and `answers` fields:
+
+    uv run --with html2text --with markdownify python benchmarks/markdown_conversion.py \\
+        --project-id $PROJECT_ID --rows 5000
+    uv run --with html2text python benchmarks/markdown_conversion.py --sample-file sample.jsonl --workers 1,4,8
+"""
+
+import argparse
+import functools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import html2text
+
+SOURCE_TABLE = "production-ai-template.stackoverflow_qa_{suffix}.stackoverflow_python_questions_and_answers"
+
+
+def load_rows(args: argparse.Namespace) -> list[dict]:
+    if args.sample_file:
+        with open(args.sample_file) as f:
+            return [json.loads(line) for line in f][: args.rows]
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=args.project_id, location=args.location)
+    table = SOURCE_TABLE.format(suffix=args.location.lower().replace("-", "_"))
+    query = f"SELECT question_body AS question_text, answers FROM `{table}` LIMIT {args.rows}"
+    return [dict(row) for row in client.query(query).result()]
+
+
+def flatten(rows: list[dict]) -> list[str]:
+    htmls = [row["question_text"] or "" for row in rows]
+    for row in rows:
+        htmls.extend(answer["body"] or "" for answer in row["answers"])
+    return htmls
+
+
+def run_markdownify(htmls: list[str], workers: int) -> None:
+    from markdownify import markdownify
+
+    for html in htmls:
+        markdownify(html).strip()
+
+
+def run_html2text(htmls: list[str], workers: int) -> None:
+    convert = functools.partial(html2text.html2text, bodywidth=0)
+    if workers <= 1:
+        for html in htmls:
+            convert(html).strip()
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(htmls) // (workers * 4))
+        for md in pool.map(convert, htmls, chunksize=chunksize):
+            md.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--project-id", default=os.environ.get("PROJECT_ID"))
+    parser.add_argument("--location", default="us-central1")
+    parser.add_argument("--sample-file", help="JSONL file with question_text and answers")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        default=f"1,{os.cpu_count()}",
+        help="Comma-separated process counts for the batched conversion",
+    )
+    args = parser.parse_args()
+
+    rows = load_rows(args)
+    htmls = flatten(rows)
+    megabytes = sum(len(html) for html in htmls) / 1024 / 1024
+    print(f"{len(rows)} questions, {len(htmls)} HTML fields, {megabytes:.1f} MB")
+
+    runs = [("markdownify, serial", run_markdownify, 1)]
+    runs += [
+        (f"html2text, {workers} process(es)", run_html2text, workers)
+        for workers in (int(w) for w in args.workers.split(","))
+    ]
+    baseline = None
+    for name, run, workers in runs:
+        try:
+            started = time.perf_counter()
+            run(htmls, workers)
+            elapsed = time.perf_counter() - started
+        except ImportError as e:
+            print(f"{name:>28}: skipped ({e})")
+            continue
+        baseline = baseline or elapsed
+        print(
+            f"{name:>28}: {elapsed:7.2f}s  {len(rows) / elapsed:8.0f} questions/s  "
+            f"{megabytes / elapsed:6.2f} MB/s  {baseline / elapsed:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,7 @@
 # limitations under the License.
 # ruff: noqa
 
-from kfp.dsl import Dataset, Input, component
+from kfp.dsl import Dataset, Input, Metrics, Output, component
 {% if cookiecutter.datastore_type == "vertex_ai_search" %}
 
 @component(
@@ -26,6 +26,8 @@ def ingest_data(
     data_store_id: str,
     embedding_dimension: int = 768,
     embedding_column: str = "embedding",
+    readiness_timeout_seconds: int = 1800,
+    readiness_probe_documents: int = 5,
 ) -> None:
     """Process and ingest documents into Vertex AI Search datastore.
 
@@ -35,13 +37,18 @@ def ingest_data(
         input_files: Input dataset containing documents
         data_store_id: ID of target datastore
         embedding_column: Name of embedding column in schema
+        readiness_timeout_seconds: How long to wait for imported data to be searchable
+        readiness_probe_documents: Imported documents that must be searchable
+            before the data is considered ready
     """
+    import gzip
+    import itertools
     import json
     import logging
     import time
 
     from google.api_core.client_options import ClientOptions
-    from google.cloud import discoveryengine
+    from google.cloud import discoveryengine, storage
 
     def update_schema_as_json(
         original_schema: str,
@@ -153,6 +160,92 @@ def ingest_data(
         logging.info(f"Waiting for import operation: {operation.operation.name}")
         operation.result()
 
+    def read_probe_documents(input_files_uri: str, count: int) -> list[dict]:
+        """Read up to `count` imported documents, spread over the exported files.
+
+        Args:
+            input_files_uri: URI of input files, e.g. gs://bucket/path/*.jsonl.gz
+            count: Number of documents to read
+
+        Returns:
+            The documents' ids and contents, empty if no document was exported
+        """
+        bucket_name, _, pattern = input_files_uri.removeprefix("gs://").partition("/")
+        prefix = pattern.split("*", 1)[0]
+        blobs = [
+            blob
+            for blob in storage.Client(project=project_id).list_blobs(
+                bucket_name, prefix=prefix
+            )
+            if blob.size
+        ]
+        per_blob = -(-count // len(blobs)) if blobs else 0
+        documents = []
+        for blob in blobs[:count]:
+            with blob.open("rb") as f:
+                lines = gzip.open(f) if blob.name.endswith(".gz") else f
+                for line in itertools.islice(lines, per_blob):
+                    if not line.strip():
+                        continue
+                    document = json.loads(line)
+                    data = document.get("struct_data") or json.loads(
+                        document["json_data"]
+                    )
+                    documents.append({"id": document["id"], "content": data["content"]})
+        return documents[:count]
+
+    def wait_until_searchable(
+        project_id: str,
+        location: str,
+        data_store_id: str,
+        documents: list[dict],
+        timeout: float,
+        client_options: ClientOptions | None = None,
+    ) -> bool:
+        """Poll searches for the probe documents until every one is returned.
+
+        Args:
+            project_id: Google Cloud project ID
+            location: Google Cloud location
+            data_store_id: Target datastore ID
+            documents: Probe document ids and contents
+            timeout: Seconds to wait before giving up
+            client_options: Client options for API
+
+        Returns:
+            Whether all probe documents became searchable before the deadline
+        """
+        client = discoveryengine.SearchServiceClient(client_options=client_options)
+        serving_config = f"projects/{project_id}/locations/{location}/collections/default_collection/dataStores/{data_store_id}/servingConfigs/default_search"
+        # The opening words of a chunk rank that chunk first once it is indexed.
+        pending = {
+            document["id"]: " ".join(document["content"].split()[:30])
+            for document in documents
+        }
+
+        deadline = time.monotonic() + timeout
+        delay = 5.0
+        while True:
+            for document_id, query in list(pending.items()):
+                response = client.search(
+                    request=discoveryengine.SearchRequest(
+                        serving_config=serving_config, query=query, page_size=10
+                    )
+                )
+                if any(result.id == document_id for result in response.results):
+                    del pending[document_id]
+            if not pending:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            logging.info(
+                f"{len(pending)}/{len(documents)} probe documents not searchable yet, "
+                f"checking again in {delay:.0f}s"
+            )
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 60)
+
     client_options = ClientOptions(
         api_endpoint=f"{data_store_region}-discoveryengine.googleapis.com"
     )
@@ -176,17 +269,40 @@ def ingest_data(
         input_files_uri=input_files.uri,
     )
     logging.info("Data import completed")
+
+    probe_documents = read_probe_documents(input_files.uri, readiness_probe_documents)
+    if not probe_documents:
+        logging.warning("No documents were imported, skipping readiness check.")
+        return
     logging.info(
-        "Sleeping for 3 minutes to allow Vertex AI Search to properly index the data..."
+        f"Waiting for Vertex AI Search to index the data ({len(probe_documents)} probe documents)..."
     )
-    time.sleep(180)  # Sleep for 180 seconds (3 minutes)
-    logging.info("Sleep completed. Data indexing should now be complete.")
+    started = time.monotonic()
+    # The import itself succeeded, so a slow index must not fail the step: a
+    # retry would run the whole import again.
+    if wait_until_searchable(
+        project_id=project_id,
+        location=data_store_region,
+        data_store_id=data_store_id,
+        documents=probe_documents,
+        timeout=readiness_timeout_seconds,
+        client_options=client_options,
+    ):
+        logging.info(f"Data searchable after {time.monotonic() - started:.0f}s.")
+    else:
+        logging.warning(
+            f"Not all probe documents were searchable after {readiness_timeout_seconds}s; "
+            "the import succeeded and indexing continues in the background."
+        )
 {% elif cookiecutter.datastore_type == "vertex_ai_vector_search" %}
 from google_cloud_pipeline_components.types.artifact_types import BQTable
 
+from data_ingestion_pipeline.transforms import to_datapoints
+
 
 @component(
-    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2"
+    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2",
+    additional_funcs=[to_datapoints],
 )
 def ingest_data(
     project_id: str,
@@ -197,19 +313,43 @@ def ingest_data(
     schedule_time: str,
     ingestion_batch_size: int,
     input_table: Input[BQTable],
+    metrics: Output[Metrics],
     is_incremental: bool = True,
     look_back_days: int = 1,
+    ingestion_workers: int = 8,
+    ingestion_max_retries: int = 5,
+    max_failed_fraction: float = 0.0,
 ) -> None:
     """Process and ingest documents into Vertex AI Vector Search.
 
+    The source table is streamed in Arrow record batches through the BigQuery
+    Storage Read API, and the batches are upserted concurrently while the
+    next ones are read.
+
     Args:
         project_id: Google Cloud project ID
+        ingestion_batch_size: Maximum number of datapoints per upsert request
+        metrics: Throughput, latency and failure counts of the upserts
+        ingestion_workers: Number of concurrent upsert requests
+        ingestion_max_retries: Retries of a request failing with a transient error
+        max_failed_fraction: Fraction of the datapoints allowed to fail permanently
+            before the component fails (0 fails on any failed datapoint)
+
+    Raises:
+        RuntimeError: If more than `max_failed_fraction` of the datapoints failed,
+            after the metrics have been logged
     """
     import logging
+    import random
+    import time
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
     from datetime import datetime, timedelta
+    from typing import Iterator
 
-    import bigframes.pandas as bpd
-    from google.cloud import aiplatform
+    import google.api_core.exceptions
+    import numpy as np
+    import pyarrow as pa
+    from google.cloud import aiplatform, bigquery, bigquery_storage
     from langchain_google_vertexai import VectorSearchVectorStore
     from langchain_google_vertexai import VertexAIEmbeddings
 
@@ -218,8 +358,8 @@ def ingest_data(
 
     # Initialize clients
     logging.info("Initializing clients...")
-    bpd.options.bigquery.project = project_id
-    bpd.options.bigquery.location = location
+    bq_client = bigquery.Client(project=project_id, location=location)
+    bqstorage_client = bigquery_storage.BigQueryReadClient()
     logging.info("Clients initialized.")
 
     # Set date range for data fetch
@@ -246,6 +386,7 @@ def ingest_data(
     dataset = input_table.metadata["datasetId"]
     table = input_table.metadata["tableId"]
 
+    # Deduplicate in the query so that the result can be streamed as is.
     query = f"""
         SELECT
             question_id
@@ -254,16 +395,30 @@ def ingest_data(
             , text_chunk
             , chunk_id
             , embedding
-        FROM  {project_id}.{dataset}.{table}
+        FROM  `{project_id}.{dataset}.{table}`
         WHERE TRUE
                 {f'AND DATETIME(creation_timestamp) BETWEEN DATETIME("{START_DATE}") AND DATETIME("{END_DATE}")' if is_incremental else ""}
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY question_id ORDER BY last_edit_date DESC
+        ) = 1
     """
-    df = (
-        bpd.read_gbq(query)
-        .sort_values("last_edit_date", ascending=False)
-        .drop_duplicates("question_id")
-        .reset_index(drop=True)
-    )
+    rows = bq_client.query(query).result()
+    logging.info(f"Query returned {rows.total_rows} datapoints to ingest.")
+
+    def iter_batches(rows: bigquery.table.RowIterator, batch_size: int) -> Iterator[pa.Table]:
+        """Re-slice the Storage Read API record batches into upsert-sized tables."""
+        pending: list[pa.RecordBatch] = []
+        pending_rows = 0
+        for record_batch in rows.to_arrow_iterable(bqstorage_client=bqstorage_client):
+            pending.append(record_batch)
+            pending_rows += record_batch.num_rows
+            while pending_rows >= batch_size:
+                buffered = pa.Table.from_batches(pending)
+                yield buffered.slice(0, batch_size)
+                pending = buffered.slice(batch_size).to_batches()
+                pending_rows -= batch_size
+        if pending_rows:
+            yield pa.Table.from_batches(pending)
 
     aiplatform.init(
         project=project_id,
@@ -286,24 +441,101 @@ def ingest_data(
         stream_update=True,
     )
 
-    for batch_num, start in enumerate(range(0, len(df), ingestion_batch_size)):
-        ids = (
-            df.iloc[start : start + ingestion_batch_size]
-            .question_id.astype(str)
-            .tolist()
-        )
-        texts = df.iloc[start : start + ingestion_batch_size].text_chunk.tolist()
-        embeddings = df.iloc[start : start + ingestion_batch_size].embedding.tolist()
-        metadatas = (
-            df.iloc[start : start + ingestion_batch_size]
-            .drop(columns=["embedding", "last_edit_date"])
-            .to_dict(orient="records")
-        )
-        vector_store.add_texts_with_embeddings(
-            ids=ids,
-            texts=texts,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            is_complete_overwrite=True,
+    TRANSIENT_ERRORS = (
+        google.api_core.exceptions.ResourceExhausted,
+        google.api_core.exceptions.ServiceUnavailable,
+        google.api_core.exceptions.DeadlineExceeded,
+        google.api_core.exceptions.InternalServerError,
+        google.api_core.exceptions.Aborted,
+    )
+    request_latencies: list[float] = []
+
+    def upsert(datapoints: dict) -> tuple[int, int, int]:
+        """Upsert datapoints, retrying only the ones that failed.
+
+        Transient errors retry the request with exponential backoff. A request
+        rejected as invalid is split in halves, so that its valid datapoints
+        are still ingested and only the rejected ones count as failed.
+
+        Returns:
+            Numbers of ingested datapoints, failed datapoints and retries
+        """
+        ids = datapoints["ids"]
+        for attempt in range(ingestion_max_retries + 1):
+            started = time.perf_counter()
+            try:
+                vector_store.add_texts_with_embeddings(
+                    **datapoints, is_complete_overwrite=True
+                )
+            except TRANSIENT_ERRORS as e:
+                if attempt == ingestion_max_retries:
+                    logging.error(
+                        f"Giving up on {len(ids)} datapoints after "
+                        f"{ingestion_max_retries} retries: {e}"
+                    )
+                    return 0, len(ids), attempt
+                delay = min(60, 2**attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"Upsert failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+            except google.api_core.exceptions.InvalidArgument as e:
+                if len(ids) == 1:
+                    logging.error(f"Datapoint {ids[0]} rejected: {e}")
+                    return 0, 1, attempt
+                half = len(ids) // 2
+                results = [
+                    upsert({name: values[:half] for name, values in datapoints.items()}),
+                    upsert({name: values[half:] for name, values in datapoints.items()}),
+                ]
+                halves_ingested, halves_failed, halves_retries = map(sum, zip(*results))
+                return halves_ingested, halves_failed, attempt + halves_retries
+            else:
+                request_latencies.append(time.perf_counter() - started)
+                return len(ids), 0, attempt
+
+    # Up to two requests per worker are queued, which bounds the number of
+    # batches held in memory while keeping every worker busy.
+    ingested = failed = retries = 0
+
+    def collect(done: set) -> None:
+        nonlocal ingested, failed, retries
+        for future in done:
+            batch_ingested, batch_failed, batch_retries = future.result()
+            ingested += batch_ingested
+            failed += batch_failed
+            retries += batch_retries
+        logging.info(
+            f"Ingested {ingested}/{rows.total_rows} datapoints ({failed} failed)."
         )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ingestion_workers) as upserter:
+        in_flight = set()
+        for batch in iter_batches(rows, ingestion_batch_size):
+            if len(in_flight) >= 2 * ingestion_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(upserter.submit(upsert, to_datapoints(batch)))
+        collect(wait(in_flight).done)
+    elapsed = time.perf_counter() - started
+
+    metrics.log_metric("datapoints_ingested", ingested)
+    metrics.log_metric("datapoints_failed", failed)
+    metrics.log_metric("upsert_requests", len(request_latencies))
+    metrics.log_metric("upsert_retries", retries)
+    metrics.log_metric("ingestion_seconds", round(elapsed, 1))
+    metrics.log_metric(
+        "datapoints_per_second", round(ingested / elapsed, 1) if elapsed else 0.0
+    )
+    if request_latencies:
+        p50, p95 = np.percentile(request_latencies, [50, 95])
+        metrics.log_metric("upsert_latency_p50_seconds", round(float(p50), 3))
+        metrics.log_metric("upsert_latency_p95_seconds", round(float(p95), 3))
+    logging.info(f"Ingested {ingested} datapoints in {elapsed:.1f}s.")
+    if failed:
+        logging.error(f"{failed} datapoints could not be ingested.")
+        if failed > max_failed_fraction * (ingested + failed):
+            raise RuntimeError(
+                f"{failed} of {ingested + failed} datapoints failed to ingest, "
+                f"more than the allowed fraction of {max_failed_fraction}."
+            )
 {% endif %}
\ No newline at end of file
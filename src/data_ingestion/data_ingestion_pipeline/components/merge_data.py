@@ -0,0 +1,206 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ruff: noqa
+
+from kfp.dsl import Dataset, Output, component
+{% if cookiecutter.datastore_type == "vertex_ai_vector_search" %}
+from google_cloud_pipeline_components.types.artifact_types import BQTable
+{% endif %}
+from data_ingestion_pipeline.transforms import merge_rows_query
+
+@component(
+    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2",
+    additional_funcs=[merge_rows_query],
+)
+def merge_data(
+    project_id: str,
+    run_start_time: str,
+{%- if cookiecutter.datastore_type == "vertex_ai_search" %}
+    output_files: Output[Dataset],
+{%- elif cookiecutter.datastore_type == "vertex_ai_vector_search" %}
+    output_table: Output[BQTable],
+{%- endif %}
+    is_incremental: bool = True,
+    destination_dataset: str = "stackoverflow_data",
+    destination_table: str = "incremental_questions_embeddings",
+    deduped_table: str = "questions_embeddings",
+    location: str = "us-central1",
+{%- if cookiecutter.datastore_type == "vertex_ai_search" %}
+    embedding_column: str = "embedding",
+    export_compression: str = "GZIP",
+{%- endif %}
+) -> None:
+    """Merge the rows written by all process_data shards of a run into the
+    deduplicated table{% if cookiecutter.datastore_type == "vertex_ai_search" %} and export it to JSONL{% endif %}.
+
+    Only this run's rows are merged in, so the cost follows the size of the
+    run rather than the whole history of the incremental table. A question
+    seen again replaces its chunks: matching chunk ids are updated, new ones
+    inserted and chunks it no longer has are deleted. A full run also drops
+    the rows of earlier runs from the incremental table.
+
+    Args:
+        run_start_time: Pipeline job creation time; rows appended to the
+            incremental table since then belong to this run
+        is_incremental: Whether only the questions of this run are replaced,
+            or the whole deduplicated table
+        destination_dataset: BigQuery dataset for storing results
+        destination_table: Table for storing incremental results
+        deduped_table: Table for storing deduplicated results
+        location: BigQuery location
+{%- if cookiecutter.datastore_type == "vertex_ai_search" %}
+        output_files: Output dataset path
+        embedding_column: Name of embedding column in the exported documents
+        export_compression: Compression of the exported files, GZIP or NONE
+{%- elif cookiecutter.datastore_type == "vertex_ai_vector_search" %}
+        output_table: Deduplicated table
+{%- endif %}
+    """
+    import logging
+
+    from google.cloud import bigquery
+
+    # Initialize logging
+    logging.basicConfig(level=logging.INFO)
+
+    bq_client = bigquery.Client(project=project_id, location=location)
+
+    PARTITION_DATE_COLUMN = "creation_timestamp"
+    incremental_table = bq_client.get_table(
+        f"{project_id}.{destination_dataset}.{destination_table}"
+    )
+    columns = [field.name for field in incremental_table.schema]
+
+    # Create the deduplicated table, or add columns introduced since it was created
+    table = bigquery.Table(
+        f"{project_id}.{destination_dataset}.{deduped_table}",
+        schema=incremental_table.schema,
+    )
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY, field=PARTITION_DATE_COLUMN
+    )
+    table.clustering_fields = ["question_id"]
+    table = bq_client.create_table(table=table, exists_ok=True)
+    existing_columns = {field.name for field in table.schema}
+    new_fields = [f for f in incremental_table.schema if f.name not in existing_columns]
+    if new_fields:
+        table.schema = [*table.schema, *new_fields]
+        bq_client.update_table(table, ["schema"])
+
+    # Compare the partition column with a constant of its own type, so that
+    # only the partitions written by this run are scanned.
+    partition_column_type = {
+        field.name: field.field_type for field in incremental_table.schema
+    }[PARTITION_DATE_COLUMN]
+    run_start = f'TIMESTAMP("{run_start_time}")'
+    if partition_column_type == "DATETIME":
+        run_start = f"DATETIME({run_start})"
+    run_rows_query = f"""
+        SELECT *
+        FROM `{project_id}.{destination_dataset}.{destination_table}`
+        WHERE {PARTITION_DATE_COLUMN} >= {run_start}
+            AND chunk_id IS NOT NULL
+    """
+
+    # A full run replaces the whole table, so a run without rows (e.g. cached
+    # process_data tasks that wrote nothing new) would empty it.
+    count_query = f"SELECT COUNT(*) AS run_rows FROM ({run_rows_query})"
+    run_rows = list(bq_client.query(count_query).result())[0].run_rows
+    logging.info(f"{run_rows} rows written by this run.")
+    if run_rows == 0 and not is_incremental:
+        raise RuntimeError(
+            "No rows were written to the incremental table by this run; "
+            "refusing to replace the deduplicated table with an empty one."
+        )
+
+    # A full run replaces the whole table, an incremental one only the
+    # questions it contains.
+    merge_query = merge_rows_query(
+        target_table=f"`{project_id}.{destination_dataset}.{deduped_table}`",
+        run_rows_query=run_rows_query,
+        columns=columns,
+        is_incremental=is_incremental,
+        partition_column=PARTITION_DATE_COLUMN,
+    )
+    logging.info("Merging new rows into deduplicated table...")
+    merge_job = bq_client.query(merge_query)
+    merge_job.result()
+    logging.info(
+        f"Deduplicated table updated: {merge_job.num_dml_affected_rows} rows "
+        f"affected, {merge_job.total_bytes_processed} bytes processed."
+    )
+
+    if not is_incremental:
+        # Shards always append, so a full run replaces the incremental table
+        # here, once its rows are merged: earlier runs' rows are dropped.
+        logging.info("Dropping rows of earlier runs from the incremental table...")
+        cleanup_job = bq_client.query(
+            f"""
+            DELETE FROM `{project_id}.{destination_dataset}.{destination_table}`
+            WHERE {PARTITION_DATE_COLUMN} < {run_start}
+            """
+        )
+        cleanup_job.result()
+        logging.info(
+            f"Incremental table replaced: {cleanup_job.num_dml_affected_rows} rows "
+            "of earlier runs deleted."
+        )
+{%- if cookiecutter.datastore_type == "vertex_ai_search" %}
+
+    # Export to JSONL
+    # EXPORT DATA writes the query result straight to sharded, compressed
+    # files, without materializing it in a table first. Documents carry their
+    # fields as a struct rather than a JSON string, and only the fields used
+    # for retrieval.
+    logging.info("Exporting to JSONL...")
+    extension = ".jsonl.gz" if export_compression == "GZIP" else ".jsonl"
+    output_files.uri = output_files.uri + "*" + extension
+
+    export_query = f"""
+    EXPORT DATA OPTIONS (
+        uri = '{output_files.uri}',
+        format = 'JSON',
+        compression = '{export_compression}',
+        overwrite = true
+    ) AS
+    SELECT
+        chunk_id as id,
+        STRUCT(
+            chunk_id as id,
+            embedding as {embedding_column},
+            text_chunk as content,
+            question_id,
+            CAST(last_edit_date AS STRING) as last_edit_date
+        ) as struct_data
+    FROM
+        `{project_id}.{destination_dataset}.{deduped_table}`
+    WHERE
+        chunk_id IS NOT NULL
+        AND embedding IS NOT NULL
+    """
+    export_job = bq_client.query(export_query)
+    export_job.result()
+    logging.info(
+        f"Exported to JSONL: {export_job.total_bytes_processed} bytes processed."
+    )
+{%- elif cookiecutter.datastore_type == "vertex_ai_vector_search" %}
+
+    # Set artifact metadata (important!)
+    output_table.uri = (
+        f"bq://{project_id}.{destination_dataset}.{deduped_table}"  # Full BQ URI
+    )
+    output_table.metadata["projectId"] = project_id
+    output_table.metadata["datasetId"] = destination_dataset
+    output_table.metadata["tableId"] = deduped_table
+{%- endif %}
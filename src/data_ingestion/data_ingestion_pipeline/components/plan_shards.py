@@ -0,0 +1,72 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ruff: noqa
+
+from kfp.dsl import component
+
+from data_ingestion_pipeline.transforms import plan_date_shards
+
+
+@component(
+    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2",
+    additional_funcs=[plan_date_shards],
+)
+def plan_shards(
+    schedule_time: str,
+    is_incremental: bool = True,
+    look_back_days: int = 1,
+    shard_days: int = 0,
+) -> list:
+    """Split the processing window into date shards for process_data.
+
+    Args:
+        schedule_time: Pipeline schedule time
+        is_incremental: Whether to process only recent data
+        look_back_days: Number of days to look back for incremental processing
+        shard_days: Days per shard (e.g. 1 or 7), 0 to process the window at once
+
+    Returns:
+        List of {"start_date", "end_date"} dicts with inclusive ISO dates. Full
+        (non-incremental) runs get a single shard without dates.
+    """
+    import logging
+    from datetime import datetime, timedelta
+
+    logging.basicConfig(level=logging.INFO)
+
+    if not is_incremental:
+        return [{"start_date": "", "end_date": ""}]
+
+    # Set date range for data fetch
+    schedule_time_dt: datetime = datetime.fromisoformat(
+        schedule_time.replace("Z", "+00:00")
+    )
+    if schedule_time_dt.year == 1970:
+        logging.warning(
+            "Pipeline schedule not set. Setting schedule_time to current date."
+        )
+        schedule_time_dt = datetime.now()
+
+    # Note: The following line sets the schedule time 5 years back to allow sample data to be present.
+    # For your use case, please comment out the following line to use the actual schedule time.
+    # Keep it in sync with process_data and ingest_data.
+    schedule_time_dt = schedule_time_dt - timedelta(days=5 * 365)
+
+    shards = plan_date_shards(
+        start=(schedule_time_dt - timedelta(days=look_back_days)).date(),
+        end=schedule_time_dt.date(),
+        shard_days=shard_days,
+    )
+    logging.info(f"Planned {len(shards)} shards: {shards}")
+    return shards
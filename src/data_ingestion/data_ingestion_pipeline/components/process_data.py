@@ -20,56 +20,79 @@ https://github.com/GoogleCloudPlatform/generative-ai/blob/main/gemini/use-cases/
 It leverages BigQuery for data processing. We also suggest looking at remote functions for enhanced scalability.
 """
 
-from kfp.dsl import Dataset, Output, component
+from kfp.dsl import component
+
+from data_ingestion_pipeline.transforms import (
+    combine_reused_chunks,
+    content_hash_sql,
+    convert_html_batch_to_markdown,
+    create_text_splitter,
+)
+
 
-{% if cookiecutter.datastore_type == "vertex_ai_search" %}
 @component(
-    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2"
+    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2",
+    packages_to_install=["html2text==2024.2.26"],
+    additional_funcs=[
+        combine_reused_chunks,
+        content_hash_sql,
+        convert_html_batch_to_markdown,
+        create_text_splitter,
+    ],
 )
 def process_data(
     project_id: str,
     schedule_time: str,
-    output_files: Output[Dataset],
     is_incremental: bool = True,
     look_back_days: int = 1,
+    start_date: str = "",
+    end_date: str = "",
     chunk_size: int = 1500,
     chunk_overlap: int = 20,
     destination_dataset: str = "stackoverflow_data",
     destination_table: str = "incremental_questions_embeddings",
     deduped_table: str = "questions_embeddings",
     location: str = "us-central1",
-    embedding_column: str = "embedding",
+    markdown_workers: int = 0,
+    markdown_batch_size: int = 2000,
 ) -> None:
     """Process StackOverflow questions and answers by:
     1. Fetching data from BigQuery
     2. Converting HTML to markdown
     3. Splitting text into chunks
     4. Generating embeddings
-    5. Storing results in BigQuery
-    6. Exporting to JSONL
+    5. Appending results to the incremental BigQuery table
+
+    The deduplicated table is updated afterwards by the merge_data component,
+    once every date shard of the run has been processed.
 
     Args:
-        output_files: Output dataset path
         is_incremental: Whether to process only recent data
         look_back_days: Number of days to look back for incremental processing
+        start_date: First day of the shard to process (overrides look_back_days)
+        end_date: Last day of the shard to process, inclusive
         chunk_size: Size of text chunks
         chunk_overlap: Overlap between chunks
         destination_dataset: BigQuery dataset for storing results
         destination_table: Table for storing incremental results
-        deduped_table: Table for storing deduplicated results
+        deduped_table: Table of deduplicated results, used to reuse the embeddings
+            of unchanged chunks of the same questions
         location: BigQuery location
+        markdown_workers: Processes for HTML to markdown conversion (0 = all cores)
+        markdown_batch_size: Rows read and converted per record batch
     """
     import logging
+    import os
+    from concurrent.futures import ProcessPoolExecutor
     from datetime import datetime, timedelta
 
     import backoff
     import bigframes.ml.llm as llm
     import bigframes.pandas as bpd
     import google.api_core.exceptions
+    import pandas as pd
     import swifter
     from google.cloud import bigquery
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from markdownify import markdownify
 
     # Initialize logging
     logging.basicConfig(level=logging.INFO)
@@ -100,6 +123,10 @@ def process_data(
         days=look_back_days
     )  # Start date for data processing window
     END_DATE: datetime = schedule_time_dt  # End date for data processing window
+    if start_date and end_date:
+        # Date shard planned by the plan_shards component
+        START_DATE = datetime.fromisoformat(start_date)
+        END_DATE = datetime.fromisoformat(end_date)
 
     logging.info(f"Date range set: START_DATE={START_DATE}, END_DATE={END_DATE}")
 
@@ -122,19 +149,8 @@ def process_data(
         logging.info("Fetching StackOverflow data from BigQuery...")
         return bpd.read_gbq(query)
 
-    def convert_html_to_markdown(html: str) -> str:
-        """Convert HTML into Markdown for easier parsing and rendering after LLM response."""
-        return markdownify(html).strip()
-
-    def create_answers_markdown(answers: list) -> str:
-        """Convert each answer's HTML to markdown and concatenate into a single markdown text."""
-        answers_md = ""
-        for index, answer_record in enumerate(answers):
-            answers_md += (
-                f"\n\n## Answer {index + 1}:\n"  # Answer number is H2 heading size
-            )
-            answers_md += convert_html_to_markdown(answer_record["body"])
-        return answers_md
+    # Convert HTML into Markdown for easier parsing and rendering after LLM response.
+    markdown_workers = markdown_workers or os.cpu_count() or 1
 
     def create_table_if_not_exist(
         df: bpd.DataFrame,
@@ -156,7 +172,14 @@ def process_data(
         dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
         dataset.location = location
         bq_client.create_dataset(dataset, exists_ok=True)
-        bq_client.create_table(table=table, exists_ok=True)
+        table = bq_client.create_table(table=table, exists_ok=True)
+
+        # Add columns introduced since the table was created (e.g. content_hash)
+        existing_columns = {field.name for field in table.schema}
+        new_fields = [f for f in table_schema if f.name not in existing_columns]
+        if new_fields:
+            table.schema = [*table.schema, *new_fields]
+            bq_client.update_table(table, ["schema"])
 
     # Fetch and preprocess data
     logging.info("Fetching and preprocessing data...")
@@ -179,10 +202,20 @@ def process_data(
     df["question_title_md"] = (
         "# " + df["question_title"] + "\n"
     )  # Title is H1 heading size
-    df["question_text_md"] = (
-        df["question_text"].to_pandas().swifter.apply(convert_html_to_markdown) + "\n"
-    )
-    df["answers_md"] = df["answers"].to_pandas().swifter.apply(create_answers_markdown)
+    row_index, questions_md, answers_md = [], [], []
+    with ProcessPoolExecutor(max_workers=markdown_workers) as pool:
+        for batch in df[["question_text", "answers"]].to_pandas_batches(
+            page_size=markdown_batch_size
+        ):
+            batch_questions_md, batch_answers_md = convert_html_batch_to_markdown(
+                pool, list(batch["question_text"]), list(batch["answers"]), markdown_workers
+            )
+            row_index.extend(batch.index)
+            questions_md.extend(batch_questions_md)
+            answers_md.extend(batch_answers_md)
+            logging.info(f"Converted {len(row_index)} questions to markdown.")
+    df["question_text_md"] = pd.Series(questions_md, index=row_index, dtype="string")
+    df["answers_md"] = pd.Series(answers_md, index=row_index, dtype="string")
 
     # Create a column containing the whole markdown text
     df["full_text_md"] = (
@@ -195,11 +228,7 @@ def process_data(
 
     # Split text into chunks
     logging.info("Splitting text into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-    )
+    text_splitter = create_text_splitter(chunk_size, chunk_overlap)
 
     df["text_chunk"] = (
         df["full_text_md"]
@@ -218,327 +247,94 @@ def process_data(
     df["chunk_id"] = df["question_id"].astype("string") + "__" + chunk_ids
     logging.info("Chunk IDs created and chunks exploded.")
 
-    # Generate embeddings
-    logging.info("Generating embeddings...")
+    # Reuse the embeddings of chunk texts that were already embedded
+    logging.info("Looking up existing embeddings...")
+    EMBEDDING_MODEL = "text-embedding-005"
+    EMBEDDING_COLUMNS = ["embedding", "embedding_statistics", "embedding_status"]
 
-    # The first invocation in a new project might fail due to permission propagation.
-    @backoff.on_exception(
-        backoff.expo, google.api_core.exceptions.InvalidArgument, max_tries=10
-    )
-    def create_embedder() -> llm.TextEmbeddingGenerator:
-        return llm.TextEmbeddingGenerator(model_name="text-embedding-005")
-
-    embedder = create_embedder()
-
-    embeddings_df = embedder.predict(df["text_chunk"])
-    logging.info("Embeddings generated.")
-
-    df = df.assign(
-        embedding=embeddings_df["ml_generate_embedding_result"],
-        embedding_statistics=embeddings_df["ml_generate_embedding_statistics"],
-        embedding_status=embeddings_df["ml_generate_embedding_status"],
-        creation_timestamp=datetime.now(),
-    )
-
-    # Store results in BigQuery
-    PARTITION_DATE_COLUMN = "creation_timestamp"
-
-    # Create and populate incremental table
-    logging.info("Creating and populating incremental table...")
-    create_table_if_not_exist(
-        df=df,
-        project_id=project_id,
-        dataset_id=destination_dataset,
-        table_id=destination_table,
-        partition_column=PARTITION_DATE_COLUMN,
-    )
-
-    if_exists_mode = "append" if is_incremental else "replace"
-    df.to_gbq(
-        destination_table=f"{destination_dataset}.{destination_table}",
-        if_exists=if_exists_mode,
-    )
-    logging.info("Incremental table created and populated.")
-
-    # Create deduplicated table
-    logging.info("Creating deduplicated table...")
-    df_questions = bpd.read_gbq(
-        f"{destination_dataset}.{destination_table}", use_cache=False
-    )
-    max_date_df = (
-        df_questions.groupby("question_id")["creation_timestamp"].max().reset_index()
-    )
-    df_questions_dedup = max_date_df.merge(
-        df_questions, how="inner", on=["question_id", "creation_timestamp"]
-    )
-
-    create_table_if_not_exist(
-        df=df_questions_dedup,
-        project_id=project_id,
-        dataset_id=destination_dataset,
-        table_id=deduped_table,
-        partition_column=PARTITION_DATE_COLUMN,
-    )
-
-    df_questions_dedup.to_gbq(
-        destination_table=f"{destination_dataset}.{deduped_table}",
-        if_exists="replace",
-    )
-    logging.info("Deduplicated table created and populated.")
-
-    # Export to JSONL
-    logging.info("Exporting to JSONL...")
-
-    export_query = f"""
-    SELECT
-        chunk_id as id,
-        TO_JSON_STRING(STRUCT(
-            chunk_id as id,
-            embedding as {embedding_column},
-            text_chunk as content,
-            question_id,
-            CAST(creation_timestamp AS STRING) as creation_timestamp,
-            CAST(last_edit_date AS STRING) as last_edit_date,
-            question_text,
-            full_text_md
-        )) as json_data
-    FROM
-        `{project_id}.{destination_dataset}.{deduped_table}`
-    WHERE
-        chunk_id IS NOT NULL
-        AND embedding IS NOT NULL
+    chunks_table = df.to_gbq()
+    hashed_chunks_query = f"""
+        SELECT *, {content_hash_sql("text_chunk", EMBEDDING_MODEL)} AS content_hash
+        FROM `{chunks_table}`
     """
-    export_df_id = bpd.read_gbq(export_query).to_gbq()
-
-    output_files.uri = output_files.uri + "*.jsonl"
-
-    job_config = bigquery.ExtractJobConfig()
-    job_config.destination_format = bigquery.DestinationFormat.NEWLINE_DELIMITED_JSON
-
-    extract_job = bq_client.extract_table(
-        export_df_id, output_files.uri, job_config=job_config
-    )
-    extract_job.result()
-    logging.info("Exported to JSONL.")
-{% elif cookiecutter.datastore_type == "vertex_ai_vector_search" %}
-from google_cloud_pipeline_components.types.artifact_types import BQTable
-
-
-@component(
-    base_image="us-docker.pkg.dev/production-ai-template/starter-pack/data_processing:0.2",
-)
-def process_data(
-    project_id: str,
-    schedule_time: str,
-    output_table: Output[BQTable],
-    is_incremental: bool = True,
-    look_back_days: int = 1,
-    chunk_size: int = 1500,
-    chunk_overlap: int = 20,
-    destination_dataset: str = "stackoverflow_data",
-    destination_table: str = "incremental_questions_embeddings",
-    deduped_table: str = "questions_embeddings",
-    location: str = "us-central1",
-) -> None:
-    """Process StackOverflow questions and answers by:
-    1. Fetching data from BigQuery
-    2. Converting HTML to markdown
-    3. Splitting text into chunks
-    4. Generating embeddings
-    5. Storing results in BigQuery
-    6. Exporting to JSONL
-
-    Args:
-        output_files: Output dataset path
-        is_incremental: Whether to process only recent data
-        look_back_days: Number of days to look back for incremental processing
-        chunk_size: Size of text chunks
-        chunk_overlap: Overlap between chunks
-        destination_dataset: BigQuery dataset for storing results
-        destination_table: Table for storing incremental results
-        deduped_table: Table for storing deduplicated results
-        location: BigQuery location
-    """
-    import logging
-    from datetime import datetime, timedelta
-
-    import backoff
-    import bigframes.ml.llm as llm
-    import bigframes.pandas as bpd
-    import google.api_core.exceptions
-    import swifter
-    from google.cloud import bigquery
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from markdownify import markdownify
-
-    # Initialize logging
-    logging.basicConfig(level=logging.INFO)
-    logging.info(f"Using {swifter} for apply operations.")
-
-    # Initialize clients
-    logging.info("Initializing clients...")
-    bq_client = bigquery.Client(project=project_id, location=location)
-    bpd.options.bigquery.project = project_id
-    bpd.options.bigquery.location = location
-    logging.info("Clients initialized.")
-
-    # Set date range for data fetch
-    schedule_time_dt: datetime = datetime.fromisoformat(
-        schedule_time.replace("Z", "+00:00")
-    )
-    if schedule_time_dt.year == 1970:
-        logging.warning(
-            "Pipeline schedule not set. Setting schedule_time to current date."
+    try:
+        existing_table = bq_client.get_table(
+            f"{project_id}.{destination_dataset}.{deduped_table}"
         )
-        schedule_time_dt = datetime.now()
-
-    # Note: The following line sets the schedule time 5 years back to allow sample data to be present.
-    # For your use case, please comment out the following line to use the actual schedule time.
-    schedule_time_dt = schedule_time_dt - timedelta(days=5 * 365)
-
-    START_DATE: datetime = schedule_time_dt - timedelta(
-        days=look_back_days
-    )  # Start date for data processing window
-    END_DATE: datetime = schedule_time_dt  # End date for data processing window
-
-    logging.info(f"Date range set: START_DATE={START_DATE}, END_DATE={END_DATE}")
-
-    def fetch_stackoverflow_data(
-        dataset_suffix: str, start_date: str, end_date: str
-    ) -> bpd.DataFrame:
-        """Fetch StackOverflow data from BigQuery."""
-        query = f"""
+    except google.api_core.exceptions.NotFound:
+        existing_table = None
+
+    if existing_table is None:
+        df = bpd.read_gbq(hashed_chunks_query)
+        reused_df = None
+    else:
+        # Tables written before the content_hash column existed are hashed on the fly.
+        existing_hash = (
+            "content_hash"
+            if "content_hash" in {field.name for field in existing_table.schema}
+            else content_hash_sql("text_chunk", EMBEDDING_MODEL)
+        )
+        # Only the rows of this window's questions are read. The deduplicated
+        # table is clustered on question_id, so the filter prunes blocks before
+        # the embedding columns are read or old rows are hashed.
+        reuse_query = f"""
+            WITH chunks AS ({hashed_chunks_query}),
+            existing AS (
+                SELECT
+                    content_hash,
+                    ARRAY_AGG(
+                        STRUCT({", ".join(EMBEDDING_COLUMNS)}) LIMIT 1
+                    )[OFFSET(0)] AS previous
+                FROM (
+                    SELECT {existing_hash} AS content_hash, {", ".join(EMBEDDING_COLUMNS)}
+                    FROM `{project_id}.{destination_dataset}.{deduped_table}`
+                    WHERE question_id IN (SELECT DISTINCT question_id FROM chunks)
+                        AND embedding_status = '' AND ARRAY_LENGTH(embedding) > 0
+                )
+                WHERE content_hash IN (SELECT content_hash FROM chunks)
+                GROUP BY content_hash
+            )
             SELECT
-                creation_date,
-                last_edit_date,
-                question_id,
-                question_title,
-                question_body AS question_text,
-                answers
-            FROM `production-ai-template.stackoverflow_qa_{dataset_suffix}.stackoverflow_python_questions_and_answers`
-            WHERE TRUE
-                {f'AND TIMESTAMP_TRUNC(creation_date, DAY) BETWEEN TIMESTAMP("{start_date}") AND TIMESTAMP("{end_date}")' if is_incremental else ""}
+                chunks.*,
+                {", ".join(f"existing.previous.{column}" for column in EMBEDDING_COLUMNS)},
+                existing.content_hash IS NOT NULL AS is_reused
+            FROM chunks
+            LEFT JOIN existing ON chunks.content_hash = existing.content_hash
         """
-        logging.info("Fetching StackOverflow data from BigQuery...")
-        return bpd.read_gbq(query)
-
-    def convert_html_to_markdown(html: str) -> str:
-        """Convert HTML into Markdown for easier parsing and rendering after LLM response."""
-        return markdownify(html).strip()
-
-    def create_answers_markdown(answers: list) -> str:
-        """Convert each answer's HTML to markdown and concatenate into a single markdown text."""
-        answers_md = ""
-        for index, answer_record in enumerate(answers):
-            answers_md += (
-                f"\n\n## Answer {index + 1}:\n"  # Answer number is H2 heading size
-            )
-            answers_md += convert_html_to_markdown(answer_record["body"])
-        return answers_md
-
-    def create_table_if_not_exist(
-        df: bpd.DataFrame,
-        project_id: str,
-        dataset_id: str,
-        table_id: str,
-        partition_column: str,
-        location: str = location,
-    ) -> None:
-        """Create BigQuery table with time partitioning if it doesn't exist."""
-        table_schema = bq_client.get_table(df.head(0).to_gbq()).schema
-        table = bigquery.Table(
-            f"{project_id}.{dataset_id}.{table_id}", schema=table_schema
-        )
-        table.time_partitioning = bigquery.TimePartitioning(
-            type_=bigquery.TimePartitioningType.DAY, field=partition_column
+        all_chunks_df = bpd.read_gbq(reuse_query).cache()
+        reused_df = all_chunks_df[all_chunks_df["is_reused"]].drop(columns="is_reused")
+        df = all_chunks_df[~all_chunks_df["is_reused"]].drop(
+            columns=["is_reused", *EMBEDDING_COLUMNS]
         )
-
-        dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
-        dataset.location = location
-        bq_client.create_dataset(dataset, exists_ok=True)
-        bq_client.create_table(table=table, exists_ok=True)
-
-    # Fetch and preprocess data
-    logging.info("Fetching and preprocessing data...")
-    df = fetch_stackoverflow_data(
-        start_date=START_DATE.strftime("%Y-%m-%d"),
-        end_date=END_DATE.strftime("%Y-%m-%d"),
-        dataset_suffix=location.lower().replace("-", "_"),
-    )
-    df = (
-        df.sort_values("last_edit_date", ascending=False)
-        .drop_duplicates("question_id")
-        .reset_index(drop=True)
-    )
-    logging.info("Data fetched and preprocessed.")
-
-    # Convert content to markdown
-    logging.info("Converting content to markdown...")
-
-    # Create markdown fields efficiently
-    df["question_title_md"] = (
-        "# " + df["question_title"] + "\n"
-    )  # Title is H1 heading size
-    df["question_text_md"] = (
-        df["question_text"].to_pandas().swifter.apply(convert_html_to_markdown) + "\n"
-    )
-    df["answers_md"] = df["answers"].to_pandas().swifter.apply(create_answers_markdown)
-
-    # Create a column containing the whole markdown text
-    df["full_text_md"] = (
-        df["question_title_md"] + df["question_text_md"] + df["answers_md"]
-    )
-    logging.info("Content converted to markdown.")
-
-    # Keep only necessary columns
-    df = df[["last_edit_date", "question_id", "question_text", "full_text_md"]]
-
-    # Split text into chunks
-    logging.info("Splitting text into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-    )
-
-    df["text_chunk"] = (
-        df["full_text_md"]
-        .to_pandas()
-        .astype(object)
-        .swifter.apply(text_splitter.split_text)
-    )
-    logging.info("Text split into chunks.")
-
-    # Create chunk IDs and explode chunks into rows
-    logging.info("Creating chunk IDs and exploding chunks into rows...")
-    chunk_ids = [
-        str(idx) for text_chunk in df["text_chunk"] for idx in range(len(text_chunk))
-    ]
-    df = df.explode("text_chunk").reset_index(drop=True)
-    df["chunk_id"] = df["question_id"].astype("string") + "__" + chunk_ids
-    logging.info("Chunk IDs created and chunks exploded.")
+        logging.info(f"Reusing embeddings of {len(reused_df)} unchanged chunks.")
 
     # Generate embeddings
-    logging.info("Generating embeddings...")
+    logging.info(f"Generating embeddings for {len(df)} new or changed chunks...")
 
     # The first invocation in a new project might fail due to permission propagation.
     @backoff.on_exception(
         backoff.expo, google.api_core.exceptions.InvalidArgument, max_tries=10
     )
     def create_embedder() -> llm.TextEmbeddingGenerator:
-        return llm.TextEmbeddingGenerator(model_name="text-embedding-005")
-
-    embedder = create_embedder()
-
-    embeddings_df = embedder.predict(df["text_chunk"])
+        return llm.TextEmbeddingGenerator(model_name=EMBEDDING_MODEL)
+
+    if len(df) > 0:
+        embedder = create_embedder()
+        embeddings_df = embedder.predict(df["text_chunk"])
+        df = df.assign(
+            embedding=embeddings_df["ml_generate_embedding_result"],
+            embedding_statistics=embeddings_df["ml_generate_embedding_statistics"],
+            embedding_status=embeddings_df["ml_generate_embedding_status"],
+        )
+    df = combine_reused_chunks(df, reused_df, bpd.concat)
     logging.info("Embeddings generated.")
 
-    df = df.assign(
-        embedding=embeddings_df["ml_generate_embedding_result"],
-        embedding_statistics=embeddings_df["ml_generate_embedding_statistics"],
-        embedding_status=embeddings_df["ml_generate_embedding_status"],
-        creation_timestamp=datetime.now(),
-    )
+    df = df.assign(creation_timestamp=datetime.now())
+
+    # Materialize this run's rows once, so that reading the schema and loading
+    # the incremental table do not run the embeddings again.
+    new_rows_table = df.to_gbq()
+    df = bpd.read_gbq(new_rows_table)
 
     # Store results in BigQuery
     PARTITION_DATE_COLUMN = "creation_timestamp"
@@ -553,43 +349,10 @@ def process_data(
         partition_column=PARTITION_DATE_COLUMN,
     )
 
-    if_exists_mode = "append" if is_incremental else "replace"
+    # Date shards of a run are processed concurrently, so they always append.
+    # merge_data drops the rows of earlier runs after a full run.
     df.to_gbq(
         destination_table=f"{destination_dataset}.{destination_table}",
-        if_exists=if_exists_mode,
+        if_exists="append",
     )
     logging.info("Incremental table created and populated.")
-
-    # Create deduplicated table
-    logging.info("Creating deduplicated table...")
-    df_questions = bpd.read_gbq(
-        f"{destination_dataset}.{destination_table}", use_cache=False
-    )
-    max_date_df = (
-        df_questions.groupby("question_id")["creation_timestamp"].max().reset_index()
-    )
-    df_questions_dedup = max_date_df.merge(
-        df_questions, how="inner", on=["question_id", "creation_timestamp"]
-    )
-
-    create_table_if_not_exist(
-        df=df_questions_dedup,
-        project_id=project_id,
-        dataset_id=destination_dataset,
-        table_id=deduped_table,
-        partition_column=PARTITION_DATE_COLUMN,
-    )
-
-    df_questions_dedup.to_gbq(
-        destination_table=f"{destination_dataset}.{deduped_table}",
-        if_exists="replace",
-    )
-    logging.info("Deduplicated table created and populated.")
-    # Set artifact metadata (important!)
-    output_table.uri = (
-        f"bq://{project_id}.{destination_dataset}.{deduped_table}"  # Full BQ URI
-    )
-    output_table.metadata["projectId"] = project_id
-    output_table.metadata["datasetId"] = destination_dataset
-    output_table.metadata["tableId"] = deduped_table
-{% endif %}
\ No newline at end of file
@@ -0,0 +1,440 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ruff: noqa
+
+"""
+Local runner for the data ingestion pipeline.
+
+Runs the steps of the plan_shards, process_data, merge_data and ingest_data
+components on a single machine, so that their performance can be profiled
+and regression-tested without Google Cloud:
+
+- BigQuery and bigframes are replaced by DuckDB, reading the StackOverflow
+  questions from a Parquet fixture and keeping the incremental and
+  deduplicated tables in a local database file.
+- Embeddings come from langchain's DeterministicFakeEmbedding, with the
+  dimensionality of text-embedding-005.
+- The datastore is replaced by a local sink writing the documents or
+  datapoints that would be imported into JSONL files.
+
+Shard planning, markdown conversion, chunking, content hashing, the merge
+statement and the conversion to datapoints are the functions in
+transforms.py that the components run, so a regression in them shows up
+here too.
+
+Usage:
+    uv run --with duckdb --with html2text --with langchain-text-splitters \\
+        python -m data_ingestion_pipeline.local_runner --source questions.parquet
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+import duckdb
+import pyarrow as pa
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from data_ingestion_pipeline.transforms import (
+    content_hash_sql,
+    convert_html_batch_to_markdown,
+    create_text_splitter,
+    merge_rows_query,
+    plan_date_shards,
+    to_datapoints,
+)
+
+EMBEDDING_DIMENSIONS = 768
+# Name hashed into the content hashes of chunks embedded locally.
+OFFLINE_EMBEDDING_MODEL = f"deterministic-fake-{EMBEDDING_DIMENSIONS}"
+# Embeddings are computed for this many chunks at a time.
+EMBEDDING_BATCH_SIZE = 1000
+DEFAULT_DATASTORE = "{{cookiecutter.datastore_type}}"
+
+
+class LocalSink:
+    """File-based stand-in for the datastore.
+
+    For Vertex AI Search, documents are written in the JSONL format imported
+    by ingest_data. For Vector Search, datapoints are upserted into a JSONL
+    file keyed by id, like the streaming upserts of ingest_data. Files are
+    compressed at the fastest level, so that the sink does not dominate the
+    timings.
+    """
+
+    def __init__(self, path: str, datastore_type: str):
+        self.path = path
+        self.datastore_type = datastore_type
+        os.makedirs(path, exist_ok=True)
+
+    def ingest(self, batches: Iterator[pa.RecordBatch], embedding_column: str = "embedding") -> int:
+        """Write the deduplicated rows to the sink.
+
+        Args:
+            batches: Record batches of the deduplicated table
+            embedding_column: Name of the embedding field in documents
+
+        Returns:
+            Number of documents or datapoints written
+        """
+        if self.datastore_type == "vertex_ai_vector_search":
+            return self._upsert_datapoints(batches)
+
+        count = 0
+        with gzip.open(
+            os.path.join(self.path, "documents.jsonl.gz"), "wt", compresslevel=1
+        ) as f:
+            for batch in batches:
+                for row in batch.to_pylist():
+                    struct_data = {
+                        "id": row["chunk_id"],
+                        embedding_column: row["embedding"],
+                        "content": row["text_chunk"],
+                        "question_id": row["question_id"],
+                        "last_edit_date": str(row["last_edit_date"]),
+                    }
+                    f.write(
+                        json.dumps({"id": row["chunk_id"], "struct_data": struct_data})
+                        + "\n"
+                    )
+                    count += 1
+        return count
+
+    def _upsert_datapoints(self, batches: Iterator[pa.RecordBatch]) -> int:
+        index_path = os.path.join(self.path, "datapoints.jsonl")
+        datapoints: dict[str, dict] = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                datapoints = {d["id"]: d for d in map(json.loads, f)}
+
+        count = 0
+        for batch in batches:
+            upserts = to_datapoints(pa.Table.from_batches([batch]))
+            for datapoint_id, embedding, text in zip(
+                upserts["ids"], upserts["embeddings"], upserts["texts"]
+            ):
+                datapoints[datapoint_id] = {
+                    "id": datapoint_id,
+                    "embedding": embedding,
+                    "text": text,
+                }
+                count += 1
+
+        with open(index_path, "w") as f:
+            for datapoint in datapoints.values():
+                f.write(json.dumps(datapoint) + "\n")
+        return count
+
+
+class LocalRunner:
+    """Runs the ingestion pipeline steps against DuckDB and a local sink.
+
+    Args:
+        source: Parquet file(s) with StackOverflow-shaped questions
+        workdir: Directory for the DuckDB database and the sink
+        datastore_type: "vertex_ai_search" or "vertex_ai_vector_search"
+        chunk_size: Size of text chunks
+        chunk_overlap: Overlap between chunks
+        markdown_workers: Processes for HTML to markdown conversion (0 = all cores)
+        markdown_batch_size: Rows converted per record batch
+        embedder: Embeddings to use instead of DeterministicFakeEmbedding
+        embedding_model: Model name hashed into the chunks' content hashes
+    """
+
+    def __init__(
+        self,
+        source: str,
+        workdir: str,
+        datastore_type: str = DEFAULT_DATASTORE,
+        chunk_size: int = 1500,
+        chunk_overlap: int = 20,
+        markdown_workers: int = 0,
+        markdown_batch_size: int = 2000,
+        embedder: Embeddings | None = None,
+        embedding_model: str = OFFLINE_EMBEDDING_MODEL,
+    ):
+        self.source = source
+        self.workdir = workdir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.markdown_workers = markdown_workers or os.cpu_count() or 1
+        self.markdown_batch_size = markdown_batch_size
+        self.embedder = embedder or DeterministicFakeEmbedding(size=EMBEDDING_DIMENSIONS)
+        self.embedding_model = embedding_model
+        self.sink = LocalSink(os.path.join(workdir, "datastore"), datastore_type)
+        os.makedirs(workdir, exist_ok=True)
+        self.db = duckdb.connect(os.path.join(workdir, "warehouse.duckdb"))
+        self.timings: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Time a pipeline step; repeated steps (e.g. per shard) add up."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    # plan_shards
+
+    def plan_shards(
+        self, end: date, is_incremental: bool, look_back_days: int, shard_days: int
+    ) -> list[dict]:
+        """Split the processing window into inclusive date shards."""
+        if not is_incremental:
+            return [{"start_date": "", "end_date": ""}]
+        return plan_date_shards(end - timedelta(days=look_back_days), end, shard_days)
+
+    # process_data
+
+    def fetch(self, start_date: str, end_date: str) -> pa.Table:
+        """Fetch the latest edit of each question created in the shard."""
+        window = (
+            f"AND date_trunc('day', creation_date) BETWEEN TIMESTAMP '{start_date}' AND TIMESTAMP '{end_date}'"
+            if start_date
+            else ""
+        )
+        return self.db.sql(
+            f"""
+            SELECT
+                creation_date,
+                last_edit_date,
+                question_id,
+                question_title,
+                question_body AS question_text,
+                answers
+            FROM read_parquet('{self.source}')
+            WHERE TRUE
+                {window}
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY question_id ORDER BY last_edit_date DESC
+            ) = 1
+            """
+        ).fetch_arrow_table()
+
+    def to_markdown(self, pool: ProcessPoolExecutor, questions: pa.Table) -> list[str]:
+        """Convert questions and answers to the full markdown text of each question."""
+        full_texts = []
+        for batch in questions.to_batches(max_chunksize=self.markdown_batch_size):
+            columns = batch.to_pydict()
+            questions_md, answers_md = convert_html_batch_to_markdown(
+                pool, columns["question_text"], columns["answers"], self.markdown_workers
+            )
+            full_texts.extend(
+                f"# {title}\n{question_md}{answer_md}"  # Title is H1 heading size
+                for title, question_md, answer_md in zip(
+                    columns["question_title"], questions_md, answers_md
+                )
+            )
+        return full_texts
+
+    def chunk(self, questions: pa.Table, full_texts: list[str]) -> pa.Table:
+        """Split the markdown texts into chunks with ids question_id__index."""
+        text_splitter = create_text_splitter(self.chunk_size, self.chunk_overlap)
+        rows: dict[str, list] = {
+            "last_edit_date": [],
+            "question_id": [],
+            "question_text": [],
+            "full_text_md": [],
+            "text_chunk": [],
+            "chunk_id": [],
+        }
+        columns = questions.select(["last_edit_date", "question_id", "question_text"]).to_pydict()
+        for last_edit_date, question_id, question_text, full_text in zip(
+            columns["last_edit_date"], columns["question_id"], columns["question_text"], full_texts
+        ):
+            for index, text_chunk in enumerate(text_splitter.split_text(full_text)):
+                rows["last_edit_date"].append(last_edit_date)
+                rows["question_id"].append(question_id)
+                rows["question_text"].append(question_text)
+                rows["full_text_md"].append(full_text)
+                rows["text_chunk"].append(text_chunk)
+                rows["chunk_id"].append(f"{question_id}__{index}")
+        return pa.table(rows)
+
+    def embed(self, chunks: pa.Table) -> pa.Table:
+        """Embed new or changed chunks and reuse the embeddings of the others."""
+        self.db.register("run_chunks", chunks)
+        chunks = self.db.sql(
+            f"""
+            SELECT *, {content_hash_sql("text_chunk", self.embedding_model, "duckdb")} AS content_hash
+            FROM run_chunks
+            """
+        ).fetch_arrow_table()
+        self.db.unregister("run_chunks")
+        hashes = chunks.column("content_hash").to_pylist()
+
+        existing: dict[str, list[float]] = {}
+        if self._table_exists("deduped"):
+            self.db.register("run_chunks", chunks.select(["question_id", "content_hash"]))
+            existing = dict(
+                self.db.sql(
+                    """
+                    SELECT content_hash, ANY_VALUE(embedding)
+                    FROM deduped
+                    WHERE question_id IN (SELECT DISTINCT question_id FROM run_chunks)
+                        AND content_hash IN (SELECT content_hash FROM run_chunks)
+                    GROUP BY content_hash
+                    """
+                ).fetchall()
+            )
+            self.db.unregister("run_chunks")
+
+        texts = chunks.column("text_chunk").to_pylist()
+        missing = [i for i, digest in enumerate(hashes) if digest not in existing]
+        embeddings = [existing.get(digest) for digest in hashes]
+        for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+            rows = missing[start : start + EMBEDDING_BATCH_SIZE]
+            for row, embedding in zip(
+                rows, self.embedder.embed_documents([texts[row] for row in rows])
+            ):
+                embeddings[row] = embedding
+        self.counts["embedded"] = self.counts.get("embedded", 0) + len(missing)
+        self.counts["reused"] = self.counts.get("reused", 0) + len(hashes) - len(missing)
+        return chunks.append_column(
+            "embedding", pa.array(embeddings, pa.list_(pa.float32()))
+        ).append_column(
+            "creation_timestamp",
+            pa.array([datetime.now()] * chunks.num_rows, pa.timestamp("us")),
+        )
+
+    def store(self, rows: pa.Table) -> None:
+        """Append a shard's rows to the incremental table."""
+        self.db.register("run_rows", rows)
+        if self._table_exists("incremental"):
+            self.db.execute("INSERT INTO incremental BY NAME SELECT * FROM run_rows")
+        else:
+            self.db.execute("CREATE TABLE incremental AS SELECT * FROM run_rows")
+        self.db.unregister("run_rows")
+
+    def process_shard(self, pool: ProcessPoolExecutor, start_date: str, end_date: str) -> None:
+        with self.step("fetch"):
+            questions = self.fetch(start_date, end_date)
+        with self.step("markdown"):
+            full_texts = self.to_markdown(pool, questions)
+        with self.step("chunk"):
+            chunks = self.chunk(questions, full_texts)
+        with self.step("embed"):
+            rows = self.embed(chunks)
+        with self.step("store"):
+            self.store(rows)
+        self.counts["questions"] = self.counts.get("questions", 0) + questions.num_rows
+        self.counts["chunks"] = self.counts.get("chunks", 0) + rows.num_rows
+
+    # merge_data
+
+    def merge(self, run_start: datetime, is_incremental: bool) -> None:
+        """Replace the chunks of this run's questions in the deduplicated table,
+        with the MERGE statement of merge_data (needs DuckDB 1.4 or later)."""
+        if not self._table_exists("deduped"):
+            self.db.execute("CREATE TABLE deduped AS SELECT * FROM incremental LIMIT 0")
+        columns = [column for column, *_ in self.db.sql("DESCRIBE incremental").fetchall()]
+        run_start_sql = f"TIMESTAMP '{run_start.isoformat(sep=' ')}'"
+        run_rows = f"""
+            SELECT * FROM incremental
+            WHERE creation_timestamp >= {run_start_sql}
+                AND chunk_id IS NOT NULL
+        """
+        (count,) = self.db.sql(f"SELECT count(*) FROM ({run_rows})").fetchone()
+        if count == 0 and not is_incremental:
+            raise RuntimeError(
+                "No rows were written by this run; refusing to replace the "
+                "deduplicated table with an empty one."
+            )
+        self.db.execute(merge_rows_query("deduped", run_rows, columns, is_incremental))
+        if not is_incremental:
+            # Shards always append, so the full run replaces the incremental table here.
+            self.db.execute(f"DELETE FROM incremental WHERE creation_timestamp < {run_start_sql}")
+
+    # ingest_data
+
+    def ingest(self) -> int:
+        reader = self.db.sql(
+            "SELECT * FROM deduped WHERE chunk_id IS NOT NULL AND embedding IS NOT NULL"
+        ).fetch_record_batch()
+        return self.sink.ingest(iter(reader))
+
+    def run(
+        self,
+        end_date: date,
+        is_incremental: bool = True,
+        look_back_days: int = 1,
+        shard_days: int = 0,
+    ) -> dict[str, float]:
+        """Run the whole pipeline and return the time spent in each step."""
+        self.timings, self.counts = {}, {}
+        run_start = datetime.now()
+        with self.step("total"):
+            shards = self.plan_shards(end_date, is_incremental, look_back_days, shard_days)
+            with ProcessPoolExecutor(max_workers=self.markdown_workers) as pool:
+                for shard in shards:
+                    self.process_shard(pool, shard["start_date"], shard["end_date"])
+            with self.step("merge"):
+                self.merge(run_start, is_incremental)
+            with self.step("ingest"):
+                self.counts["ingested"] = self.ingest()
+        self.counts["shards"] = len(shards)
+        return self.timings
+
+    def _table_exists(self, name: str) -> bool:
+        return bool(
+            self.db.execute(
+                "SELECT count(*) FROM information_schema.tables WHERE table_name = ?",
+                [name],
+            ).fetchone()[0]
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the ingestion pipeline locally")
+    parser.add_argument("--source", required=True, help="Parquet file(s) with questions")
+    parser.add_argument("--workdir", default=".local_ingestion")
+    parser.add_argument("--datastore-type", default=DEFAULT_DATASTORE)
+    parser.add_argument("--end-date", default=None, help="Last day to process (default: latest in source)")
+    parser.add_argument("--full", action="store_true", help="Process the whole source")
+    parser.add_argument("--look-back-days", type=int, default=1)
+    parser.add_argument("--shard-days", type=int, default=0)
+    parser.add_argument("--markdown-workers", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = LocalRunner(
+        args.source,
+        args.workdir,
+        datastore_type=args.datastore_type,
+        markdown_workers=args.markdown_workers,
+    )
+    end_date = (
+        date.fromisoformat(args.end_date)
+        if args.end_date
+        else runner.db.sql(
+            f"SELECT max(creation_date)::DATE FROM read_parquet('{args.source}')"
+        ).fetchone()[0]
+    )
+    timings = runner.run(end_date, not args.full, args.look_back_days, args.shard_days)
+    for name, seconds in timings.items():
+        logging.info(f"{name:>10}: {seconds:8.2f}s")
+    logging.info(f"Counts: {runner.counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,14 @@
 # limitations under the License.
 
 from data_ingestion_pipeline.components.ingest_data import ingest_data
+from data_ingestion_pipeline.components.merge_data import merge_data
+from data_ingestion_pipeline.components.plan_shards import plan_shards
 from data_ingestion_pipeline.components.process_data import process_data
 from kfp import dsl
 
+# Maximum number of date shards processed at the same time
+MAX_PARALLEL_SHARDS = 8
+
 
 @dsl.pipeline(description="A pipeline to run ingestion of new data into the datastore")
 def pipeline(
@@ -23,6 +28,7 @@ def pipeline(
     location: str,
     is_incremental: bool = True,
     look_back_days: int = 1,
+    shard_days: int = 0,
     chunk_size: int = 1500,
     chunk_overlap: int = 20,
     destination_table: str = "incremental_questions_embeddings",
@@ -36,25 +42,59 @@ def pipeline(
     vector_search_index_endpoint: str = "",
     vector_search_data_bucket_name: str = "",
     ingestion_batch_size: int = 1000,
+    ingestion_workers: int = 8,
+    ingestion_max_failed_fraction: float = 0.0,
 {%- endif %}
 ) -> None:
-    """Processes data and ingests it into a datastore for RAG Retrieval"""
+    """Processes data and ingests it into a datastore for RAG Retrieval
 
-    # Process the data and generate embeddings
-    processed_data = process_data(
-        project_id=project_id,
+    The look-back window is split into date shards of `shard_days` days (0 for
+    a single shard), which are processed in parallel before being merged into
+    the deduplicated table.
+    """
+
+    # Split the processing window into date shards
+    shards = plan_shards(
         schedule_time=dsl.PIPELINE_JOB_SCHEDULE_TIME_UTC_PLACEHOLDER,
         is_incremental=is_incremental,
         look_back_days=look_back_days,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
+        shard_days=shard_days,
+    )
+
+    # Process the data and generate embeddings, one task per shard
+    with dsl.ParallelFor(
+        items=shards.output, parallelism=MAX_PARALLEL_SHARDS
+    ) as shard:
+        # Not cached: merge_data picks up the rows written since the job
+        # started, so a cached task, which writes nothing, would leave the
+        # run empty.
+        shard_data = process_data(
+            project_id=project_id,
+            schedule_time=dsl.PIPELINE_JOB_SCHEDULE_TIME_UTC_PLACEHOLDER,
+            is_incremental=is_incremental,
+            look_back_days=look_back_days,
+            start_date=shard.start_date,
+            end_date=shard.end_date,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            destination_dataset=destination_dataset,
+            destination_table=destination_table,
+            deduped_table=deduped_table,
+            location=location,
+        ).set_caching_options(False).set_retry(num_retries=2)
+
+    # Merge the rows of all shards into the deduplicated table
+    processed_data = merge_data(
+        project_id=project_id,
+        run_start_time=dsl.PIPELINE_JOB_CREATE_TIME_UTC_PLACEHOLDER,
+        is_incremental=is_incremental,
         destination_dataset=destination_dataset,
         destination_table=destination_table,
         deduped_table=deduped_table,
         location=location,
 {%- if cookiecutter.datastore_type == "vertex_ai_search" %}
         embedding_column="embedding",{% endif %}
-    ).set_retry(num_retries=2)
+    ).after(shard_data).set_retry(num_retries=2)
 {% if cookiecutter.datastore_type == "vertex_ai_search" %}
     # Ingest the processed data into Vertex AI Search datastore
     ingest_data(
@@ -77,5 +117,7 @@ def pipeline(
         is_incremental=False,
         look_back_days=look_back_days,
         ingestion_batch_size=ingestion_batch_size,
+        ingestion_workers=ingestion_workers,
+        max_failed_fraction=ingestion_max_failed_fraction,
     ).set_retry(num_retries=2)
 {% endif %}
\ No newline at end of file
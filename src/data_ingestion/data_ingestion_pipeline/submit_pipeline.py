@@ -13,15 +13,19 @@
 # limitations under the License.
 
 import argparse
+import hashlib
 import logging
 import os
+import pathlib
 import sys
+from importlib import metadata
 
-from data_ingestion_pipeline.pipeline import pipeline
-from google.cloud import aiplatform
-from kfp import compiler
+from google.cloud import aiplatform, storage
 
 PIPELINE_FILE_NAME = "data_processing_pipeline.json"
+# Compiled pipeline specs, keyed by the hash of the pipeline sources
+PIPELINE_CACHE_DIR = pathlib.Path(".cache/compiled_pipelines")
+PIPELINE_PACKAGE_DIR = pathlib.Path(__file__).parent
 
 # Configure logging
 logging.basicConfig(
@@ -85,6 +89,18 @@ def parse_args() -> argparse.Namespace:
         default=os.getenv("DISABLE_CACHING", "false").lower() == "true",
         help="Enable pipeline caching",
     )
+    parser.add_argument(
+        "--look-back-days",
+        type=int,
+        default=int(os.getenv("LOOK_BACK_DAYS", "1")),
+        help="Number of days of data to process",
+    )
+    parser.add_argument(
+        "--shard-days",
+        type=int,
+        default=int(os.getenv("SHARD_DAYS", "0")),
+        help="Days per parallel processing shard (0 = a single shard)",
+    )
     parser.add_argument(
         "--cron-schedule",
         default=os.getenv("CRON_SCHEDULE", None),
@@ -136,6 +152,63 @@ def parse_args() -> argparse.Namespace:
     return parsed_args
 
 
+def pipeline_spec_hash() -> str:
+    """Hash of everything the compiled pipeline spec depends on.
+
+    Covers the source of the pipeline and its components (including their
+    parameter defaults) and the KFP version, so an unchanged pipeline maps to
+    the same compiled spec.
+    """
+    digest = hashlib.sha256(metadata.version("kfp").encode())
+    for path in sorted(PIPELINE_PACKAGE_DIR.rglob("*.py")):
+        if path.name == "submit_pipeline.py":
+            continue
+        digest.update(str(path.relative_to(PIPELINE_PACKAGE_DIR)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def get_pipeline_template(project_id: str, pipeline_root: str, spec_hash: str) -> str:
+    """Return the URI of the compiled pipeline template, building it if needed.
+
+    Templates are versioned by spec hash under the pipeline root, so runs and
+    schedules of an unchanged pipeline reuse the uploaded template without
+    compiling or uploading again. Compiled specs are also cached locally.
+
+    Args:
+        project_id: GCP Project ID
+        pipeline_root: GCS pipeline root directory
+        spec_hash: Hash returned by pipeline_spec_hash()
+
+    Returns:
+        gs:// URI of the template
+    """
+    file_name = f"{pathlib.Path(PIPELINE_FILE_NAME).stem}-{spec_hash}.json"
+    template_uri = f"{pipeline_root.rstrip('/')}/templates/{file_name}"
+    blob = storage.Blob.from_string(template_uri, client=storage.Client(project=project_id))
+    if blob.exists():
+        logging.info(f"Using uploaded pipeline template {template_uri}")
+        return template_uri
+
+    local_path = PIPELINE_CACHE_DIR / file_name
+    if local_path.exists():
+        logging.info(f"Using compiled pipeline {local_path}")
+    else:
+        # Imported here so that runs with an uploaded template skip loading KFP
+        from data_ingestion_pipeline.pipeline import pipeline
+        from kfp import compiler
+
+        logging.info("Compiling pipeline...")
+        PIPELINE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        compiler.Compiler().compile(
+            pipeline_func=pipeline, package_path=str(local_path)
+        )
+
+    blob.upload_from_filename(str(local_path), content_type="application/json")
+    logging.info(f"Uploaded pipeline template {template_uri}")
+    return template_uri
+
+
 if __name__ == "__main__":
     args = parse_args()
 
@@ -151,11 +224,15 @@ if __name__ == "__main__":
         logging.info(f"{arg_name}: {arg_value}")
     logging.info("--------------\n")
 
-    compiler.Compiler().compile(pipeline_func=pipeline, package_path=PIPELINE_FILE_NAME)
+    spec_hash = pipeline_spec_hash()
+    template_path = get_pipeline_template(
+        args.project_id, args.pipeline_root, spec_hash
+    )
     # Create common pipeline job parameters
     pipeline_job_params = {
         "display_name": args.pipeline_name,
-        "template_path": PIPELINE_FILE_NAME,
+        "template_path": template_path,
+        "labels": {"pipeline-spec-hash": spec_hash},
         "pipeline_root": args.pipeline_root,
         "project": args.project_id,
         "enable_caching": (not args.disable_caching),
@@ -163,6 +240,8 @@ if __name__ == "__main__":
         "parameter_values": {
             "project_id": args.project_id,
             "location": args.region,
+            "look_back_days": args.look_back_days,
+            "shard_days": args.shard_days,
         },
     }
 {%- if cookiecutter.datastore_type == "vertex_ai_search" %}
@@ -204,16 +283,26 @@ if __name__ == "__main__":
             location=args.region,
         )
         logging.info("Schedule lists found: %s", schedule_list)
-        if not schedule_list:
+        # A schedule keeps the pipeline spec it was created with, so it is
+        # only updated in place while the spec is unchanged.
+        scheduled_spec_hash = (
+            schedule_list[0]
+            .gca_resource.create_pipeline_job_request.pipeline_job.labels.get(
+                "pipeline-spec-hash"
+            )
+            if schedule_list
+            else None
+        )
+        if schedule_list and scheduled_spec_hash == spec_hash:
+            schedule_list[0].update(cron=args.cron_schedule)
+            logging.info("Schedule updated")
+        else:
+            # Create the new schedule before deleting the old one, so that a
+            # failed creation leaves the previous schedule running.
             pipeline_job_schedule.create(
                 cron=args.cron_schedule, service_account=args.service_account
             )
             logging.info("Schedule created")
-        else:
-            schedule_list[0].update(cron=args.cron_schedule)
-            logging.info("Schedule updated")
-
-    # Clean up pipeline file
-    if os.path.exists(PIPELINE_FILE_NAME):
-        os.remove(PIPELINE_FILE_NAME)
-        logging.info(f"Deleted {PIPELINE_FILE_NAME}")
+            if schedule_list:
+                schedule_list[0].delete()
+                logging.info("Pipeline changed, deleted the previous schedule")
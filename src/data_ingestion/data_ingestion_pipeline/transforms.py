@@ -0,0 +1,217 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Steps shared by the pipeline components and the local runner.
+
+The components embed these functions with `additional_funcs`, which copies
+their source into the component code, so each function must be
+self-contained: imports go inside the function body and one function must
+not call another.
+"""
+
+
+def plan_date_shards(start, end, shard_days: int) -> list:
+    """Split the inclusive date window [start, end] into date shards.
+
+    Args:
+        start: First day of the window
+        end: Last day of the window
+        shard_days: Days per shard, 0 for a single shard
+
+    Returns:
+        List of {"start_date", "end_date"} dicts with inclusive ISO dates
+    """
+    from datetime import timedelta
+
+    shard_days = shard_days or (end - start).days + 1
+    shards = []
+    while start <= end:
+        shard_end = min(start + timedelta(days=shard_days - 1), end)
+        shards.append(
+            {"start_date": start.isoformat(), "end_date": shard_end.isoformat()}
+        )
+        start = shard_end + timedelta(days=1)
+    return shards
+
+
+def convert_html_batch_to_markdown(
+    pool, question_htmls: list, answers: list, workers: int
+) -> tuple:
+    """Convert a record batch's questions and answers to markdown on the pool.
+
+    All HTML fields of the batch are flattened into one list so that each
+    worker task gets many small documents, then regrouped per question.
+    html2text works on a streaming parser rather than a BeautifulSoup tree,
+    and a partial of a module-level function can be sent to worker processes.
+
+    Args:
+        pool: Process pool running the conversions
+        question_htmls: Question bodies
+        answers: Answer records of each question, with a "body" field
+        workers: Number of processes in the pool
+
+    Returns:
+        The question markdowns and the answers markdown of each question
+    """
+    import functools
+
+    import html2text
+
+    convert_html_to_markdown = functools.partial(html2text.html2text, bodywidth=0)
+    htmls = [html or "" for html in question_htmls]
+    answer_spans = []
+    for answer_records in answers:
+        start = len(htmls)
+        if answer_records is not None:  # Arrays from pandas batches have no truth value
+            htmls.extend(
+                answer_record["body"] or "" for answer_record in answer_records
+            )
+        answer_spans.append((start, len(htmls)))
+
+    chunksize = max(1, len(htmls) // (workers * 4))
+    converted = [
+        md.strip()
+        for md in pool.map(convert_html_to_markdown, htmls, chunksize=chunksize)
+    ]
+
+    questions_md = [md + "\n" for md in converted[: len(question_htmls)]]
+    answers_md = [
+        "".join(
+            f"\n\n## Answer {index + 1}:\n{md}"  # Answer number is H2 heading size
+            for index, md in enumerate(converted[start:end])
+        )
+        for start, end in answer_spans
+    ]
+    return questions_md, answers_md
+
+
+def create_text_splitter(chunk_size: int, chunk_overlap: int):
+    """Text splitter cutting the markdown of a question into chunks."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+
+
+def content_hash_sql(
+    text_column: str, embedding_model: str, dialect: str = "bigquery"
+) -> str:
+    """SQL expression hashing a chunk text together with the embedding model.
+
+    Args:
+        text_column: Column or expression holding the chunk text
+        embedding_model: Name of the embedding model
+        dialect: "bigquery" or "duckdb"; both give the same hex digest
+
+    Returns:
+        The SQL expression
+    """
+    digest = f"SHA256(CONCAT('{embedding_model}', ':', {text_column}))"
+    # DuckDB's SHA256 already returns the hex digest.
+    return f"TO_HEX({digest})" if dialect == "bigquery" else digest
+
+
+def combine_reused_chunks(new_chunks, reused_chunks, concat):
+    """Rows of a shard: the newly embedded chunks followed by the reused ones.
+
+    When every chunk is reused, nothing was embedded and `new_chunks` lacks
+    the embedding columns, so the reused rows are returned as they are rather
+    than narrowed to its columns.
+
+    Args:
+        new_chunks: Embedded new or changed chunks (pandas or bigframes)
+        reused_chunks: Chunks carrying their previous embeddings, or None
+        concat: Concatenation function of the dataframe library
+
+    Returns:
+        The combined dataframe
+    """
+    if reused_chunks is None:
+        return new_chunks
+    if len(new_chunks) == 0:
+        return reused_chunks
+    return concat(
+        [new_chunks, reused_chunks[list(new_chunks.columns)]], ignore_index=True
+    )
+
+
+def merge_rows_query(
+    target_table: str,
+    run_rows_query: str,
+    columns: list,
+    is_incremental: bool,
+    partition_column: str = "creation_timestamp",
+) -> str:
+    """MERGE statement replacing the chunks of a run's questions in a table.
+
+    A question seen again replaces its chunks: matching chunk ids are
+    updated, new ones inserted and chunks it no longer has are deleted. A
+    full run replaces the whole table, so it empties the table when the run
+    has no rows; callers check for that first. The statement runs on
+    BigQuery and DuckDB.
+
+    Args:
+        target_table: Deduplicated table, quoted as the engine needs
+        run_rows_query: Query returning the run's rows
+        columns: Columns of the rows
+        is_incremental: Whether only the questions of this run are replaced
+        partition_column: Timestamp deciding which row of a chunk is the latest
+
+    Returns:
+        The MERGE statement
+    """
+    stale_rows_condition = (
+        f"AND T.question_id IN (SELECT question_id FROM ({run_rows_query}))"
+        if is_incremental
+        else ""
+    )
+    return f"""
+    MERGE INTO {target_table} AS T
+    USING (
+        {run_rows_query}
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY chunk_id ORDER BY {partition_column} DESC
+        ) = 1
+    ) AS S
+    ON T.chunk_id = S.chunk_id
+    WHEN MATCHED AND S.{partition_column} >= T.{partition_column} THEN
+        UPDATE SET {", ".join(f"{column} = S.{column}" for column in columns)}
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT ({", ".join(columns)})
+        VALUES ({", ".join(f"S.{column}" for column in columns)})
+    WHEN NOT MATCHED BY SOURCE {stale_rows_condition} THEN
+        DELETE
+    """
+
+
+def to_datapoints(batch) -> dict:
+    """Convert a pyarrow batch of deduplicated rows into the arguments of
+    VectorSearchVectorStore.add_texts_with_embeddings."""
+    columns = batch.to_pydict()
+    metadata_columns = [
+        name for name in columns if name not in ("embedding", "last_edit_date")
+    ]
+    return {
+        "ids": [str(question_id) for question_id in columns["question_id"]],
+        "texts": columns["text_chunk"],
+        "embeddings": columns["embedding"],
+        "metadatas": [
+            dict(zip(metadata_columns, values))
+            for values in zip(*(columns[name] for name in metadata_columns))
+        ],
+    }
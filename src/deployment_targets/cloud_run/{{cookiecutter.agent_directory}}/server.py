@@ -275,9 +275,10 @@ app: FastAPI = get_fast_api_app(
 app.title = "{{cookiecutter.project_name}}"
 app.description = "API for interacting with the Agent {{cookiecutter.project_name}}"
 {% else %}
+import asyncio
 import logging
 import os
-from collections.abc import Generator
+from collections.abc import AsyncGenerator
 
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse, StreamingResponse
@@ -326,12 +327,16 @@ def set_tracing_properties(config: RunnableConfig) -> None:
     )
 
 
-def stream_messages(
+async def stream_messages(
     input: InputChat,
     config: RunnableConfig | None = None,
-) -> Generator[str, None, None]:
+) -> AsyncGenerator[str, None]:
     """Stream events in response to an input chat.
 
+    Runs on the event loop, so an in-flight conversation does not hold a
+    threadpool thread. The agent is only advanced once the previous event has
+    been written to the client, and it is cancelled if the client disconnects.
+
     Args:
         input: The input chat messages
         config: Optional configuration for the runnable
@@ -343,8 +348,12 @@ def stream_messages(
     set_tracing_properties(config)
     input_dict = input.model_dump()
 
-    for data in agent.stream(input_dict, config=config, stream_mode="messages"):  # type: ignore[arg-type]
-        yield dumps(data) + "\n"
+    try:
+        async for data in agent.astream(input_dict, config=config, stream_mode="messages"):  # type: ignore[arg-type]
+            yield dumps(data) + "\n"
+    except asyncio.CancelledError:
+        logging.info("Client disconnected, cancelled run %s", config.get("run_id"))
+        raise
 
 
 # Routes
@@ -355,7 +364,7 @@ def redirect_root_to_docs() -> RedirectResponse:
 
 
 @app.post("/stream_messages")
-def stream_chat_events(request: Request) -> StreamingResponse:
+async def stream_chat_events(request: Request) -> StreamingResponse:
     """Stream chat events in response to an input request.
 
     Args:
@@ -0,0 +1,10 @@
+# tests/app/conftest.py
+
+"""The ingestion scripts in app/ import each other as top-level modules."""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "app")
+)
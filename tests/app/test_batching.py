@@ -0,0 +1,70 @@
+# tests/app/test_batching.py
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from batching import AdaptiveBatcher, estimate_tokens, is_batch_size_error
+from embedding_backends import OfflineEmbeddingBackend
+
+
+def texts(count: int, words: int = 5) -> list:
+    """Texts of equal length, so every text has the same token estimate."""
+    return [" ".join(f"word{i:04d}x{j:02d}" for j in range(words)) for i in range(count)]
+
+
+def test_too_many_instances_halves_the_batch():
+    backend = OfflineEmbeddingBackend(dimensions=8, max_instances=8)
+    batcher = AdaptiveBatcher(max_instances=16, grow_after=100)
+    batch = texts(16)
+
+    embeddings = batcher.embed(batch, backend.get_embeddings)
+
+    assert [e.values for e in embeddings] == [backend.embed_text(text) for text in batch]
+    assert batcher.splits == 1
+    assert batcher.instance_limit == 8
+    assert [len(b) for b in batcher.batches(texts(20))] == [8, 8, 4]
+
+
+def test_too_many_tokens_halves_the_batch():
+    batch = texts(8, words=20)
+    tokens = sum(estimate_tokens(text) for text in batch)
+    backend = OfflineEmbeddingBackend(dimensions=8, max_tokens=tokens // 2)
+    batcher = AdaptiveBatcher(max_instances=8, max_tokens=tokens, grow_after=100)
+
+    embeddings = batcher.embed(batch, backend.get_embeddings)
+
+    assert len(embeddings) == len(batch)
+    assert batcher.splits == 1
+    assert batcher.token_limit == tokens // 2
+    assert backend.requests == 2
+
+
+def test_limits_grow_back_to_the_maximum_after_successes():
+    backend = OfflineEmbeddingBackend(dimensions=8, max_instances=4)
+    batcher = AdaptiveBatcher(max_instances=16, grow_after=100)
+    batcher.embed(texts(16), backend.get_embeddings)
+    assert batcher.instance_limit == 4
+
+    backend.max_instances = 16
+    batcher.grow_after = 2
+    limits = []
+    for _ in range(20):
+        batcher.embed(texts(batcher.instance_limit), backend.get_embeddings)
+        limits.append(batcher.instance_limit)
+    assert limits == sorted(limits)
+    assert limits[-1] == 16
+
+
+def test_other_errors_are_not_split():
+    batcher = AdaptiveBatcher(max_instances=16)
+    calls = []
+
+    def throttled(batch):
+        calls.append(len(batch))
+        raise api_exceptions.ResourceExhausted("Quota exceeded")
+
+    with pytest.raises(api_exceptions.ResourceExhausted):
+        batcher.embed(texts(16), throttled)
+    assert calls == [16]
+    assert batcher.instance_limit == 16
+    assert not is_batch_size_error(api_exceptions.InvalidArgument("Malformed instance"))
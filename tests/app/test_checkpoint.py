@@ -0,0 +1,104 @@
+# tests/app/test_checkpoint.py
+
+import json
+
+from google.api_core import exceptions as api_exceptions
+
+import embedding
+from checkpoint import DeadLetterFile
+from embedding_backends import OfflineEmbeddingBackend
+
+
+def write_chunks(path, count: int) -> list:
+    ids = [f"chunk-{i}" for i in range(count)]
+    with open(path, "w") as f:
+        for i, chunk_id in enumerate(ids):
+            f.write(json.dumps({"id": chunk_id, "text": f"text number {i} about topic {i % 7}"}) + "\n")
+    return ids
+
+
+def use_offline_backend(monkeypatch, tmp_path, batch_size: int = 5):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_SIZE", batch_size)
+    monkeypatch.setattr(embedding, "EMBEDDING_CACHE_FILE", "")
+    monkeypatch.setattr(
+        embedding, "load_embedding_model", lambda: OfflineEmbeddingBackend(dimensions=8)
+    )
+
+
+def crash_after(commits: int) -> None:
+    """Rewinds the checkpoint to its first `commits` batches, as if the run
+    had died while writing the next batch and its manifest record."""
+    with open(embedding.CHECKPOINT_FILE) as f:
+        records = f.readlines()
+    kept = [record for record in records if "input" in json.loads(record)]
+    kept += [record for record in records if "ids" in json.loads(record)][:commits]
+    with open(embedding.CHECKPOINT_FILE, "w") as f:
+        f.writelines(kept)
+        f.write('{"ids": ["chunk-')
+    with open(embedding.EMBEDDED_DATA_FILE, "a") as f:
+        f.write('{"id": "chunk-3", "text": "text num')
+
+
+def test_resume_after_truncated_write_has_no_duplicates_or_gaps(monkeypatch, tmp_path):
+    use_offline_backend(monkeypatch, tmp_path)
+    ids = write_chunks(embedding.INGESTED_DATA_FILE, 42)
+    embedding.generate_embeddings()
+    with open(embedding.EMBEDDED_DATA_FILE, "rb") as f:
+        complete_output = f.read()
+
+    crash_after(commits=3)
+    embedding.generate_embeddings(resume=True)
+
+    with open(embedding.EMBEDDED_DATA_FILE, "rb") as f:
+        resumed_output = f.read()
+    assert [json.loads(line)["id"] for line in resumed_output.splitlines()] == ids
+    assert resumed_output == complete_output
+
+
+def test_resume_refuses_a_changed_input(monkeypatch, tmp_path):
+    use_offline_backend(monkeypatch, tmp_path)
+    write_chunks(embedding.INGESTED_DATA_FILE, 20)
+    embedding.generate_embeddings()
+    crash_after(commits=1)
+    with open(embedding.EMBEDDED_DATA_FILE, "rb") as f:
+        interrupted_output = f.read()
+
+    write_chunks(embedding.INGESTED_DATA_FILE, 30)
+    embedding.generate_embeddings(resume=True)
+
+    with open(embedding.EMBEDDED_DATA_FILE, "rb") as f:
+        assert f.read() == interrupted_output
+
+
+def test_dead_letters_are_deduplicated_by_id(tmp_path):
+    dead_letters = DeadLetterFile(str(tmp_path / "failures.jsonl"))
+    first, second = {"id": "a", "text": "first"}, {"id": "b", "text": "second"}
+    dead_letters.add([first, second], api_exceptions.ServiceUnavailable("outage"))
+    # A crash before the batch was committed dead-letters it again on resume.
+    dead_letters.add([first], api_exceptions.ResourceExhausted("quota"))
+
+    entries = dead_letters.read()
+    assert [entry["item"]["id"] for entry in entries] == ["a", "b"]
+    assert "quota" in entries[0]["error"]
+    assert "outage" in entries[1]["error"]
+
+
+def test_retry_embeds_dead_letters_once(monkeypatch, tmp_path):
+    use_offline_backend(monkeypatch, tmp_path)
+    ids = write_chunks(embedding.INGESTED_DATA_FILE, 12)
+    failing = OfflineEmbeddingBackend(dimensions=8, error_rate=1.0)
+    monkeypatch.setattr(embedding, "load_embedding_model", lambda: failing)
+    monkeypatch.setattr(embedding, "get_embeddings_with_retry", lambda model, texts, _: model.get_embeddings(texts))
+    embedding.generate_embeddings()
+    assert embedding.failed_chunk_ids() == set(ids)
+
+    # The same items failing twice must still only be retried once.
+    dead_letters = DeadLetterFile(embedding.DEAD_LETTER_FILE)
+    dead_letters.add([dead_letters.read()[0]["item"]], RuntimeError("again"))
+    monkeypatch.setattr(embedding, "load_embedding_model", lambda: OfflineEmbeddingBackend(dimensions=8))
+    embedding.retry_failed_embeddings()
+
+    with open(embedding.EMBEDDED_DATA_FILE) as f:
+        assert sorted(json.loads(line)["id"] for line in f) == sorted(ids)
+    assert embedding.failed_chunk_ids() == set()
@@ -0,0 +1,74 @@
+# tests/app/test_dedup.py
+
+import random
+
+import numpy as np
+
+from dedup import MinHashDeduplicator, candidate_probability, optimal_bands, shingles
+
+
+def jaccard(a: str, b: str) -> float:
+    a_shingles, b_shingles = shingles(a), shingles(b)
+    return len(a_shingles & b_shingles) / len(a_shingles | b_shingles)
+
+
+def near_duplicate_pairs(count: int, words: int, edits: int, seed: int = 0):
+    """Random documents paired with a copy that has `edits` words replaced."""
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    pairs = []
+    for _ in range(count):
+        original = rng.choices(vocabulary, k=words)
+        edited = list(original)
+        for position in rng.sample(range(words), edits):
+            edited[position] = rng.choice(vocabulary)
+        pairs.append((" ".join(original), " ".join(edited)))
+    return pairs
+
+
+def test_optimal_bands_places_s_curve_below_threshold():
+    bands, rows = optimal_bands(0.8, 128)
+    assert bands * rows <= 128
+    assert candidate_probability(0.8, bands, rows) >= 0.9
+
+
+def test_recall_on_near_duplicate_pairs():
+    pairs = near_duplicate_pairs(count=200, words=300, edits=3)
+    similarities = [jaccard(original, edited) for original, edited in pairs]
+    assert min(similarities) >= 0.85
+
+    deduplicator = MinHashDeduplicator(threshold=0.8)
+    representatives = [deduplicator.add(original) for original, _ in pairs]
+    assert representatives == [None] * len(pairs)
+
+    found = sum(deduplicator.add(edited) == i for i, (_, edited) in enumerate(pairs))
+    assert found / len(pairs) >= 0.95
+
+
+class FixedSignatures(MinHashDeduplicator):
+    """Uses the given signatures instead of hashing the text."""
+
+    def __init__(self, signatures, **kwargs):
+        super().__init__(**kwargs)
+        self.signatures = signatures
+
+    def signature(self, text):
+        return self.signatures[text]
+
+
+def test_documents_sharing_a_bucket_are_all_compared():
+    deduplicator = FixedSignatures({}, threshold=0.8, num_perm=128)
+    rows = deduplicator.rows
+    a = np.zeros(128, dtype=np.uint64)
+    # b shares only its first band with a, so it is a new representative.
+    b = a.copy()
+    b[rows:] = 1
+    # c is b with one value changed in every band but the first: similar
+    # enough to b, but the first band is the only bucket they share.
+    c = b.copy()
+    c[rows::rows] = 2
+    deduplicator.signatures = {"a": a, "b": b, "c": c}
+
+    assert deduplicator.add("a") is None
+    assert deduplicator.add("b") is None
+    assert deduplicator.add("c") == 1
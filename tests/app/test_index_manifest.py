@@ -0,0 +1,64 @@
+# tests/app/test_index_manifest.py
+
+from chunk_io import ChunkWriter
+from embedding_backends import OfflineEmbeddingBackend
+from index_manifest import build_manifest, carry_over, datapoint_hash, diff_manifests
+
+BACKEND = OfflineEmbeddingBackend(dimensions=8)
+
+
+def chunk(chunk_id: str, text: str) -> dict:
+    return {"id": chunk_id, "text": text, "embedding": BACKEND.embed_text(text)}
+
+
+def write_chunks(path, chunks) -> str:
+    with ChunkWriter(str(path)) as writer:
+        writer.write_many(chunks)
+    return str(path)
+
+
+def test_diff_gives_changed_and_new_upserts_and_removed_deletes(tmp_path):
+    deployed = build_manifest(
+        write_chunks(
+            tmp_path / "deployed.jsonl",
+            [chunk("kept", "unchanged text"), chunk("edited", "old text"), chunk("gone", "removed text")],
+        )
+    )
+    current = build_manifest(
+        write_chunks(
+            tmp_path / "current.jsonl",
+            [chunk("kept", "unchanged text"), chunk("edited", "new text"), chunk("added", "added text")],
+        )
+    )
+
+    upserts, deletes = diff_manifests(deployed, current)
+
+    assert upserts == {"edited", "added"}
+    assert deletes == ["gone"]
+    assert diff_manifests(current, current) == (set(), [])
+
+
+def test_embedding_change_alone_is_upserted():
+    item = chunk("a", "same text")
+    reembedded = dict(item, embedding=[value + 1e-3 for value in item["embedding"]])
+    assert datapoint_hash(item) != datapoint_hash(reembedded)
+
+    upserts, deletes = diff_manifests({"a": datapoint_hash(item)}, {"a": datapoint_hash(reembedded)})
+    assert upserts == {"a"}
+    assert deletes == []
+
+
+def test_unresolved_chunks_are_kept_until_embedded():
+    deployed = {"ok": "1", "failed": "2", "gone": "3"}
+    current = {"ok": "1"}
+
+    upserts, deletes = diff_manifests(deployed, current, unresolved={"failed"})
+    assert upserts == set()
+    assert deletes == ["gone"]
+
+    saved = carry_over(deployed, current, unresolved={"failed", "never-deployed"})
+    assert saved == {"ok": "1", "failed": "2"}
+
+    # Once the chunk embeds again, it is upserted only if it changed.
+    assert diff_manifests(saved, {"ok": "1", "failed": "2"}) == (set(), [])
+    assert diff_manifests(saved, {"ok": "1", "failed": "4"}) == ({"failed"}, [])
@@ -0,0 +1,102 @@
+# tests/app/test_rate_control.py
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import rate_control
+from embedding_backends import OfflineEmbeddingBackend
+from rate_control import RateController, is_throttle_error, is_transient_error, ordered_map
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_control, "BACKOFF_BASE_SECONDS", 0.0)
+
+
+def failing(errors: list):
+    """A request raising `errors` in turn, then returning "ok"."""
+    remaining = list(errors)
+
+    def request():
+        if remaining:
+            raise remaining.pop(0)
+        return "ok"
+
+    return request
+
+
+def test_throttles_halve_the_window(monkeypatch):
+    monkeypatch.setattr(rate_control, "DECREASE_COOLDOWN_SECONDS", 0.0)
+    controller = RateController(max_concurrency=16, initial_concurrency=16, requests_per_minute=0)
+    throttle = api_exceptions.ResourceExhausted("Quota exceeded")
+
+    assert controller.call(failing([throttle, throttle, throttle])) == "ok"
+
+    assert controller.window == 2
+    assert controller.throttles == 3
+    assert controller.retries == 3
+
+
+def test_a_burst_of_throttles_halves_the_window_once():
+    controller = RateController(max_concurrency=16, initial_concurrency=16, requests_per_minute=0)
+    throttle = api_exceptions.TooManyRequests("Too many requests")
+
+    controller.call(failing([throttle] * 4))
+
+    assert controller.window == 8
+    assert controller.throttles == 4
+
+
+def test_successes_widen_the_window_additively():
+    controller = RateController(max_concurrency=8, initial_concurrency=2, requests_per_minute=0)
+    for _ in range(2):
+        controller.call(lambda: "ok")
+    assert controller.window == 2
+    for _ in range(3):
+        controller.call(lambda: "ok")
+    assert controller.window == 3
+    for _ in range(100):
+        controller.call(lambda: "ok")
+    assert controller.window == 8
+
+
+def test_retry_classification():
+    assert is_throttle_error(api_exceptions.ResourceExhausted("quota"))
+    assert is_throttle_error(api_exceptions.TooManyRequests("429"))
+    assert is_transient_error(api_exceptions.ServiceUnavailable("503"))
+    assert is_transient_error(api_exceptions.DeadlineExceeded("timeout"))
+    assert is_transient_error(ConnectionError())
+    invalid = api_exceptions.InvalidArgument("bad request")
+    assert not is_throttle_error(invalid) and not is_transient_error(invalid)
+
+    controller = RateController(requests_per_minute=0)
+    with pytest.raises(api_exceptions.InvalidArgument):
+        controller.call(failing([invalid]))
+    assert controller.retries == 0
+
+    outage = api_exceptions.ServiceUnavailable("outage")
+    assert controller.call(failing([outage] * rate_control.TRANSIENT_RETRIES)) == "ok"
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        controller.call(failing([outage] * (rate_control.TRANSIENT_RETRIES + 1)))
+
+
+def test_concurrency_quota_shrinks_the_window(monkeypatch):
+    monkeypatch.setattr(rate_control, "DECREASE_COOLDOWN_SECONDS", 0.0)
+    # Retries have to wait for requests holding the quota to finish.
+    monkeypatch.setattr(rate_control, "BACKOFF_BASE_SECONDS", 0.02)
+    backend = OfflineEmbeddingBackend(dimensions=8, latency_ms=20, max_concurrency=2)
+    controller = RateController(max_concurrency=16, initial_concurrency=16, requests_per_minute=0)
+    batches = [[f"text {i} {j}" for j in range(4)] for i in range(16)]
+
+    results = list(
+        ordered_map(
+            lambda batch: controller.call(lambda: backend.get_embeddings(batch), items=len(batch)),
+            batches,
+            controller,
+        )
+    )
+
+    assert [batch for batch, _, _ in results] == batches
+    assert all(error is None for _, _, error in results)
+    assert controller.throttles > 0
+    assert controller.window <= 4
@@ -0,0 +1,13 @@
+# tests/data_ingestion/conftest.py
+
+"""The pipeline transforms are imported from the data ingestion template."""
+
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "data_ingestion"
+    ),
+)
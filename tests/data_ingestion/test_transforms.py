@@ -0,0 +1,88 @@
+# tests/data_ingestion/test_transforms.py
+
+import duckdb
+import pandas as pd
+
+from data_ingestion_pipeline.transforms import combine_reused_chunks, merge_rows_query
+
+EMBEDDING_COLUMNS = ["embedding", "embedding_statistics", "embedding_status"]
+
+
+def split_reused(all_chunks: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Split the reuse query's rows the way process_data does."""
+    reused = all_chunks[all_chunks["is_reused"]].drop(columns="is_reused")
+    new = all_chunks[~all_chunks["is_reused"]].drop(
+        columns=["is_reused", *EMBEDDING_COLUMNS]
+    )
+    return new, reused
+
+
+def chunks(reused: list[bool]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "chunk_id": [f"1__{i}" for i in range(len(reused))],
+            "text_chunk": [f"text {i}" for i in range(len(reused))],
+            "embedding": [[0.5, 0.5] if r else None for r in reused],
+            "embedding_statistics": ["{}" if r else None for r in reused],
+            "embedding_status": ["" if r else None for r in reused],
+            "is_reused": reused,
+        }
+    )
+
+
+def embed(new: pd.DataFrame) -> pd.DataFrame:
+    return new.assign(
+        embedding=[[1.0, 0.0]] * len(new),
+        embedding_statistics=["{}"] * len(new),
+        embedding_status=[""] * len(new),
+    )
+
+
+def test_all_reused_chunks_keep_their_embeddings():
+    new, reused = split_reused(chunks([True, True]))
+    combined = combine_reused_chunks(new, reused, pd.concat)
+    assert set(EMBEDDING_COLUMNS) <= set(combined.columns)
+    assert combined["embedding"].tolist() == [[0.5, 0.5], [0.5, 0.5]]
+    assert combined["embedding_status"].tolist() == ["", ""]
+
+
+def test_new_and_reused_chunks_are_combined():
+    new, reused = split_reused(chunks([False, True]))
+    combined = combine_reused_chunks(embed(new), reused, pd.concat)
+    assert list(combined.columns) == list(embed(new).columns)
+    assert combined.set_index("chunk_id")["embedding"].to_dict() == {
+        "1__0": [1.0, 0.0],
+        "1__1": [0.5, 0.5],
+    }
+
+
+def test_no_existing_table():
+    new = chunks([False]).drop(columns=["is_reused", *EMBEDDING_COLUMNS])
+    assert combine_reused_chunks(embed(new), None, pd.concat).equals(embed(new))
+
+
+def merge(rows: list[tuple], existing: list[tuple], is_incremental: bool) -> set:
+    """Merge (question_id, chunk_id, creation_timestamp) rows into a table."""
+    db = duckdb.connect()
+    for table, values in (("deduped", existing), ("incremental", rows)):
+        db.execute(
+            f"CREATE TABLE {table} (question_id INT, chunk_id VARCHAR, creation_timestamp INT)"
+        )
+        if values:
+            db.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", values)
+    columns = ["question_id", "chunk_id", "creation_timestamp"]
+    db.execute(
+        merge_rows_query("deduped", "SELECT * FROM incremental", columns, is_incremental)
+    )
+    return set(db.sql("SELECT * FROM deduped").fetchall())
+
+
+def test_incremental_merge_replaces_only_the_run_questions():
+    existing = [(1, "1__0", 1), (1, "1__1", 1), (2, "2__0", 1)]
+    rows = [(1, "1__0", 2), (1, "1__0", 3)]
+    assert merge(rows, existing, is_incremental=True) == {(1, "1__0", 3), (2, "2__0", 1)}
+
+
+def test_full_merge_replaces_the_table():
+    existing = [(1, "1__0", 1), (2, "2__0", 1)]
+    assert merge([(3, "3__0", 2)], existing, is_incremental=False) == {(3, "3__0", 2)}